@@ -0,0 +1,271 @@
+"""
+塔罗占卜流程基准测试
+对完整占卜流程或API接口计时，配合LLM cassette可以在没有网络的情况下得到稳定、可对比的结果
+
+先用真实提供商录制：python benchmark.py --record cassettes/bench.jsonl --reading both
+之后离线回放：      python benchmark.py --replay cassettes/bench.jsonl --output bench.json
+与上一版本对比：    python benchmark.py --replay cassettes/bench.jsonl --baseline bench.json
+对比解读+建议的两次调用和合并调用：python benchmark.py --replay cassettes/bench.jsonl --reading both
+流程编排本身的开销（不调用LLM）：python benchmark.py --target orchestration
+简化占卜依次运行与按依赖并发运行：python benchmark.py --target simple，再用 --target dag 对比
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import warnings
+from typing import Any, Callable, Dict, List
+
+from utils.call_llm import (
+    set_cassette, set_response_cache, get_llm_cassette_stats, get_llm_limiter_stats, get_llm_usage_stats
+)
+from macore import Node, Flow, get_trace_stats
+from utils.llm_cassette import Cassette
+from utils.response_templates import get_template_stats
+from utils.node_memo import set_node_memo, get_node_memo_stats
+
+# 基准测试使用的用户选择
+BENCH_TOPIC = "love"
+BENCH_SPREAD = "past_present_future"
+
+def new_shared() -> Dict[str, Any]:
+    """创建一次完整占卜所需的共享存储，用户输入预先填好"""
+    return {
+        "user_session": {
+            "user_id": "benchmark",
+            "current_step": "welcome",
+            "conversation_history": []
+        },
+        "user_input": {"selected_topic": BENCH_TOPIC, "selected_spread": BENCH_SPREAD},
+        "divination": {
+            "topic": None,
+            "spread_type": None,
+            "drawn_cards": [],
+            "interpretation": None,
+            "advice": None,
+            "status": "started"
+        }
+    }
+
+def make_flow_runner(fused_reading: bool) -> Callable[[], None]:
+    """返回用create_tarot_flow()走完一次完整占卜的函数"""
+    from flow import create_tarot_flow
+    
+    def run_flow() -> None:
+        create_tarot_flow(fused_reading=fused_reading).run(new_shared())
+    
+    return run_flow
+
+def make_simple_runner(fused_reading: bool, dag: bool) -> Callable[[], None]:
+    """返回运行一次简化版异步占卜（单张牌）的函数：依次运行（AsyncFlow）或按依赖并发运行（AsyncDAGFlow）"""
+    from flow import create_async_simple_divination_flow, create_async_dag_divination_flow
+    create = create_async_dag_divination_flow if dag else create_async_simple_divination_flow
+    
+    def run_simple() -> None:
+        shared = new_shared()
+        shared["divination"].update({"topic": BENCH_TOPIC, "spread_type": "single"})
+        asyncio.run(create(fused_reading=fused_reading).run_async(shared))
+    
+    return run_simple
+
+def make_api_runner(fused_reading: bool) -> Callable[[], None]:
+    """返回通过API接口走完一次完整占卜的函数"""
+    os.environ["FUSED_READING_ENABLED"] = "true" if fused_reading else "false"
+    from fastapi.testclient import TestClient
+    import main
+    
+    client = TestClient(main.app)
+    client.__enter__()
+    
+    def run_api() -> None:
+        response = client.post("/api/v1/divination/start", json={"user_id": "benchmark"})
+        response.raise_for_status()
+        session_id = response.json()["session_id"]
+        steps = [
+            ("select_topic", {"topic": BENCH_TOPIC}),
+            ("select_spread", {"spread": BENCH_SPREAD}),
+            ("draw_cards", {}),
+            ("get_interpretation", {}),
+            ("get_advice", {})
+        ]
+        for step, data in steps:
+            response = client.post("/api/v1/divination/step",
+                                   json={"session_id": session_id, "step": step, "data": data})
+            response.raise_for_status()
+    
+    return run_api
+
+# 编排基准中流程的节点数
+ORCHESTRATION_STEPS = 50
+
+class NoopNode(Node):
+    """什么都不做的节点，只用来测量流程编排的开销"""
+    
+    def post(self, shared, prep_res, exec_res):
+        return "next"
+
+def make_orchestration_runner(compiled: bool) -> Callable[[], None]:
+    """返回把ORCHESTRATION_STEPS个空节点串成的流程运行一次的函数"""
+    nodes = [NoopNode() for _ in range(ORCHESTRATION_STEPS)]
+    for node, successor in zip(nodes, nodes[1:]):
+        node - "next" >> successor
+    flow = Flow(start=nodes[0])
+    if compiled:
+        flow.compile()
+    
+    def run_flow() -> None:
+        flow.run({})
+    
+    return run_flow
+
+def run_orchestration_benchmark(mode: str, runs: int) -> Dict[str, Any]:
+    """
+    测量编排开销：逐步复制节点（copy）与编译后的流程（compiled）
+    
+    Args:
+        mode: copy或compiled
+        runs: 运行次数，每次运行ORCHESTRATION_STEPS步
+    
+    Returns:
+        Dict: 与run_benchmark相同的结构，summary中另有每步的平均微秒数
+    """
+    runner = make_orchestration_runner(mode == "compiled")
+    runner()
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        runner()
+        latencies.append(time.perf_counter() - start)
+    summary = summarize(latencies)
+    summary["llm_calls_per_run"] = 0.0
+    summary["us_per_step"] = summary["mean"] / ORCHESTRATION_STEPS * 1e6
+    return {"target": "orchestration", "reading": mode, "seed": None, "summary": summary, "latencies": latencies}
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "runs": len(ordered),
+        "mean": statistics.mean(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+        "max": ordered[-1]
+    }
+
+def llm_calls() -> int:
+    # 限流器发放的名额数即实际发出的LLM请求数
+    return sum(stats["granted"] for stats in get_llm_limiter_stats().values())
+
+def run_benchmark(target: str, reading: str, runs: int, seed: int) -> Dict[str, Any]:
+    """
+    运行基准测试
+    
+    Args:
+        target: flow、api、simple或dag
+        reading: two-call（解读、建议分两次调用）或fused（合并为一次调用）
+        runs: 运行次数
+        seed: 抽牌随机种子
+    
+    Returns:
+        Dict: 延迟汇总、每次延迟和平均每次占卜的LLM调用数
+    """
+    fused = reading == "fused"
+    if target == "flow":
+        runner = make_flow_runner(fused)
+    elif target == "api":
+        runner = make_api_runner(fused)
+    else:
+        runner = make_simple_runner(fused, dag=target == "dag")
+    calls_before = llm_calls()
+    latencies = []
+    for i in range(runs):
+        # 每次运行使用固定种子，保证抽到的牌（进而提示词）与录制时一致
+        random.seed(seed + i)
+        start = time.perf_counter()
+        runner()
+        latencies.append(time.perf_counter() - start)
+    summary = summarize(latencies)
+    summary["llm_calls_per_run"] = (llm_calls() - calls_before) / runs
+    return {"target": target, "reading": reading, "seed": seed, "summary": summary, "latencies": latencies}
+
+def print_summary(result: Dict[str, Any]) -> None:
+    summary = result["summary"]
+    print(f"{result['target']}/{result['reading']}: {summary['runs']}次  mean {summary['mean']:.3f}s  "
+          f"p50 {summary['p50']:.3f}s  p95 {summary['p95']:.3f}s  max {summary['max']:.3f}s  "
+          f"LLM调用 {summary['llm_calls_per_run']:.1f}次/占卜")
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> bool:
+    """打印与基线中相同解读方式的对比，p50或p95变慢超过tolerance时返回False"""
+    ok = True
+    for reading, result in report["results"].items():
+        if reading not in baseline["results"]:
+            continue
+        print(f"  {reading}:")
+        for metric in ("p50", "p95"):
+            old, new = baseline["results"][reading]["summary"][metric], result["summary"][metric]
+            change = (new - old) / old if old else 0.0
+            regressed = change > tolerance
+            ok = ok and not regressed
+            print(f"    {metric}: {old:.3f}s -> {new:.3f}s ({change:+.1%}){'  <-- 退化' if regressed else ''}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="塔罗占卜流程基准测试")
+    parser.add_argument("--target", choices=["flow", "api", "simple", "dag", "orchestration"],
+                        default="flow", help="测试完整流程、API接口、简化占卜（依次或按依赖并发运行），或只测流程编排的开销")
+    parser.add_argument("--reading", choices=["two-call", "fused", "both"], default="two-call",
+                        help="解读和建议分两次调用、合并为一次调用，或两者都测并对比")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42, help="抽牌随机种子，录制和回放需一致")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--record", metavar="PATH", help="录制真实提供商的回复到cassette")
+    group.add_argument("--replay", metavar="PATH", help="从cassette回放，不访问网络")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速度倍数，0表示不等待")
+    parser.add_argument("--output", metavar="PATH", help="把结果写入JSON文件")
+    parser.add_argument("--baseline", metavar="PATH", help="与之前的结果对比")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="允许的变慢比例")
+    args = parser.parse_args()
+    
+    warnings.filterwarnings("ignore")
+    # 关闭响应缓存和节点记忆，每次运行都完整经过LLM调用
+    set_response_cache(None)
+    set_node_memo(None)
+    if args.record or args.replay:
+        set_cassette(Cassette(args.record or args.replay, "record" if args.record else "replay", args.speed))
+    
+    if args.target == "orchestration":
+        results = [run_orchestration_benchmark(mode, args.runs) for mode in ("copy", "compiled")]
+        for result in results:
+            summary = result["summary"]
+            print(f"orchestration/{result['reading']}: {summary['runs']}次 x {ORCHESTRATION_STEPS}步  "
+                  f"每步 mean {summary['us_per_step']:.2f}µs  p95 {summary['p95'] / ORCHESTRATION_STEPS * 1e6:.2f}µs")
+    else:
+        readings = ["two-call", "fused"] if args.reading == "both" else [args.reading]
+        results = [run_benchmark(args.target, reading, args.runs, args.seed) for reading in readings]
+        for result in results:
+            print_summary(result)
+    if args.target != "orchestration" and len(results) == 2:
+        two_call, fused = results[0]["summary"], results[1]["summary"]
+        print(f"合并调用相对两次调用：p50 {fused['p50'] / two_call['p50'] - 1:+.1%}  "
+              f"p95 {fused['p95'] / two_call['p95'] - 1:+.1%}")
+    
+    report = {"results": {result["reading"]: result for result in results}, "cassette": get_llm_cassette_stats(),
+              "usage": get_llm_usage_stats(), "templates": get_template_stats(),
+              "node_memo": get_node_memo_stats(),
+              "tracing": get_trace_stats()}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"与基线 {args.baseline} 对比：")
+        if not compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -3,17 +3,34 @@
 连接各个节点构建完整的占卜流程
 """
 
-from macore import Flow
+from macore import Flow, AsyncFlow, AsyncDAGFlow
 from nodes import (
     WelcomeNode, TopicSelectionNode, ProcessTopicNode,
     SpreadSelectionNode, ProcessSpreadNode, CardDrawingNode,
-    InterpretationNode, AdviceNode
+    InterpretationNode, AdviceNode, FusedReadingNode,
+    AsyncWelcomeNode, AsyncTopicSelectionNode, AsyncProcessTopicNode,
+    AsyncSpreadSelectionNode, AsyncProcessSpreadNode, AsyncCardDrawingNode,
+    AsyncInterpretationNode, AsyncAdviceNode, AsyncFusedReadingNode,
+    AsyncDrawCardsNode, AsyncDrawMessageNode, DrawSimulationNode
 )
 
-def create_tarot_flow():
+def _connect_reading(card_drawing, fused_reading, use_async=False):
+    """在抽牌节点之后接上解读和建议：分两个节点，或合并为一个节点"""
+    if fused_reading:
+        card_drawing - "interpretation" >> (AsyncFusedReadingNode() if use_async else FusedReadingNode())
+        return
+    interpretation = AsyncInterpretationNode() if use_async else InterpretationNode()
+    advice = AsyncAdviceNode() if use_async else AdviceNode()
+    card_drawing - "interpretation" >> interpretation
+    interpretation - "advice" >> advice
+
+def create_tarot_flow(fused_reading=False):
     """
     创建塔罗占卜的完整流程
     
+    Args:
+        fused_reading: 是否用一次LLM调用同时生成解读和建议（FusedReadingNode）
+    
     Returns:
         Flow: 配置好的塔罗占卜流程
     """
@@ -24,8 +41,6 @@ def create_tarot_flow():
     spread_selection = SpreadSelectionNode()
     process_spread = ProcessSpreadNode()
     card_drawing = CardDrawingNode()
-    interpretation = InterpretationNode()
-    advice = AdviceNode()
     
     # 连接节点流程
     # 欢迎 -> 主题选择
@@ -45,34 +60,111 @@ def create_tarot_flow():
     process_spread - "drawing_cards" >> card_drawing
     process_spread - "spread_selection" >> spread_selection
     
-    # 抽牌 -> 解读
-    card_drawing - "interpretation" >> interpretation
-    
-    # 解读 -> 建议
-    interpretation - "advice" >> advice
+    # 抽牌 -> 解读 -> 建议
+    _connect_reading(card_drawing, fused_reading)
     
-    # 创建并返回流程，从欢迎节点开始
-    return Flow(start=welcome)
+    # 创建并返回流程，从欢迎节点开始；编译时检查流程图，运行时不再逐步复制节点
+    return Flow(start=welcome).compile()
 
-def create_simple_divination_flow():
+def create_simple_divination_flow(fused_reading=False):
     """
     创建简化版占卜流程（用于测试）
     直接进行单张牌占卜
     
+    Args:
+        fused_reading: 是否用一次LLM调用同时生成解读和建议
+    
     Returns:
         Flow: 简化的占卜流程
     """
     # 只包含核心节点
     card_drawing = CardDrawingNode()
-    interpretation = InterpretationNode()
-    advice = AdviceNode()
+    _connect_reading(card_drawing, fused_reading)
     
-    # 简单连接
-    card_drawing - "interpretation" >> interpretation
-    interpretation - "advice" >> advice
+    return Flow(start=card_drawing).compile()
+
+# API在这些action之后暂停流程，等待用户的下一个请求：选择主题、选择牌阵、抽牌、查看解读、查看建议
+API_SUSPEND_ACTIONS = ("waiting_topic", "waiting_spread", "drawing_cards", "interpretation", "advice")
+
+def create_async_tarot_flow(fused_reading=False, suspend_on=()):
+    """
+    创建塔罗占卜完整流程的异步版本，节点的LLM调用不会阻塞事件循环
+    
+    Args:
+        fused_reading: 是否用一次LLM调用同时生成解读和建议
+        suspend_on: 运行到这些action时暂停，之后用resume_async从Checkpoint继续
+    
+    Returns:
+        AsyncFlow: 配置好的异步塔罗占卜流程
+    """
+    welcome = AsyncWelcomeNode()
+    topic_selection = AsyncTopicSelectionNode()
+    process_topic = AsyncProcessTopicNode()
+    spread_selection = AsyncSpreadSelectionNode()
+    process_spread = AsyncProcessSpreadNode()
+    card_drawing = AsyncCardDrawingNode()
     
-    return Flow(start=card_drawing)
+    welcome - "topic_selection" >> topic_selection
+    topic_selection - "waiting_topic" >> process_topic
+    process_topic - "spread_selection" >> spread_selection
+    process_topic - "topic_selection" >> topic_selection
+    spread_selection - "waiting_spread" >> process_spread
+    process_spread - "drawing_cards" >> card_drawing
+    process_spread - "spread_selection" >> spread_selection
+    _connect_reading(card_drawing, fused_reading, use_async=True)
+    
+    return AsyncFlow(start=welcome).compile(suspend_on=suspend_on)
+
+def create_async_simple_divination_flow(fused_reading=False):
+    """
+    创建简化版占卜流程的异步版本
+    
+    Args:
+        fused_reading: 是否用一次LLM调用同时生成解读和建议
+    
+    Returns:
+        AsyncFlow: 简化的异步占卜流程
+    """
+    card_drawing = AsyncCardDrawingNode()
+    _connect_reading(card_drawing, fused_reading, use_async=True)
+    
+    return AsyncFlow(start=card_drawing).compile()
+
+def create_async_dag_divination_flow(fused_reading=False):
+    """
+    创建按依赖并发运行的简化版占卜流程
+    
+    抽牌不调用LLM，抽到牌后抽牌描述和解读同时调用LLM，建议在解读完成后开始；
+    对话历史仍按抽牌描述、解读、建议的顺序写入，结果与依次运行相同。
+    
+    Args:
+        fused_reading: 是否用一次LLM调用同时生成解读和建议
+    
+    Returns:
+        AsyncDAGFlow: 简化的并发占卜流程
+    """
+    draw_cards = AsyncDrawCardsNode()
+    nodes = [draw_cards, AsyncDrawMessageNode()]
+    if fused_reading:
+        nodes.append(AsyncFusedReadingNode())
+    else:
+        nodes += [AsyncInterpretationNode(), AsyncAdviceNode()]
+    # 只连接有分支的边：抽牌返回interpretation后才解读，解读返回advice后才给建议
+    draw_cards - "interpretation" >> nodes[2]
+    if not fused_reading:
+        nodes[2] - "advice" >> nodes[3]
+    
+    return AsyncDAGFlow(nodes).compile()
 
 # 创建流程实例
 tarot_flow = create_tarot_flow()
-simple_flow = create_simple_divination_flow()
\ No newline at end of file
+simple_flow = create_simple_divination_flow()
+
+def create_draw_simulation_flow():
+    """
+    创建抽牌模拟流程，抽牌在进程池中计算
+    
+    Returns:
+        AsyncFlow: 编译好的抽牌模拟流程，可以被并发的请求共用
+    """
+    return AsyncFlow(start=DrawSimulationNode()).compile()
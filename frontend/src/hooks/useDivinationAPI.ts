@@ -30,6 +30,10 @@ export const useStartDivination = () => {
       setCurrentStep(data.next_step || 'topic_selection');
       setProgress(10);
       addMessage('welcome', data.message);
+      // 主题菜单
+      if (typeof data.data?.menu === 'string') {
+        addMessage('topic_selection', data.data.menu);
+      }
       setLoading(false);
     },
     onError: (error: Error) => {
@@ -52,6 +56,10 @@ export const useProcessDivinationStep = () => {
     onSuccess: (data) => {
       setCurrentStep(data.next_step || 'completed');
       addMessage(data.status, data.message);
+      // 选择主题后给出的牌阵菜单（主题无效时为主题菜单）
+      if (typeof data.data?.menu === 'string') {
+        addMessage(data.next_step || data.status, data.data.menu);
+      }
       
       // 根据步骤更新进度
       const progressMap: Record<string, number> = {
@@ -3,12 +3,300 @@
 MACore Framework - MACore Application Framework
 A lightweight framework for building LLM applications with nodes and flows.
 """
-import asyncio, warnings, copy, time
+import asyncio, warnings, copy, time, random, threading, contextvars, contextlib, functools, os, weakref, json, logging, bisect, hashlib, pickle, sqlite3, zlib, multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+class DeadlineExceeded(TimeoutError): pass
+
+class Deadline:
+    """Request-scoped time budget, optionally nested in a parent; cancel() ends it early (e.g. client disconnect)."""
+    POLL=0.05
+    def __init__(self,timeout=None,parent=None):
+        self.expires_at=None if timeout is None else time.monotonic()+timeout
+        self.parent,self.reason,self._cancelled=parent,None,threading.Event()
+    def remaining(self):
+        if self._cancelled.is_set(): return 0.0
+        left=None if self.expires_at is None else max(0.0,self.expires_at-time.monotonic())
+        up=self.parent.remaining() if self.parent else None
+        return left if up is None else up if left is None else min(left,up)
+    def expired(self): r=self.remaining(); return r is not None and r<=0
+    def cancel(self,reason="cancelled"): self.reason=self.reason or reason; self._cancelled.set()
+    def why(self): return self.reason or (self.parent.why() if self.parent else None) or "deadline exceeded"
+    def check(self):
+        if self.expired(): raise DeadlineExceeded(self.why())
+    def sleep(self,seconds):
+        # Only our own cancel wakes the wait, so with a parent wake every POLL seconds to see its cancel too.
+        end=time.monotonic()+seconds
+        while True:
+            self.check(); left,r=end-time.monotonic(),self.remaining()
+            if left<=0: return
+            if r is not None: left=min(left,r)
+            self._cancelled.wait(left if self.parent is None else min(left,self.POLL))
+
+_deadline=contextvars.ContextVar("macore_deadline",default=None)
+def current_deadline(): return _deadline.get()
+
+@contextlib.contextmanager
+def deadline_scope(deadline):
+    """Run nodes under a Deadline, a timeout in seconds (nested in the current deadline), or None (detached)."""
+    if deadline is not None and not isinstance(deadline,Deadline): deadline=Deadline(deadline,_deadline.get())
+    token=_deadline.set(deadline)
+    try: yield deadline
+    finally:
+        try: _deadline.reset(token)
+        except ValueError: pass
+
+def backoff_delay(attempt,wait,max_wait=None):
+    """Full-jitter exponential backoff: uniform in [0, wait*2**attempt], capped at max_wait."""
+    if wait<=0: return 0
+    cap=wait*2**attempt
+    return random.uniform(0,cap if max_wait is None else min(cap,max_wait))
+
+_sync_executor,_sync_executor_lock=None,threading.Lock()
+def get_sync_executor():
+    """Shared bounded pool that AsyncFlow uses for sync nodes; MACORE_SYNC_WORKERS threads (default 16)."""
+    global _sync_executor
+    with _sync_executor_lock:
+        if _sync_executor is None: _sync_executor=ThreadPoolExecutor(int(os.getenv("MACORE_SYNC_WORKERS","16")),thread_name_prefix="macore-sync")
+        return _sync_executor
+def set_sync_executor(executor):
+    global _sync_executor
+    with _sync_executor_lock: _sync_executor=executor
+
+_process_pool,_process_pool_lock=None,threading.Lock()
+def get_process_pool():
+    """Shared pool of ProcessPoolNode/ProcessBatchNode, started on first use (MACORE_PROCESS_WORKERS, default: CPU
+    count; MACORE_PROCESS_START, default: forkserver, or spawn where that is not available)."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # never fork by default: forking the threaded server process can copy held locks into the workers
+            method=os.getenv("MACORE_PROCESS_START") or ("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+            ctx=multiprocessing.get_context(method)
+            _process_pool=ProcessPoolExecutor(int(os.getenv("MACORE_PROCESS_WORKERS","0")) or os.cpu_count() or 1,mp_context=ctx)
+        return _process_pool
+def set_process_pool(pool):
+    global _process_pool
+    with _process_pool_lock: _process_pool=pool
+def shutdown_process_pool(wait=True):
+    """Stop the shared pool if it was started, dropping queued work; get_process_pool() would start a new one."""
+    global _process_pool
+    with _process_pool_lock: pool,_process_pool=_process_pool,None
+    if pool is not None: pool.shutdown(wait=wait,cancel_futures=True)
+def _drop_broken_pool(pool):
+    # a worker died: the shared pool is unusable, the next call starts a new one
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool: _process_pool=None
+
+class FlowValidationError(ValueError): pass
+
+class Span:
+    """Timing of one node/flow run: seconds per phase, exec attempts, the action returned and nested child spans."""
+    __slots__=("name","start","duration","phases","attempts","fallbacks","action","error","children","_tracer","_last","_t0","_token")
+    def __init__(self,node,tracer):
+        self.name,self.start,self.duration,self.phases=type(node).__name__,time.time(),None,{}
+        self.attempts=self.fallbacks=0; self.action=self.error=None; self.children=[]
+        parent=_span.get()
+        if parent is not None: parent.children.append(self)
+        self._tracer=None if parent is not None else tracer
+        self._t0=self._last=time.perf_counter(); self._token=_span.set(self)
+    def mark(self,phase):
+        now=time.perf_counter(); self.phases[phase]=self.phases.get(phase,0.0)+now-self._last; self._last=now
+    def end(self,action=None,error=None):
+        self.duration=time.perf_counter()-self._t0; self.action=action
+        if error is not None: self.error=f"{type(error).__name__}: {error}"
+        _span.reset(self._token)
+        if self._tracer is not None: self._tracer.emit(self)  # root span: the whole tree is done
+        return action
+    def walk(self,depth=0):
+        yield depth,self
+        for c in self.children: yield from c.walk(depth+1)
+    def to_dict(self):
+        return {"name":self.name,"start":self.start,"duration":self.duration,"phases":self.phases,"attempts":self.attempts,
+                "fallbacks":self.fallbacks,"action":self.action,"error":self.error,"children":[c.to_dict() for c in self.children]}
+
+class Tracer:
+    """Hands every finished root span (a full timing tree for one Flow.run) to its sinks; a failing sink only warns."""
+    def __init__(self,*sinks): self.sinks=list(sinks)
+    def emit(self,span):
+        for sink in self.sinks:
+            try: sink.emit(span)
+            except Exception as e: warnings.warn(f"Trace sink {type(sink).__name__} failed: {e}")
+
+class MemorySink:
+    """Per node name: runs, errors, exec attempts/fallbacks and a latency histogram (upper bounds in seconds) per phase."""
+    BUCKETS=(0.001,0.005,0.01,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60)
+    def __init__(self): self._lock,self._nodes=threading.Lock(),{}
+    def emit(self,span):
+        with self._lock:
+            for _,s in span.walk():
+                n=self._nodes.setdefault(s.name,{"runs":0,"errors":0,"attempts":0,"fallbacks":0,"phases":{}})
+                n["runs"]+=1; n["errors"]+=s.error is not None; n["attempts"]+=s.attempts; n["fallbacks"]+=s.fallbacks
+                for phase,sec in (*s.phases.items(),("total",s.duration)):
+                    h=n["phases"].setdefault(phase,[0,0.0,0.0,[0]*(len(self.BUCKETS)+1)])
+                    h[0]+=1; h[1]+=sec; h[2]=max(h[2],sec); h[3][bisect.bisect_left(self.BUCKETS,sec)]+=1
+    def stats(self):
+        with self._lock:
+            return {name:{**{k:v for k,v in n.items() if k!="phases"},"phases":{phase:{"count":c,"mean":t/c,"max":m,
+                    "buckets":{str(le):k for le,k in zip((*self.BUCKETS,"inf"),b) if k}} for phase,(c,t,m,b) in n["phases"].items()}}
+                    for name,n in self._nodes.items()}
+    def reset(self):
+        with self._lock: self._nodes={}
+
+class JSONLSink:
+    """Appends each span tree as one JSON line."""
+    def __init__(self,path): self.path,self._lock=path,threading.Lock()
+    def emit(self,span):
+        line=json.dumps(span.to_dict(),ensure_ascii=False,default=str)
+        with self._lock, open(self.path,"a",encoding="utf-8") as f: f.write(line+"\n")
+
+class LogSink:
+    """Logs each span tree as indented lines: name, duration, phases, attempts, action/error."""
+    def __init__(self,logger="macore.trace",level=logging.INFO):
+        self.logger,self.level=logging.getLogger(logger) if isinstance(logger,str) else logger,level
+    def emit(self,span):
+        if not self.logger.isEnabledFor(self.level): return
+        lines=[]
+        for depth,s in span.walk():
+            phases=" ".join(f"{k}={v*1000:.1f}ms" for k,v in s.phases.items())
+            extra=f" attempts={s.attempts}" if s.attempts>1 or s.fallbacks else ""
+            extra+=f" fallback" if s.fallbacks else ""
+            lines.append(f"{'  '*depth}{s.name} {s.duration*1000:.1f}ms {phases}{extra} -> {s.error or s.action}")
+        self.logger.log(self.level,"\n".join(lines))
+
+def _tracer_from_env():
+    # MACORE_TRACE: comma-separated sinks (memory, jsonl, log); empty disables tracing
+    names=[x.strip() for x in os.getenv("MACORE_TRACE","").lower().split(",") if x.strip()]
+    make={"memory":MemorySink,"jsonl":lambda: JSONLSink(os.getenv("MACORE_TRACE_FILE","macore_trace.jsonl")),"log":LogSink}
+    unknown=[x for x in names if x not in make]
+    if unknown: raise ValueError(f"Unknown MACORE_TRACE sinks: {unknown}. Choose from: {', '.join(make)}")
+    return Tracer(*(make[x]() for x in names)) if names else None
+
+_span=contextvars.ContextVar("macore_span",default=None)
+_tracer=_tracer_from_env()
+def get_tracer(): return _tracer
+def set_tracer(tracer):
+    """Install a Tracer (or None: no spans, the default). Only runs started afterwards are traced."""
+    global _tracer; _tracer=tracer
+def get_trace_stats():
+    t=_tracer
+    if t is None: return {"enabled":False}
+    mem=next((x for x in t.sinks if isinstance(x,MemorySink)),None)
+    return {"enabled":True,"sinks":[type(x).__name__ for x in t.sinks],"nodes":mem.stats() if mem else None}
+def _count_attempt(fallback=False):
+    s=_span.get()
+    if s is not None:
+        if fallback: s.fallbacks+=1
+        else: s.attempts+=1
+
+class MemoCache:
+    """In-process LRU/TTL store for memoized exec results (max_size entries, ttl seconds or None)."""
+    def __init__(self,max_size=256,ttl=None):
+        if max_size<1: raise ValueError("max_size must be at least 1")
+        self.max_size,self.ttl,self._lock,self._entries=max_size,ttl,threading.Lock(),{}
+        self.hits=self.misses=self.evictions=0
+    def get(self,key):
+        """(True, value) on a live hit, (False, None) otherwise."""
+        with self._lock:
+            e=self._entries.pop(key,None)
+            if e is None or (e[1] is not None and e[1]<=time.monotonic()): self.misses+=1; return False,None
+            self._entries[key]=e; self.hits+=1; return True,e[0]
+    def put(self,key,value):
+        with self._lock:
+            self._entries.pop(key,None); self._entries[key]=(value,time.monotonic()+self.ttl if self.ttl else None)
+            while len(self._entries)>self.max_size: del self._entries[next(iter(self._entries))]; self.evictions+=1
+    def clear(self):
+        with self._lock: self._entries.clear(); self.hits=self.misses=self.evictions=0
+    def stats(self):
+        with self._lock:
+            total=self.hits+self.misses
+            return {"backend":"memory","hits":self.hits,"misses":self.misses,"hit_rate":self.hits/total if total else 0.0,
+                    "size":len(self._entries),"max_size":self.max_size,"evictions":self.evictions,"ttl":self.ttl}
+
+class DiskMemoCache(MemoCache):
+    """MemoCache persisted in a SQLite file (values pickled), shared across processes and restarts."""
+    def __init__(self,path,max_size=4096,ttl=None):
+        super().__init__(max_size,ttl); self.path=path
+        self._db=sqlite3.connect(path,check_same_thread=False,isolation_level=None)
+        self._db.execute("CREATE TABLE IF NOT EXISTS memo (key TEXT PRIMARY KEY, value BLOB, expires REAL, used REAL)")
+    def get(self,key):
+        with self._lock:
+            row=self._db.execute("SELECT value, expires FROM memo WHERE key=?",(key,)).fetchone()
+            if row is None or (row[1] is not None and row[1]<=time.time()): self.misses+=1; return False,None
+            self._db.execute("UPDATE memo SET used=? WHERE key=?",(time.time(),key)); self.hits+=1
+            return True,pickle.loads(row[0])
+    def put(self,key,value):
+        with self._lock:
+            now=time.time()
+            self._db.execute("INSERT OR REPLACE INTO memo VALUES (?,?,?,?)",(key,pickle.dumps(value),now+self.ttl if self.ttl else None,now))
+            extra=self._db.execute("SELECT COUNT(*) FROM memo").fetchone()[0]-self.max_size
+            if extra>0:
+                self._db.execute("DELETE FROM memo WHERE key IN (SELECT key FROM memo ORDER BY used LIMIT ?)",(extra,)); self.evictions+=extra
+    def clear(self):
+        with self._lock: self._db.execute("DELETE FROM memo"); self.hits=self.misses=self.evictions=0
+    def stats(self):
+        with self._lock: size=self._db.execute("SELECT COUNT(*) FROM memo").fetchone()[0]
+        return {**super().stats(),"backend":"disk","path":self.path,"size":size}
+
+def _memo_key(node,prep_res):
+    # stable digest of the node class and its memo_key data; None (not cached) if memo_key returns None or not JSON
+    try:
+        data=node.memo_key(prep_res)
+        if data is None: return None
+        data=json.dumps(data,sort_keys=True,ensure_ascii=False,separators=(",",":"))
+    except (TypeError,ValueError): return None
+    return hashlib.sha256(f"{type(node).__module__}.{type(node).__qualname__}\x1f{data}".encode()).hexdigest()
+
+def _traced(run):
+    # flows: one span around prep/orchestration/post, child node spans nest under it
+    @functools.wraps(run)
+    def wrapper(self,shared,*args):
+        t=_tracer
+        if t is None: return run(self,shared,*args)
+        s=Span(self,t)
+        try: a=run(self,shared,*args)
+        except BaseException as e: s.end(error=e); raise
+        return s.end(a)
+    return wrapper
+def _traced_async(run):
+    @functools.wraps(run)
+    async def wrapper(self,shared,*args):
+        t=_tracer
+        if t is None: return await run(self,shared,*args)
+        s=Span(self,t)
+        try: a=await run(self,shared,*args)
+        except BaseException as e: s.end(error=e); raise
+        return s.end(a)
+    return wrapper
+
+class _Run:
+    # per-run node state of a compiled flow: nodes are shared between runs instead of being copied
+    __slots__=("ids","params","retry","hooks")
+    def __init__(self,ids,params,hooks=None): self.ids,self.params,self.retry,self.hooks=ids,params,{},hooks
+_run=contextvars.ContextVar("macore_run",default=None)
+def _phase_hooks(node):
+    # scheduler callbacks between prep/exec/post, only set for nodes of an AsyncDAGFlow run
+    r=_run.get()
+    return r.hooks if r is not None and r.hooks is not None and id(node) in r.ids else None
 
 class BaseNode:
+    executor=None  # per-node override of the pool used when a sync node runs inside AsyncFlow
+    actions=None  # optional tuple of the actions post() can return, checked by Flow.compile()
+    reads=writes=None  # optional dotted shared paths ("divination.drawn_cards") used by AsyncDAGFlow; None = anything
+    memo=None  # a MemoCache: exec results are cached by a hash of memo_key(prep_res), None from it = don't cache
+    memo_fields=None  # prep_res keys exec depends on when memoized; None = the whole prep_res
+    def memo_key(self,prep_res): return prep_res if self.memo_fields is None else {k:prep_res[k] for k in self.memo_fields}
     def __init__(self): 
         self.params = {}
         self.successors = {}
+    @property
+    def params(self):
+        r=_run.get()
+        return r.params if r is not None and id(self) in r.ids else self._params
+    @params.setter
+    def params(self,params): self._params=params
     def set_params(self,params): self.params=params
     def next(self,node,action="default"):
         if action in self.successors: warnings.warn(f"Overwriting successor for action '{action}'")
@@ -17,7 +305,20 @@ class BaseNode:
     def exec(self,prep_res): pass
     def post(self,shared,prep_res,exec_res): pass
     def _exec(self,prep_res): return self.exec(prep_res)
-    def _run(self,shared): p=self.prep(shared); e=self._exec(p); return self.post(shared,p,e)
+    def _run(self,shared):
+        t=_tracer; s=t and Span(self,t)
+        try:
+            p=self.prep(shared); h=_phase_hooks(self)
+            if s: s.mark("prep")
+            if h: h.prepped(self)
+            e=self._exec(p)
+            if s: s.mark("exec")
+            a=self.post(shared,p,e)
+        except BaseException as x:
+            if s: s.end(error=x)
+            raise
+        if s: s.mark("post"); s.end(a)
+        return a
     def run(self,shared): 
         if self.successors: warnings.warn("Node won't run successors. Use Flow.")  
         return self._run(shared)
@@ -31,33 +332,158 @@ class _ConditionalTransition:
     def __rshift__(self,tgt): return self.src.next(tgt,self.action)
 
 class Node(BaseNode):
-    def __init__(self,max_retries=1,wait=0): super().__init__(); self.max_retries,self.wait=max_retries,wait
+    def __init__(self,max_retries=1,wait=0,max_wait=None): super().__init__(); self.max_retries,self.wait,self.max_wait=max_retries,wait,max_wait
+    @property
+    def retry_attempt(self):
+        r=_run.get()
+        return r.retry.get(id(self),0) if r is not None and id(self) in r.ids else self.__dict__.get("_retry_attempt",0)
+    @retry_attempt.setter
+    def retry_attempt(self,attempt):
+        r=_run.get()
+        if r is not None and id(self) in r.ids: r.retry[id(self)]=attempt
+        else: self._retry_attempt=attempt
     def exec_fallback(self,prep_res,exc): raise exc
+    def _retry_delay(self,deadline):
+        # None: stop retrying, the remaining budget cannot cover the backoff
+        delay=backoff_delay(self.retry_attempt,self.wait,self.max_wait)
+        if deadline is None: return delay
+        r=deadline.remaining()
+        return None if r is not None and r<=delay else delay
     def _exec(self,prep_res):
+        memo=self.memo; key=memo is not None and _memo_key(self,prep_res)
+        if key:
+            hit,v=memo.get(key)
+            if hit: return v
+        deadline=current_deadline()
         for self.retry_attempt in range(self.max_retries):
-            try: return self.exec(prep_res)
+            if deadline: deadline.check()
+            if _tracer: _count_attempt()
+            try: r=self.exec(prep_res)
             except Exception as e:
-                if self.retry_attempt==self.max_retries-1: return self.exec_fallback(prep_res,e)
-                if self.wait>0: time.sleep(self.wait)
+                delay=None if isinstance(e,DeadlineExceeded) else self._retry_delay(deadline)
+                if self.retry_attempt==self.max_retries-1 or delay is None:
+                    if _tracer: _count_attempt(fallback=True)
+                    return self.exec_fallback(prep_res,e)
+                if delay>0: deadline.sleep(delay) if deadline else time.sleep(delay)
+            else:
+                if key: memo.put(key,r)  # fallback results are never memoized
+                return r
 
 class BatchNode(Node):
     def _exec(self,items): return [super(BatchNode,self)._exec(i) for i in (items or [])]
 
+def _check_graph(nodes,index):
+    """Problems in a flow graph: declared actions without a successor, unreachable nodes, cycles without an exit."""
+    problems,names=[],[f"{type(n).__name__}#{i}" for i,n in enumerate(nodes)]
+    edges=[]
+    for i,n in enumerate(nodes):
+        acts=list(n.successors) if n.actions is None else [a or "default" for a in n.actions]
+        if n.actions is not None and n.successors:
+            problems+=[f"{names[i]} has no successor for action '{a}'" for a in acts if a not in n.successors]
+        edges.append([index[id(n.successors[a])] for a in acts if a in n.successors])
+    seen,stack=set(),[0]
+    while stack:
+        i=stack.pop()
+        if i not in seen: seen.add(i); stack.extend(edges[i])
+    problems+=[f"{names[i]} is unreachable from {names[0]}" for i in range(len(nodes)) if i not in seen]
+    # a node can end the flow if it has no successors or may return an action without one
+    exits={i for i,n in enumerate(nodes) if not n.successors or n.actions is None or len(edges[i])<len(n.actions)}
+    changed=True
+    while changed:
+        changed=False
+        for i in seen-exits:
+            if any(j in exits for j in edges[i]): exits.add(i); changed=True
+    problems+=[f"{names[i]} is in a cycle with no exit" for i in sorted(seen-exits)]
+    return problems
+
+class Checkpoint:
+    """
+    Where a suspended run of a compiled flow stopped: the plan index of the node to run next (None when the
+    run finished), the action that stopped it, the shared store and the flow's graph signature.
+    dumps()/loads() give a compact record (zlib-compressed JSON, so shared must be JSON-serialisable).
+    """
+    __slots__=("node","action","shared","signature")
+    def __init__(self,node,action,shared,signature): self.node,self.action,self.shared,self.signature=node,action,shared,signature
+    @property
+    def done(self): return self.node is None
+    def dumps(self):
+        return zlib.compress(json.dumps([self.signature,self.node,self.action,self.shared],ensure_ascii=False,separators=(",",":")).encode())
+    @classmethod
+    def loads(cls,data): sig,node,action,shared=json.loads(zlib.decompress(data)); return cls(node,action,shared,sig)
+    def __repr__(self): return f"Checkpoint(node={self.node}, action={self.action!r})"
+
 class Flow(BaseNode):
-    def __init__(self,start=None): super().__init__(); self.start_node=start
-    def start(self,start): self.start_node=start; return start
+    suspend_on=frozenset()  # actions after which a compiled run stops, to be resumed later from a Checkpoint
+    def __init__(self,start=None): super().__init__(); self.start_node=start; self._plan=None
+    def start(self,start): self.start_node=start; self._plan=None; return start
+    def compile(self,suspend_on=None):
+        """
+        Validate the graph once and build a flat dispatch table. Compiled runs reuse the node objects
+        (per-run params/retry state lives in a context variable) instead of copying every node at
+        every step. Recompile after changing the graph. A run stops after a node returns one of the
+        suspend_on actions; run_until_suspended()/resume() hand out and continue from Checkpoints.
+        """
+        if suspend_on is not None: self.suspend_on=frozenset(suspend_on)
+        nodes,index,stack=[],{},[self.start_node]
+        while stack:
+            n=stack.pop()
+            if n is None or id(n) in index: continue
+            index[id(n)]=len(nodes); nodes.append(n); stack.extend(reversed(list(n.successors.values())))
+        if not nodes: raise FlowValidationError("Flow has no start node")
+        problems=_check_graph(nodes,index)
+        if problems: raise FlowValidationError("; ".join(problems))
+        self._ids=frozenset(index)
+        self._plan=[(n,isinstance(n,AsyncNode),{a:index[id(t)] for a,t in n.successors.items()}) for n in nodes]
+        graph=";".join(f"{type(n).__name__}:{sorted(succ.items())}" for n,_,succ in self._plan)
+        self._signature=hashlib.sha256(graph.encode()).hexdigest()[:16]
+        return self
+    def node_at(self,checkpoint):
+        """The node a Checkpoint resumes at, None if its run finished."""
+        return None if checkpoint.node is None else self._plan[checkpoint.node][0]
+    def _planned(self):
+        if self._plan is None: self.compile()
+        if self._plan is None: raise FlowValidationError(f"{type(self).__name__} does not support checkpoints")
+    def _resumable(self,checkpoint,updates):
+        if self._plan is None: raise FlowValidationError("Checkpoints need a compiled flow")
+        if checkpoint.signature!=self._signature: raise FlowValidationError("Checkpoint was taken on a different flow graph")
+        if checkpoint.node is None: raise FlowValidationError("Checkpointed run already finished")
+        if updates: checkpoint.shared.update(updates)
+        return checkpoint.shared
+    def run_until_suspended(self,shared):
+        self._planned()
+        return self._segment(shared,0)
+    def resume(self,checkpoint,updates=None):
+        """Continue a suspended run; updates (e.g. new user input) are merged into shared first."""
+        return self._segment(self._resumable(checkpoint,updates),checkpoint.node)
+    @_traced
+    def _segment(self,shared,at):
+        a,i=self._orch_compiled(shared,None,at)
+        return Checkpoint(i,a,shared,self._signature)
     def get_next_node(self,curr,action):
         nxt=curr.successors.get(action or "default")
         if not nxt and curr.successors: warnings.warn(f"Flow ends: '{action}' not found in {list(curr.successors)}")
         return nxt
     def _orch(self,shared,params=None):
+        if self._plan is not None: return self._orch_compiled(shared,params)[0]
         curr,p,last_action =copy.copy(self.start_node),(params or {**self.params}),None
         while curr: curr.set_params(p); last_action=curr._run(shared); curr=copy.copy(self.get_next_node(curr,last_action))
         return last_action
+    def _orch_compiled(self,shared,params=None,at=0):
+        # -> (last action, plan index to resume at if a suspend_on action stopped the run, else None)
+        plan,i,last_action,suspend=self._plan,at,None,self.suspend_on
+        token=_run.set(_Run(self._ids,params or {**self.params}))
+        try:
+            while i is not None:
+                node,_,succ=plan[i]; last_action=node._run(shared); i=succ.get(last_action or "default")
+                if i is not None and last_action in suspend: break
+            return last_action,i
+        finally: _run.reset(token)
+    @_traced
     def _run(self,shared): p=self.prep(shared); o=self._orch(shared); return self.post(shared,p,o)
     def post(self,shared,prep_res,exec_res): return exec_res
 
 class BatchFlow(Flow):
+    @_traced
     def _run(self,shared):
         pr=self.prep(shared) or []
         for bp in pr: self._orch(shared,{**self.params,**bp})
@@ -69,15 +495,44 @@ class AsyncNode(Node):
     async def exec_fallback_async(self,prep_res,exc): raise exc
     async def post_async(self,shared,prep_res,exec_res): pass
     async def _exec(self,prep_res): 
+        memo=self.memo; key=memo is not None and _memo_key(self,prep_res)
+        if key:
+            hit,v=memo.get(key)
+            if hit: return v
+        deadline=current_deadline()
         for self.retry_attempt in range(self.max_retries):
-            try: return await self.exec_async(prep_res)
+            if deadline: deadline.check()
+            if _tracer: _count_attempt()
+            try: r=await self.exec_async(prep_res)
             except Exception as e:
-                if self.retry_attempt==self.max_retries-1: return await self.exec_fallback_async(prep_res,e)
-                if self.wait>0: await asyncio.sleep(self.wait)
+                delay=None if isinstance(e,DeadlineExceeded) else self._retry_delay(deadline)
+                if self.retry_attempt==self.max_retries-1 or delay is None:
+                    if _tracer: _count_attempt(fallback=True)
+                    return await self.exec_fallback_async(prep_res,e)
+                if delay>0: await asyncio.sleep(delay)
+            else:
+                if key: memo.put(key,r)
+                return r
     async def run_async(self,shared): 
         if self.successors: warnings.warn("Node won't run successors. Use AsyncFlow.")  
         return await self._run_async(shared)
-    async def _run_async(self,shared): p=await self.prep_async(shared); e=await self._exec(p); return await self.post_async(shared,p,e)
+    async def _run_async(self,shared):
+        t=_tracer; s=t and Span(self,t)
+        try:
+            p=await self.prep_async(shared); h=_phase_hooks(self)
+            if s: s.mark("prep")
+            if h: h.prepped(self)
+            e=await self._exec(p)
+            if s: s.mark("exec")
+            if h:
+                await h.wait_post(self)
+                if s: s.mark("wait")
+            a=await self.post_async(shared,p,e)
+        except BaseException as x:
+            if s: s.end(error=x)
+            raise
+        if s: s.mark("post"); s.end(a)
+        return a
     def _run(self,shared): raise RuntimeError("Use run_async.")
 
 class AsyncBatchNode(AsyncNode,BatchNode):
@@ -88,35 +543,292 @@ class AsyncBatchNode(AsyncNode,BatchNode):
             results.append(result)
         return results
 
+async def _as_completed(run,items,limit=None,isolate=False):
+    """
+    Yield (index, item, result) as each run(item) finishes, with at most `limit` in flight. Items are pulled
+    lazily, so a generator of any length runs in O(limit) memory. isolate=True yields a failed item's exception
+    as its result instead of raising; a DeadlineExceeded always aborts. Unfinished runs are cancelled on exit.
+    """
+    it,pending=enumerate(items),{}
+    def fill():
+        while not limit or len(pending)<limit:
+            nxt=next(it,None)
+            if nxt is None: return
+            pending[asyncio.ensure_future(run(nxt[1]))]=nxt
+    try:
+        fill()
+        while pending:
+            done,_=await asyncio.wait(pending,return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                i,item=pending.pop(t); e=t.exception()
+                if e is not None and (not isolate or isinstance(e,DeadlineExceeded) or not isinstance(e,Exception)): raise e
+                yield i,item,(e if e is not None else t.result())
+            fill()
+    finally:
+        for t in pending: t.cancel()
+
 class AsyncParallelBatchNode(AsyncNode,BatchNode):
+    """
+    Runs exec for all items concurrently, at most max_concurrency at a time (None: unbounded). Results are in
+    item order; with as_completed=True they are not buffered: item_done_async gets each as it finishes and
+    exec returns None. isolate_failures=True makes a failing item (after retries/fallback) produce its exception.
+    """
+    def __init__(self,max_retries=1,wait=0,max_wait=None,max_concurrency=None,as_completed=False,isolate_failures=False):
+        super().__init__(max_retries,wait,max_wait); self.max_concurrency,self.as_completed,self.isolate_failures=max_concurrency,as_completed,isolate_failures
+    async def item_done_async(self,index,item,result): pass
+    def exec_as_completed(self,items):
+        """Async iterator of (index, item, result) in completion order, for callers that consume results directly."""
+        return _as_completed(super(AsyncParallelBatchNode,self)._exec,items or (),self.max_concurrency,self.isolate_failures)
     async def _exec(self,items): 
-        if not items:
+        if not items and not self.as_completed:
             return []
-        return await asyncio.gather(*(super(AsyncParallelBatchNode,self)._exec(i) for i in items))
+        results={}
+        async for i,item,r in self.exec_as_completed(items):
+            if self.as_completed: await self.item_done_async(i,item,r)
+            else: results[i]=r
+        return None if self.as_completed else [results[i] for i in range(len(results))]
+
+_PARENT_ONLY=frozenset(("successors","memo","executor","pool","_retry_attempt"))
+def _process_exec(payload):
+    # worker side: rebuild the node without its graph and run exec on one item, or on each item of a chunk
+    cls,state,arg,chunk=pickle.loads(payload)
+    node=cls.__new__(cls); node.__dict__.update(state); node.successors={}
+    if not chunk: return node.exec(arg)
+    out=[]
+    for item in arg:
+        try: out.append((True,node.exec(item)))
+        except Exception as e: out.append((False,e))
+    return out
+
+class ProcessPoolNode(AsyncNode):
+    """
+    Runs the sync exec in a worker process (pool, default: the shared get_process_pool()) so CPU-bound work
+    neither holds the GIL nor blocks the loop; prep/post and exec_fallback run in the caller. exec sees the
+    node's attributes and the run's params, pickled with prep_res. timeout bounds each exec call, and so does
+    the current Deadline; a timed-out call that already started keeps its worker busy until it returns.
+    """
+    pool=None
+    def __init__(self,max_retries=1,wait=0,max_wait=None,timeout=None):
+        super().__init__(max_retries,wait,max_wait); self.timeout=timeout
+    def _payload(self,arg,chunk):
+        state={k:v for k,v in self.__dict__.items() if k not in _PARENT_ONLY}; state["_params"]=self.params
+        try: return pickle.dumps((type(self),state,arg,chunk),pickle.HIGHEST_PROTOCOL)
+        except Exception as e: raise TypeError(f"{type(self).__name__} cannot be sent to a worker process, prep_res and node attributes must be picklable: {e}") from e
+    async def _submit(self,payload):
+        pool=self.pool or get_process_pool(); deadline=current_deadline(); t=self.timeout
+        r=deadline.remaining() if deadline else None
+        if r is not None: t=r if t is None else min(t,r)
+        try: return await asyncio.wait_for(asyncio.wrap_future(pool.submit(_process_exec,payload)),t)
+        except asyncio.TimeoutError:
+            if deadline: deadline.check()
+            raise TimeoutError(f"{type(self).__name__}.exec took longer than {self.timeout}s") from None
+        except BrokenProcessPool: _drop_broken_pool(pool); raise
+    async def exec_async(self,prep_res): return await self._submit(self._payload(prep_res,False))
+    async def exec_fallback_async(self,prep_res,exc): return self.exec_fallback(prep_res,exc)
+
+class ProcessBatchNode(ProcessPoolNode,BatchNode):
+    """
+    ProcessPoolNode over a list of items, sent to the workers in chunks of chunk_size items (default: about four
+    chunks per CPU), at most max_concurrency chunks in flight. timeout applies per chunk. An item that fails in
+    its chunk is retried on its own with the node's retry policy, then falls back; results are in item order.
+    """
+    def __init__(self,max_retries=1,wait=0,max_wait=None,timeout=None,chunk_size=None,max_concurrency=None):
+        super().__init__(max_retries,wait,max_wait,timeout); self.chunk_size,self.max_concurrency=chunk_size,max_concurrency
+    async def _settle(self,item,key,exc):
+        # the chunk was the first attempt: the remaining attempts run one item per call
+        deadline=current_deadline()
+        for attempt in range(1,self.max_retries):
+            self.retry_attempt=attempt-1
+            delay=None if isinstance(exc,DeadlineExceeded) else self._retry_delay(deadline)
+            if delay is None: break
+            if delay>0: await asyncio.sleep(delay)
+            self.retry_attempt=attempt
+            if deadline: deadline.check()
+            if _tracer: _count_attempt()
+            try: r=await self.exec_async(item)
+            except Exception as e: exc=e
+            else:
+                if key: self.memo.put(key,r)
+                return r
+        if _tracer: _count_attempt(fallback=True)
+        return await self.exec_fallback_async(item,exc)
+    async def _exec(self,items):
+        items=list(items or ()); results=[None]*len(items); todo=[]; memo=self.memo
+        for i,item in enumerate(items):
+            key=memo is not None and _memo_key(self,item)
+            if key:
+                hit,v=memo.get(key)
+                if hit: results[i]=v; continue
+            todo.append((i,item,key))
+        size=self.chunk_size or max(1,-(-len(todo)//(4*(os.cpu_count() or 1))))
+        deadline=current_deadline()
+        async def run(chunk):
+            if deadline: deadline.check()
+            if _tracer:
+                for _ in chunk: _count_attempt()
+            try: return await self._submit(self._payload([item for _,item,_ in chunk],True))
+            except DeadlineExceeded: raise
+            except Exception as e: return [(False,e)]*len(chunk)
+        chunks=(todo[j:j+size] for j in range(0,len(todo),size))
+        async for _,chunk,outs in _as_completed(run,chunks,self.max_concurrency):
+            for (i,item,key),(ok,r) in zip(chunk,outs):
+                if not ok: r=await self._settle(item,key,r)
+                elif key: memo.put(key,r)
+                results[i]=r
+        return results
 
 class AsyncFlow(Flow,AsyncNode):
+    def __init__(self,start=None,executor=None,max_concurrency=None):
+        super().__init__(start); self.executor,self.max_concurrency,self._limits=executor,max_concurrency,weakref.WeakKeyDictionary()
+    async def _run_sync(self,node,shared):
+        # sync nodes (and nested sync flows) run in a thread with the caller's context (deadline etc.), not on the loop
+        loop=asyncio.get_running_loop()
+        call=functools.partial(contextvars.copy_context().run,node._run,shared)
+        executor=node.executor or self.executor or get_sync_executor()
+        if not self.max_concurrency: return await loop.run_in_executor(executor,call)
+        limit=self._limits.get(loop)
+        if limit is None: limit=self._limits[loop]=asyncio.Semaphore(self.max_concurrency)
+        async with limit: return await loop.run_in_executor(executor,call)
     async def _orch_async(self,shared,params=None):
+        if self._plan is not None: return (await self._orch_compiled_async(shared,params))[0]
         curr,p,last_action =copy.copy(self.start_node),(params or {**self.params}),None
-        while curr: curr.set_params(p); last_action=await curr._run_async(shared) if isinstance(curr,AsyncNode) else curr._run(shared); curr=copy.copy(self.get_next_node(curr,last_action))
+        while curr: curr.set_params(p); last_action=await curr._run_async(shared) if isinstance(curr,AsyncNode) else await self._run_sync(curr,shared); curr=copy.copy(self.get_next_node(curr,last_action))
         return last_action
+    async def _orch_compiled_async(self,shared,params=None,at=0):
+        plan,i,last_action,suspend=self._plan,at,None,self.suspend_on
+        token=_run.set(_Run(self._ids,params or {**self.params}))
+        try:
+            while i is not None:
+                node,is_async,succ=plan[i]
+                last_action=await node._run_async(shared) if is_async else await self._run_sync(node,shared)
+                i=succ.get(last_action or "default")
+                if i is not None and last_action in suspend: break
+            return last_action,i
+        finally: _run.reset(token)
+    async def run_until_suspended_async(self,shared):
+        self._planned()
+        return await self._segment_async(shared,0)
+    async def resume_async(self,checkpoint,updates=None):
+        return await self._segment_async(self._resumable(checkpoint,updates),checkpoint.node)
+    @_traced_async
+    async def _segment_async(self,shared,at):
+        a,i=await self._orch_compiled_async(shared,None,at)
+        return Checkpoint(i,a,shared,self._signature)
+    @_traced_async
     async def _run_async(self,shared): p=await self.prep_async(shared); o=await self._orch_async(shared); return await self.post_async(shared,p,o)
     async def post_async(self,shared,prep_res,exec_res): return exec_res
 
+def _touches(a,b):
+    # dotted paths overlap when equal or nested; None (undeclared) overlaps anything non-empty
+    if a is None or b is None: return (a is None or bool(a)) and (b is None or bool(b))
+    return any(x==y or x.startswith(y+".") or y.startswith(x+".") for x in a for y in b)
+
+class _DAGRun:
+    """Scheduling state of one AsyncDAGFlow run; nodes report their phases here through _phase_hooks."""
+    def __init__(self,flow):
+        n=len(flow._dag); self.flow,self.loop,self.thread=flow,asyncio.get_running_loop(),threading.get_ident()
+        self.prep_done,self.post_done=[asyncio.Event() for _ in range(n)],[asyncio.Event() for _ in range(n)]
+        self.actions,self.ran=[None]*n,[False]*n
+    def prepped(self,node):
+        e=self.prep_done[self.flow._index[id(node)]]
+        if threading.get_ident()==self.thread: e.set()
+        else: self.loop.call_soon_threadsafe(e.set)
+    async def wait_post(self,node):
+        # post runs after earlier writers of the same paths posted and earlier readers of them prepped
+        step=self.flow._dag[self.flow._index[id(node)]]
+        for j in step.waw: await self.post_done[j].wait()
+        for j in step.war: await self.prep_done[j].wait()
+
+class _DAGStep:
+    __slots__=("node","is_async","phased","raw","waw","war","gates")
+    def __init__(self,node,raw,waw,war,gates):
+        self.node,self.is_async,self.phased=node,isinstance(node,AsyncNode),not isinstance(node,Flow)
+        self.raw,self.waw,self.war,self.gates=raw,waw,war,gates
+
+class AsyncDAGFlow(AsyncFlow):
+    """
+    Runs nodes as a dependency graph instead of a chain. Nodes are listed in program order and declare the
+    shared paths their prep reads and their post writes; a node starts once every earlier writer of what it
+    reads has posted, exec overlaps freely, and post waits for earlier writers/readers of the same paths, so
+    results match running the list in order. Successor edges between listed nodes gate execution: a target
+    runs only if one of its sources returned that action. Async nodes run as tasks, sync ones in the pool;
+    a sync node does its post waits on the loop before it takes a thread (and a max_concurrency permit), so a
+    blocked pool thread never waits for another node.
+    """
+    def __init__(self,nodes=(),executor=None,max_concurrency=None):
+        self.nodes=list(nodes); super().__init__(self.nodes[0] if self.nodes else None,executor,max_concurrency); self._dag=None
+    def compile(self):
+        nodes,problems=self.nodes,[]
+        index={id(n):i for i,n in enumerate(nodes)}
+        names=[f"{type(n).__name__}#{i}" for i,n in enumerate(nodes)]
+        if not nodes: problems.append("DAG flow has no nodes")
+        if len(index)<len(nodes): problems.append("a node is listed more than once")
+        gates=[[] for _ in nodes]
+        for i,n in enumerate(nodes):
+            for a,t in n.successors.items():
+                j=index.get(id(t))
+                if j is None: problems.append(f"{names[i]} successor for '{a}' is not part of the DAG")
+                elif j<=i: problems.append(f"{names[i]} -> {names[j]} for '{a}' points backwards")
+                else: gates[j].append((i,a))
+        if problems: raise FlowValidationError("; ".join(problems))
+        self._dag=[_DAGStep(n,
+            {j for j in range(i) if _touches(nodes[j].writes,n.reads)}|{j for j,_ in gates[i]},
+            [j for j in range(i) if _touches(nodes[j].writes,n.writes)],
+            [j for j in range(i) if _touches(nodes[j].reads,n.writes)],gates[i]) for i,n in enumerate(nodes)]
+        self._index,self._ids=index,frozenset(index)
+        return self
+    async def _dag_step(self,i,shared,st):
+        step=self._dag[i]
+        for j in sorted(step.raw): await st.post_done[j].wait()
+        if not (step.phased and step.is_async): await st.wait_post(step.node)
+        if not step.gates or any(st.ran[j] and (st.actions[j] or "default")==a for j,a in step.gates):
+            st.actions[i]=await step.node._run_async(shared) if step.is_async else await self._run_sync(step.node,shared)
+            st.ran[i]=True
+        st.prep_done[i].set(); st.post_done[i].set()
+    async def _orch_async(self,shared,params=None):
+        if self._dag is None: self.compile()
+        st=_DAGRun(self)
+        token=_run.set(_Run(self._ids,params or {**self.params},st))
+        try:
+            tasks=[asyncio.ensure_future(self._dag_step(i,shared,st)) for i in range(len(self._dag))]
+            try: await asyncio.gather(*tasks)
+            except BaseException:
+                for t in tasks: t.cancel()
+                raise
+        finally: _run.reset(token)
+        return next((st.actions[i] for i in reversed(range(len(self._dag))) if st.ran[i]),None)
+
 class AsyncBatchFlow(AsyncFlow,BatchFlow):
+    @_traced_async
     async def _run_async(self,shared):
         pr=await self.prep_async(shared) or []
         for bp in pr: await self._orch_async(shared,{**self.params,**bp})
         return await self.post_async(shared,pr,None)
 
 class AsyncParallelBatchFlow(AsyncFlow,BatchFlow):
+    """
+    Runs the flow once per param set concurrently, at most batch_concurrency at a time (None: unbounded;
+    max_concurrency still limits sync nodes). batch_done_async gets each run's last action as it finishes;
+    isolate_failures=True passes a failed run's exception there instead of aborting the batch.
+    """
+    def __init__(self,start=None,executor=None,max_concurrency=None,batch_concurrency=None,isolate_failures=False):
+        super().__init__(start,executor,max_concurrency); self.batch_concurrency,self.isolate_failures=batch_concurrency,isolate_failures
+    async def batch_done_async(self,index,params,result): pass
+    @_traced_async
     async def _run_async(self,shared): 
         pr=await self.prep_async(shared) or []
-        await asyncio.gather(*(self._orch_async(shared,{**self.params,**bp}) for bp in pr))
+        run=lambda bp: self._orch_async(shared,{**self.params,**bp})
+        async for i,bp,r in _as_completed(run,pr,self.batch_concurrency,self.isolate_failures): await self.batch_done_async(i,bp,r)
         return await self.post_async(shared,pr,None)
-    
+
 __version__ = "0.2.1"
 __all__ = [
+    'Deadline', 'DeadlineExceeded', 'current_deadline', 'deadline_scope', 'backoff_delay',
+    'get_sync_executor', 'set_sync_executor', 'get_process_pool', 'set_process_pool', 'shutdown_process_pool',
+    'FlowValidationError', 'Checkpoint',
+    'MemoCache', 'DiskMemoCache',
+    'Span', 'Tracer', 'MemorySink', 'JSONLSink', 'LogSink', 'get_tracer', 'set_tracer', 'get_trace_stats',
     'BaseNode', 'Node', 'BatchNode', 'Flow', 'BatchFlow',
-    'AsyncNode', 'AsyncBatchNode', 'AsyncParallelBatchNode', 
-    'AsyncFlow', 'AsyncBatchFlow', 'AsyncParallelBatchFlow'
+    'AsyncNode', 'AsyncBatchNode', 'AsyncParallelBatchNode', 'ProcessPoolNode', 'ProcessBatchNode',
+    'AsyncFlow', 'AsyncBatchFlow', 'AsyncParallelBatchFlow', 'AsyncDAGFlow'
 ]
\ No newline at end of file
@@ -3,23 +3,51 @@
 提供RESTful API服务
 """
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Awaitable
+import asyncio
+import os
 import uuid
 import json
 from datetime import datetime
+from contextlib import asynccontextmanager
 
-from flow import create_tarot_flow, create_simple_divination_flow
+from macore import Checkpoint, Deadline, DeadlineExceeded, deadline_scope, get_trace_stats, shutdown_process_pool
+from flow import (
+    create_async_tarot_flow, create_async_dag_divination_flow, create_draw_simulation_flow, API_SUSPEND_ACTIONS
+)
+from nodes import (
+    ProcessTopicNode, ProcessSpreadNode, CardDrawingNode, InterpretationNode, AdviceNode,
+    speculate_reading, reading_scope
+)
 from utils.tarot_cards import get_topics, get_spreads, get_card_by_id
 from utils.card_drawer import simulate_draw_process
+from utils.call_llm import (
+    warmup_llm_clients, aclose_llm_clients, get_llm_routing_snapshot, get_llm_hedging_stats,
+    get_llm_cache_stats, get_llm_singleflight_stats, get_llm_limiter_stats, get_llm_cassette_stats,
+    get_llm_usage_stats, get_llm_model_routes_snapshot
+)
+from utils.speculation import speculation_stats
+from utils.response_templates import get_template_stats
+from utils.node_memo import get_node_memo_stats
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时预热LLM客户端，关闭时释放连接池和抽牌模拟的进程池"""
+    warmup_llm_clients(include_async=True)
+    yield
+    await aclose_llm_clients()
+    shutdown_process_pool(wait=False)
 
 # FastAPI应用实例
 app = FastAPI(
     title="塔罗占卜师 API",
     description="智能塔罗占卜服务API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 添加CORS中间件
@@ -38,8 +66,206 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 在内存中存储会话数据（生产环境应使用数据库）
-sessions: Dict[str, Dict[str, Any]] = {}
+# 所有会话共用一个编译好的占卜流程，流程在等待用户请求的步骤暂停
+tarot_api_flow = create_async_tarot_flow(suspend_on=API_SUSPEND_ACTIONS)
+
+# 快速占卜的依赖图流程，合并/不合并解读和建议的版本各编译一次，所有请求共用
+quick_divination_flows = {fused: create_async_dag_divination_flow(fused_reading=fused) for fused in (False, True)}
+
+# 在内存中存储每个会话的暂停位置和共享存储（生产环境可以把Checkpoint.dumps()的结果存入数据库）
+sessions: Dict[str, Checkpoint] = {}
+
+# /step接口的各步骤要求流程暂停在的节点
+STEP_NODES = {
+    "select_topic": ProcessTopicNode,
+    "select_spread": ProcessSpreadNode,
+    "draw_cards": CardDrawingNode,
+    "get_interpretation": InterpretationNode,
+    "get_advice": AdviceNode,
+}
+
+# 流程暂停时的action对应返回给前端的下一步
+NEXT_STEPS = {
+    "waiting_topic": "topic_selection",
+    "waiting_spread": "spread_selection",
+    "drawing_cards": "drawing_cards",
+    "interpretation": "interpretation",
+    "advice": "advice",
+}
+
+# 抽牌后在后台预生成的解读和建议：{session_id: {步骤: SpeculativeResult}}
+speculations: Dict[str, Dict[str, Any]] = {}
+
+def speculative_reading_enabled() -> bool:
+    return os.getenv("SPECULATIVE_READING_ENABLED", "true").lower() == "true"
+
+def fused_reading_enabled() -> bool:
+    return os.getenv("FUSED_READING_ENABLED", "false").lower() == "true"
+
+def discard_speculation(session_id: str) -> None:
+    """放弃会话尚未使用的预生成结果"""
+    for result in speculations.pop(session_id, {}).values():
+        result.cancel()
+
+def reading_speculation(session_id: str, shared: Dict[str, Any]):
+    """
+    获取解读步骤可以使用的预生成结果
+    
+    没有预生成但启用了合并模式时，现在一次性生成解读和建议，建议留给get_advice使用。
+    """
+    speculation = speculations.get(session_id, {}).get("get_interpretation")
+    if speculation is None and fused_reading_enabled():
+        speculations[session_id] = speculate_reading(shared, fused=True)
+        speculation = speculations[session_id]["get_interpretation"]
+    return speculation
+
+def session_checkpoint(session_id: str, step: str) -> Checkpoint:
+    """
+    获取会话的Checkpoint，并检查流程正暂停在该步骤对应的节点
+    
+    Args:
+        session_id: 会话ID
+        step: STEP_NODES中的步骤名称
+    
+    Returns:
+        Checkpoint: 会话当前的暂停位置
+    """
+    checkpoint = sessions.get(session_id)
+    if checkpoint is None:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    if not isinstance(tarot_api_flow.node_at(checkpoint), STEP_NODES[step]):
+        current_step = checkpoint.shared["user_session"]["current_step"]
+        raise HTTPException(status_code=409, detail=f"当前不能执行步骤{step}，占卜进行到: {current_step}")
+    return checkpoint
+
+def flow_next_step(checkpoint: Checkpoint) -> str:
+    """流程暂停位置对应的下一步"""
+    return "completed" if checkpoint.done else NEXT_STEPS.get(checkpoint.action, checkpoint.action)
+
+async def advance_session(session_id: str, checkpoint: Checkpoint, updates: Optional[Dict[str, Any]] = None,
+                          speculation=None, stream: Optional[asyncio.Queue] = None):
+    """
+    从Checkpoint继续运行流程到下一个暂停点，成功后保存新的Checkpoint
+    
+    Args:
+        session_id: 会话ID
+        checkpoint: 会话当前的Checkpoint
+        updates: 合并到shared中的用户输入
+        speculation: 解读/建议步骤可以使用的预生成结果
+        stream: 接收流式文本片段的队列
+    
+    Returns:
+        (新的Checkpoint, 本次运行的第一个节点写入的消息)
+    """
+    history = checkpoint.shared["user_session"]["conversation_history"]
+    start = len(history)
+    with reading_scope(speculation, stream):
+        checkpoint = await tarot_api_flow.resume_async(checkpoint, updates)
+    sessions[session_id] = checkpoint
+    return checkpoint, history[start]["message"]
+
+# 给出选择菜单的节点写入的历史步骤
+MENU_STEPS = ("topic_selection_guide", "spread_selection_guide")
+
+def pending_menu(checkpoint: Checkpoint) -> Optional[str]:
+    """
+    流程暂停等待用户选择主题或牌阵时，最后给出的菜单文本
+    
+    菜单由确认/欢迎节点之后的节点生成，不是接口返回的message，放在data["menu"]中返回。
+    
+    Returns:
+        菜单文本，流程没有停在菜单后面时返回None
+    """
+    history = checkpoint.shared["user_session"]["conversation_history"]
+    if checkpoint.done or not history or history[-1]["step"] not in MENU_STEPS:
+        return None
+    return history[-1]["message"]
+
+# 各接口（/step接口按步骤）默认的请求截止时间（秒），可以用REQUEST_DEADLINE_<NAME>覆盖
+ENDPOINT_DEADLINES = {
+    "start": 20.0,
+    "step": 30.0,
+    "select_topic": 15.0,
+    "select_spread": 15.0,
+    "draw_cards": 30.0,
+    "get_interpretation": 60.0,
+    "get_advice": 60.0,
+    "stream": 120.0,
+    "quick": 90.0,
+    "simulation": 30.0,
+}
+
+# 客户端指定本次请求截止时间（秒）的请求头，不超过REQUEST_DEADLINE_MAX
+DEADLINE_HEADER = "X-Request-Timeout"
+
+# 检查客户端是否断开的间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# 截止时间到后留给节点执行降级逻辑（如默认欢迎语）的秒数，之后强制取消处理任务
+DEADLINE_GRACE = 0.5
+
+def request_deadline(http_request: Request, endpoint: str) -> Deadline:
+    """
+    创建本次请求的截止时间：客户端通过X-Request-Timeout指定，否则使用接口的默认值
+    
+    Args:
+        http_request: 原始HTTP请求
+        endpoint: ENDPOINT_DEADLINES中的名称
+    
+    Returns:
+        Deadline: 在节点和LLM调用之间传递的截止时间
+    """
+    timeout = float(os.getenv(f"REQUEST_DEADLINE_{endpoint.upper()}", ENDPOINT_DEADLINES[endpoint]))
+    header = http_request.headers.get(DEADLINE_HEADER)
+    if header:
+        try:
+            timeout = float(header)
+        except ValueError:
+            timeout = 0.0
+        if timeout <= 0:
+            raise HTTPException(status_code=400, detail=f"无效的{DEADLINE_HEADER}: {header}")
+        timeout = min(timeout, float(os.getenv("REQUEST_DEADLINE_MAX", "300")))
+    return Deadline(timeout)
+
+async def run_within_deadline(http_request: Request, endpoint: str, work: Awaitable) -> Any:
+    """
+    在请求截止时间内运行接口的处理逻辑
+    
+    截止时间随上下文传到各节点的重试和每次LLM调用（作为超时），节点没能降级处理时返回504；
+    客户端断开时取消截止时间和处理任务，进行中的LLM调用随之取消。
+    
+    Args:
+        http_request: 原始HTTP请求
+        endpoint: ENDPOINT_DEADLINES中的名称
+        work: 处理逻辑的协程
+    
+    Returns:
+        协程的返回值
+    """
+    try:
+        deadline = request_deadline(http_request, endpoint)
+    except HTTPException:
+        work.close()
+        raise
+    with deadline_scope(deadline):
+        # task创建时复制当前上下文，截止时间随之传入
+        task = asyncio.ensure_future(work)
+    
+    async def watch_disconnect():
+        while not task.done():
+            if await http_request.is_disconnected():
+                deadline.cancel("client disconnected")
+                task.cancel()
+                return
+            await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+    
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        return await asyncio.wait_for(task, deadline.remaining() + DEADLINE_GRACE)
+    except (asyncio.TimeoutError, DeadlineExceeded):
+        raise HTTPException(status_code=504, detail="处理超时，请稍后重试")
+    finally:
+        watcher.cancel()
 
 # Pydantic模型定义
 class StartDivinationRequest(BaseModel):
@@ -70,6 +296,7 @@ class DivinationStatus(BaseModel):
     progress: int
     completed: bool
     history: List[Dict[str, Any]]
+    llm_usage: Dict[str, Any] = {}
 
 @app.get("/")
 async def root():
@@ -89,8 +316,11 @@ async def health_check():
     }
 
 @app.post("/api/v1/divination/start", response_model=DivationResponse)
-async def start_divination(request: StartDivinationRequest):
+async def start_divination(request: StartDivinationRequest, http_request: Request):
     """开始新的占卜会话"""
+    return await run_within_deadline(http_request, "start", _start_divination(request))
+
+async def _start_divination(request: StartDivinationRequest) -> DivationResponse:
     try:
         # 创建新会话
         session_id = str(uuid.uuid4())
@@ -99,6 +329,7 @@ async def start_divination(request: StartDivinationRequest):
         shared = {
             "user_session": {
                 "user_id": request.user_id or str(uuid.uuid4()),
+                "session_id": session_id,
                 "current_step": "welcome",
                 "conversation_history": []
             },
@@ -114,163 +345,130 @@ async def start_divination(request: StartDivinationRequest):
             "style_spec": {}
         }
         
-        # 运行欢迎节点
-        from nodes import WelcomeNode
-        welcome_node = WelcomeNode()
-        action = welcome_node.run(shared)
+        # 运行流程：欢迎语和主题菜单，在等待用户选择主题时暂停
+        checkpoint = await tarot_api_flow.run_until_suspended_async(shared)
         
         # 存储会话
-        sessions[session_id] = shared
+        sessions[session_id] = checkpoint
         
-        # 获取欢迎消息
-        welcome_message = shared["user_session"]["conversation_history"][-1]["message"]
+        # 获取欢迎消息，主题菜单放在data中
+        welcome_message = shared["user_session"]["conversation_history"][0]["message"]
         
         return DivationResponse(
             session_id=session_id,
             status="started",
             message=welcome_message,
-            next_step="topic_selection",
-            data={"available_topics": list(get_topics().keys())}
+            next_step=flow_next_step(checkpoint),
+            data={"available_topics": list(get_topics().keys()), "menu": pending_menu(checkpoint)}
         )
-        
+    
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"启动占卜失败: {str(e)}")
 
 @app.post("/api/v1/divination/step", response_model=DivationResponse)
-async def process_divination_step(request: DivationStepRequest):
-    """处理占卜流程中的步骤"""
+async def process_divination_step(request: DivationStepRequest, http_request: Request):
+    """处理占卜流程中的步骤，默认截止时间按步骤区分"""
+    endpoint = request.step if request.step in ENDPOINT_DEADLINES else "step"
+    return await run_within_deadline(http_request, endpoint, _process_divination_step(request))
+
+async def _process_divination_step(request: DivationStepRequest) -> DivationResponse:
     try:
-        # 检查会话是否存在
+        # 检查会话是否存在、流程是否正等待这一步
         if request.session_id not in sessions:
             raise HTTPException(status_code=404, detail="会话不存在")
+        if request.step not in STEP_NODES:
+            raise HTTPException(status_code=400, detail=f"未知的步骤: {request.step}")
+        checkpoint = session_checkpoint(request.session_id, request.step)
+        shared = checkpoint.shared
         
-        shared = sessions[request.session_id]
-        current_step = shared["user_session"]["current_step"]
-        
-        # 根据步骤处理用户输入
+        # 根据步骤处理用户输入，从暂停处继续运行流程
         if request.step == "select_topic":
             selected_topic = request.data.get("topic")
             if not selected_topic:
                 raise HTTPException(status_code=400, detail="请选择占卜主题")
             
-            # 将用户输入存储到shared中
-            shared["user_input"] = {"selected_topic": selected_topic}
-            
-            # 创建并运行处理主题节点
-            from nodes import ProcessTopicNode
-            process_topic_node = ProcessTopicNode()
-            action = process_topic_node.run(shared)
-            
-            # 更新会话
-            sessions[request.session_id] = shared
-            
-            # 获取响应消息
-            latest_message = shared["user_session"]["conversation_history"][-1]["message"]
+            # 处理主题，有效时接着给出牌阵菜单，无效时重新给出主题菜单
+            checkpoint, message = await advance_session(
+                request.session_id, checkpoint, {"user_input": {"selected_topic": selected_topic}}
+            )
+            next_step = flow_next_step(checkpoint)
+            data = {"available_spreads": list(get_spreads().keys())} if next_step == "spread_selection" else {}
             
             return DivationResponse(
                 session_id=request.session_id,
                 status="processing",
-                message=latest_message,
-                next_step=action,
-                data={"available_spreads": list(get_spreads().keys())} if action == "spread_selection" else {}
+                message=message,
+                next_step=next_step,
+                data={**data, "menu": pending_menu(checkpoint)}
             )
-            
+        
         elif request.step == "select_spread":
             selected_spread = request.data.get("spread")
             if not selected_spread:
                 raise HTTPException(status_code=400, detail="请选择牌阵类型")
             
-            shared["user_input"] = {"selected_spread": selected_spread}
-            
-            from nodes import ProcessSpreadNode
-            process_spread_node = ProcessSpreadNode()
-            action = process_spread_node.run(shared)
-            
-            latest_message = shared["user_session"]["conversation_history"][-1]["message"]
+            checkpoint, message = await advance_session(
+                request.session_id, checkpoint, {"user_input": {"selected_spread": selected_spread}}
+            )
             
             return DivationResponse(
                 session_id=request.session_id,
                 status="processing",
-                message=latest_message,
-                next_step=action,
+                message=message,
+                next_step=flow_next_step(checkpoint),
                 data={}
             )
-            
+        
         elif request.step == "draw_cards":
-            # 只执行抽牌，不执行解读和建议
-            from nodes import CardDrawingNode
-            
-            # 抽牌
-            card_drawing_node = CardDrawingNode()
-            action = card_drawing_node.run(shared)
+            # 只执行抽牌，流程在解读之前暂停
+            checkpoint, message = await advance_session(request.session_id, checkpoint)
             
-            # 更新会话
-            sessions[request.session_id] = shared
-            
-            # 获取抽牌结果
-            conversation = shared["user_session"]["conversation_history"]
-            cards_message = next((h["message"] for h in reversed(conversation) if h["step"] == "cards_drawn"), "")
-            
-            full_message = cards_message
+            # 用户观看抽牌动画时在后台预生成解读和建议
+            discard_speculation(request.session_id)
+            if speculative_reading_enabled():
+                speculations[request.session_id] = speculate_reading(shared, fused=fused_reading_enabled())
             
             return DivationResponse(
                 session_id=request.session_id,
                 status="cards_drawn",
-                message=full_message,
-                next_step="interpretation",
+                message=message,
+                next_step=flow_next_step(checkpoint),
                 data={
                     "drawn_cards": shared["divination"]["drawn_cards"]
                 }
             )
-            
+        
         elif request.step == "get_interpretation":
-            # 获取解读
-            from nodes import InterpretationNode
-            
-            interpretation_node = InterpretationNode()
-            action = interpretation_node.run(shared)
-            
-            # 更新会话
-            sessions[request.session_id] = shared
-            
-            latest_message = shared["user_session"]["conversation_history"][-1]["message"]
+            speculation = reading_speculation(request.session_id, shared)
+            checkpoint, message = await advance_session(request.session_id, checkpoint, speculation=speculation)
             
             return DivationResponse(
                 session_id=request.session_id,
                 status="interpreted",
-                message=latest_message,
-                next_step="advice",
+                message=message,
+                next_step=flow_next_step(checkpoint),
                 data={
                     "interpretation": shared["divination"]["interpretation"]
                 }
             )
-            
-        elif request.step == "get_advice":
-            # 获取建议
-            from nodes import AdviceNode
-            
-            advice_node = AdviceNode()
-            action = advice_node.run(shared)
-            
-            # 更新会话
-            sessions[request.session_id] = shared
-            
-            latest_message = shared["user_session"]["conversation_history"][-1]["message"]
+        
+        else:
+            speculation = speculations.pop(request.session_id, {}).get("get_advice")
+            checkpoint, message = await advance_session(request.session_id, checkpoint, speculation=speculation)
             
             return DivationResponse(
                 session_id=request.session_id,
                 status="completed",
-                message=latest_message,
-                next_step="completed",
+                message=message,
+                next_step=flow_next_step(checkpoint),
                 data={
                     "advice": shared["divination"]["advice"]
                 }
             )
-            
-        else:
-            raise HTTPException(status_code=400, detail=f"未知的步骤: {request.step}")
-            
-    except HTTPException:
+    
+    except (HTTPException, DeadlineExceeded):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"处理步骤失败: {str(e)}")
@@ -302,7 +500,7 @@ async def get_divination_status(session_id: str):
         if session_id not in sessions:
             raise HTTPException(status_code=404, detail="会话不存在")
         
-        shared = sessions[session_id]
+        shared = sessions[session_id].shared
         user_session = shared["user_session"]
         divination = shared["divination"]
         
@@ -328,14 +526,104 @@ async def get_divination_status(session_id: str):
             current_step=current_step,
             progress=progress,
             completed=completed,
-            history=user_session["conversation_history"]
+            history=user_session["conversation_history"],
+            llm_usage=shared.get("llm_usage", {})
         )
-        
+    
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取状态失败: {str(e)}")
 
+# 支持流式输出的步骤：(结果字段, 完成后的状态)
+STREAMING_STEPS = {
+    "get_interpretation": ("interpretation", "interpreted"),
+    "get_advice": ("advice", "completed"),
+}
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.get("/api/v1/divination/{session_id}/stream")
+async def stream_divination_step(http_request: Request, session_id: str, step: str = "get_interpretation"):
+    """
+    以SSE方式流式返回解读或建议
+    
+    事件类型：token（文本片段）、done（完整结果，与/step接口的响应字段一致）、error
+    流结束后完整文本会写入shared["divination"]和conversation_history；
+    超过截止时间时发送error事件，客户端断开时停止生成
+    """
+    if session_id not in sessions:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    if step not in STREAMING_STEPS:
+        raise HTTPException(status_code=400, detail=f"该步骤不支持流式输出: {step}")
+    
+    checkpoint = session_checkpoint(session_id, step)
+    result_key, status = STREAMING_STEPS[step]
+    shared = checkpoint.shared
+    if step == "get_advice":
+        speculation = speculations.pop(session_id, {}).get(step)
+    else:
+        speculation = reading_speculation(session_id, shared)
+    deadline = request_deadline(http_request, "stream")
+    
+    async def event_stream():
+        chunks: asyncio.Queue = asyncio.Queue()
+        with deadline_scope(deadline):
+            # 流程在后台任务中运行，节点生成的片段放入队列，运行结束时放入None
+            task = asyncio.ensure_future(advance_session(session_id, checkpoint, speculation=speculation, stream=chunks))
+        task.add_done_callback(lambda _: chunks.put_nowait(None))
+        try:
+            while True:
+                # 等待下一个片段（可能来自预生成结果）也受截止时间限制
+                chunk = await asyncio.wait_for(chunks.get(), deadline.remaining())
+                if chunk is None:
+                    break
+                yield format_sse("token", {"text": chunk})
+            next_checkpoint, message = task.result()
+            yield format_sse("done", {
+                "session_id": session_id,
+                "status": status,
+                "message": message,
+                "next_step": flow_next_step(next_checkpoint),
+                "data": {result_key: shared["divination"][result_key]}
+            })
+        except (asyncio.TimeoutError, DeadlineExceeded):
+            yield format_sse("error", {"detail": "处理超时，请稍后重试"})
+        except Exception as e:
+            yield format_sse("error", {"detail": f"处理步骤失败: {str(e)}"})
+        finally:
+            task.cancel()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/v1/llm/routing")
+async def get_llm_routing():
+    """查看LLM提供商路由状态：熔断器、延迟统计、最近的路由决策和对冲统计"""
+    return {**get_llm_routing_snapshot(), "hedging": get_llm_hedging_stats()}
+
+@app.get("/api/v1/llm/metrics")
+async def get_llm_metrics():
+    """查看LLM调用层的运行统计：缓存命中、请求合并、对冲、各提供商限流队列、模型路由、按模型/路由/节点的token用量与费用、解读预生成、本地模板回复、节点结果记忆和节点各阶段耗时"""
+    return {
+        "cache": get_llm_cache_stats(),
+        "singleflight": get_llm_singleflight_stats(),
+        "hedging": get_llm_hedging_stats(),
+        "limits": get_llm_limiter_stats(),
+        "cassette": get_llm_cassette_stats(),
+        "model_routes": get_llm_model_routes_snapshot(),
+        "usage": get_llm_usage_stats(),
+        "speculation": speculation_stats.snapshot(),
+        "templates": get_template_stats(),
+        "node_memo": get_node_memo_stats(),
+        "tracing": get_trace_stats()
+    }
+
 @app.get("/api/v1/topics")
 async def get_available_topics():
     """获取可用的占卜主题"""
@@ -346,13 +634,46 @@ async def get_available_spreads():
     """获取可用的牌阵类型"""
     return {"spreads": get_spreads()}
 
+# 抽牌模拟流程，所有请求共用
+draw_simulation_flow = create_draw_simulation_flow()
+
+# 一次抽牌模拟的最大次数
+MAX_SIMULATION_RUNS = int(os.getenv("SIMULATION_MAX_RUNS", "200000"))
+
+@app.get("/api/v1/spreads/{spread_type}/simulation")
+async def simulate_spread(http_request: Request, spread_type: str, runs: int = 10000, seed: Optional[int] = None):
+    """大批量模拟牌阵的抽牌，统计每张牌被抽到的频率和逆位比例"""
+    if spread_type not in get_spreads():
+        raise HTTPException(status_code=404, detail="牌阵不存在")
+    if not 1 <= runs <= MAX_SIMULATION_RUNS:
+        raise HTTPException(status_code=400, detail=f"模拟次数需要在1到{MAX_SIMULATION_RUNS}之间")
+    return await run_within_deadline(http_request, "simulation", _simulate_spread(spread_type, runs, seed))
+
+async def _simulate_spread(spread_type: str, runs: int, seed: Optional[int]) -> Dict[str, Any]:
+    try:
+        shared = {"simulation": {"spread_type": spread_type, "runs": runs, "seed": seed}}
+        await draw_simulation_flow.run_async(shared)
+        return shared["simulation"]
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"抽牌模拟失败: {str(e)}")
+
 # 简化版占卜接口（用于快速测试）
 @app.post("/api/v1/divination/quick")
-async def quick_divination():
+async def quick_divination(http_request: Request):
     """快速占卜（单张牌）"""
+    return await run_within_deadline(http_request, "quick", _quick_divination())
+
+async def _quick_divination() -> Dict[str, Any]:
     try:
         # 使用简化流程
         shared = {
+            "user_session": {
+                "user_id": str(uuid.uuid4()),
+                "current_step": "drawing_cards",
+                "conversation_history": []
+            },
             "divination": {
                 "topic": "general",
                 "spread_type": "single",
@@ -362,9 +683,8 @@ async def quick_divination():
             }
         }
         
-        # 执行简化流程
-        simple_flow = create_simple_divination_flow()
-        simple_flow.run(shared)
+        # 执行简化流程：抽牌描述和解读并发调用LLM
+        await quick_divination_flows[fused_reading_enabled()].run_async(shared)
         
         divination = shared["divination"]
         
@@ -372,9 +692,12 @@ async def quick_divination():
             "status": "completed",
             "drawn_cards": divination["drawn_cards"],
             "interpretation": divination["interpretation"],
-            "advice": divination["advice"]
+            "advice": divination["advice"],
+            "llm_usage": shared.get("llm_usage", {})
         }
-        
+    
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"快速占卜失败: {str(e)}")
 
@@ -3,41 +3,148 @@
 包含占卜流程中的各个步骤节点
 """
 
-from macore import Node
-from utils.call_llm import call_tarot_llm
+from macore import Node, AsyncNode, ProcessBatchNode, deadline_scope
+from utils.call_llm import call_tarot_llm, call_tarot_llm_async, stream_tarot_llm_async, resolve_node_route
 from utils.tarot_cards import get_topics, get_spreads, get_card_by_id
-from utils.card_drawer import simulate_draw_process
+from utils.card_drawer import draw_cards, simulate_draw_process, get_draw_summary
+from utils.speculation import SpeculationDiscarded, SpeculativeResult
+from utils.llm_usage import usage_scope
+from utils.response_templates import get_template_engine
+from utils.node_memo import get_node_memo
+import asyncio
+import copy
 import json
+import random
 import uuid
-from typing import Dict, Any
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Optional
 
-class WelcomeNode(Node):
+def layout_prompt(instructions, payload=None):
+    """
+    按"固定指令在前、本次数据在后"拼接提示
+    
+    系统提示（占卜师人设）和各节点的固定指令每次调用都相同，构成稳定的前缀，
+    提供商的提示缓存（prompt caching）可以复用这部分的预填充结果；
+    主题、牌面、解读等每次不同的数据只能放在最后。
+    
+    Args:
+        instructions: 不含任何变量的固定指令
+        payload: 本次调用的数据
+    
+    Returns:
+        str: 完整提示
+    """
+    if not payload:
+        return instructions
+    return f"{instructions}\n\n{payload}"
+
+class TarotNode(Node):
+    """塔罗节点基类 - 统一各节点调用LLM时的参数"""
+    
+    # 回复要求每次都不同的节点（如解读、建议）应关闭响应缓存
+    use_llm_cache = True
+    # 提供商限流排队时的优先级，用户正在等待结果的核心步骤应使用high
+    llm_priority = "normal"
+    # 模型路由：chat使用便宜、低延迟的小模型，reading使用更强的模型，可以用LLM_NODE_ROUTES按节点覆盖
+    llm_route = "chat"
+    # post可能返回的action，Flow.compile()据此检查流程图的完整性
+    actions = None
+    # prep读取、post写入的shared路径，AsyncDAGFlow据此让互不依赖的节点并发运行；None表示可能读写任何数据
+    reads = None
+    writes = None
+    # exec只取决于prep结果中的memo_fields时设为True，LLM生成的结果按这些字段缓存（NODE_MEMO_*），同样的输入不再调用LLM
+    memoize = False
+    
+    @property
+    def memo(self):
+        return get_node_memo() if self.memoize else None
+    
+    def memo_key(self, prep_res):
+        # 本地模板每次随机选择措辞，只记忆调用LLM生成的回复
+        return None if self.uses_template(prep_res) else super().memo_key(prep_res)
+    
+    def llm_options(self):
+        """传递给call_tarot_llm的额外参数"""
+        return {"use_cache": self.use_llm_cache, "priority": self.llm_priority,
+                "route": resolve_node_route(self.usage_name(), self.llm_route)}
+    
+    def response_template(self, prep_res):
+        """
+        本次回复对应的本地模板步骤和动态字段，子类按需覆盖
+        
+        Returns:
+            (步骤名称, 字段字典)，None表示总是调用LLM
+        """
+        return None
+    
+    def uses_template(self, prep_res):
+        """本次回复是否由本地模板渲染（步骤配置在RESPONSE_TEMPLATE_STEPS中）"""
+        template = self.response_template(prep_res)
+        engine = get_template_engine()
+        return template is not None and engine is not None and engine.enabled(template[0])
+    
+    def template_response(self, prep_res):
+        """步骤配置为使用本地模板时直接渲染回复，否则返回None"""
+        if not self.uses_template(prep_res):
+            return None
+        step, fields = self.response_template(prep_res)
+        return get_template_engine().render(step, **fields)
+    
+    def respond(self, prep_res):
+        """生成回复：能用本地模板时不调用LLM"""
+        reply = self.template_response(prep_res)
+        if reply is not None:
+            return reply
+        return call_tarot_llm(self.build_prompt(prep_res), **self.llm_options())
+    
+    def usage_name(self):
+        # 同步和异步版本的节点计入同一个名称
+        name = type(self).__name__
+        return name[len("Async"):] if name.startswith("Async") else name
+    
+    def usage_scope(self, shared):
+        """本节点LLM调用的用量归属：计入节点名和会话ID，并累加到shared["llm_usage"]"""
+        session_id = shared.get("user_session", {}).get("session_id")
+        return usage_scope(self.usage_name(), session_id, shared.setdefault("llm_usage", {}))
+    
+    def _run(self, shared):
+        with self.usage_scope(shared):
+            return super()._run(shared)
+
+class WelcomeNode(TarotNode):
     """欢迎节点 - 塔罗占卜师打招呼和介绍"""
     
+    actions = ("topic_selection",)
+    
+    llm_priority = "low"
+    
     def prep(self, shared):
         # 准备欢迎消息，检查是否是新会话
         session_id = shared.get("user_session", {}).get("user_id")
         return {"is_new_session": session_id is None}
     
-    def exec(self, prep_res):
-        # 调用LLM生成个性化欢迎词，如果失败则使用默认消息
-        try:
-            if prep_res["is_new_session"]:
-                prompt = """请作为塔罗占卜师星月，向新用户打招呼并介绍自己。要包含：
+    def build_prompt(self, prep_res):
+        if prep_res["is_new_session"]:
+            return """请作为塔罗占卜师星月，向新用户打招呼并介绍自己。要包含：
 1. 友好的问候
 2. 简单介绍自己的名字和职业
 3. 说明接下来会进行什么样的占卜体验
 4. 让用户感到放松和期待"""
-            else:
-                prompt = "欢迎回来！准备开始新的塔罗占卜吗？"
-            
-            return call_tarot_llm(prompt)
+        return "欢迎回来！准备开始新的塔罗占卜吗？"
+    
+    def default_message(self, prep_res):
+        # LLM调用失败时的默认消息
+        if prep_res["is_new_session"]:
+            return "🔮✨ 你好！我是塔罗占卜师星月~ 欢迎来到神秘的塔罗世界！准备好开始你的占卜之旅了吗？"
+        return "🔮 欢迎回来！准备开始新的塔罗占卜吗？"
+    
+    def exec(self, prep_res):
+        # 调用LLM生成个性化欢迎词，如果失败则使用默认消息
+        try:
+            return call_tarot_llm(self.build_prompt(prep_res), **self.llm_options())
         except Exception as e:
-            # LLM调用失败时的默认消息
-            if prep_res["is_new_session"]:
-                return "🔮✨ 你好！我是塔罗占卜师星月~ 欢迎来到神秘的塔罗世界！准备好开始你的占卜之旅了吗？"
-            else:
-                return "🔮 欢迎回来！准备开始新的塔罗占卜吗？"
+            return self.default_message(prep_res)
     
     def post(self, shared, prep_res, exec_res):
         # 初始化用户会话信息
@@ -59,9 +166,16 @@ class WelcomeNode(Node):
         shared["user_session"]["current_step"] = "topic_selection"
         return "topic_selection"
 
-class TopicSelectionNode(Node):
+class TopicSelectionNode(TarotNode):
     """主题选择节点 - 让用户选择占卜主题"""
     
+    actions = ("waiting_topic",)
+    # 主题菜单只取决于主题列表，与会话无关
+    memoize = True
+    memo_fields = ("topics",)
+    
+    llm_priority = "low"
+    
     def prep(self, shared):
         # 准备主题选项列表
         topics = get_topics()
@@ -70,23 +184,25 @@ class TopicSelectionNode(Node):
             "conversation_history": shared.get("user_session", {}).get("conversation_history", [])
         }
     
-    def exec(self, prep_res):
+    def build_prompt(self, prep_res):
         # 生成引导用户选择主题的话术
         topics = prep_res["topics"]
         topic_list = "\n".join([f"{i+1}. {topic['emoji']} {topic['name']} - {topic['description']}" 
                                for i, topic in enumerate(topics.values())])
         
-        prompt = f"""现在要引导用户选择占卜主题。可选的主题有：
-
-{topic_list}
-
-请生成一段话来：
+        instructions = """现在要引导用户选择占卜主题，可选的主题列在最后。请生成一段话来：
 1. 说明要选择占卜主题
 2. 简单介绍这些主题
 3. 让用户选择感兴趣的主题
 4. 保持轻松愉快的语气"""
-        
-        return call_tarot_llm(prompt)
+
+        return layout_prompt(instructions, f"可选的主题有：\n{topic_list}")
+    
+    def response_template(self, prep_res):
+        return "topic_menu", {}
+    
+    def exec(self, prep_res):
+        return self.respond(prep_res)
     
     def post(self, shared, prep_res, exec_res):
         # 记录主题选择引导消息
@@ -101,9 +217,11 @@ class TopicSelectionNode(Node):
         shared["user_session"]["current_step"] = "waiting_topic"
         return "waiting_topic"
 
-class ProcessTopicNode(Node):
+class ProcessTopicNode(TarotNode):
     """处理用户选择的主题"""
     
+    actions = ("spread_selection", "topic_selection")
+    
     def prep(self, shared):
         # 从输入中获取用户选择的主题
         selected_topic = shared.get("user_input", {}).get("selected_topic")
@@ -113,21 +231,32 @@ class ProcessTopicNode(Node):
             "topics": topics
         }
     
-    def exec(self, prep_res):
+    def build_prompt(self, prep_res):
         selected_topic = prep_res["selected_topic"]
         topics = prep_res["topics"]
         
         if selected_topic not in topics:
-            return call_tarot_llm(f"不好意思，我没有理解你选择的主题。请从以下选项中选择：{list(topics.keys())}")
+            return f"不好意思，我没有理解你选择的主题。请从以下选项中选择：{list(topics.keys())}"
         
         topic_info = topics[selected_topic]
-        prompt = f"""用户选择了{topic_info['emoji']} {topic_info['name']}主题。请：
+        instructions = """用户刚刚选择了占卜主题（见最后）。请：
 1. 确认用户的选择
 2. 简单说明这个主题的占卜会涉及什么
 3. 表达期待和鼓励
 4. 引导进入下一步选择牌阵"""
-        
-        return call_tarot_llm(prompt)
+
+        return layout_prompt(instructions, f"用户选择的主题：{topic_info['emoji']} {topic_info['name']}")
+    
+    def response_template(self, prep_res):
+        selected_topic = prep_res["selected_topic"]
+        if selected_topic not in prep_res["topics"]:
+            return "invalid_topic", {"selected": str(selected_topic or "")[:20]}
+        topic_info = prep_res["topics"][selected_topic]
+        return "topic_confirmed", {"topic_name": topic_info["name"], "topic_emoji": topic_info["emoji"],
+                                   "topic_description": topic_info["description"]}
+    
+    def exec(self, prep_res):
+        return self.respond(prep_res)
     
     def post(self, shared, prep_res, exec_res):
         # 存储用户选择的主题
@@ -148,9 +277,14 @@ class ProcessTopicNode(Node):
         
         return next_action
 
-class SpreadSelectionNode(Node):
+class SpreadSelectionNode(TarotNode):
     """牌阵选择节点 - 让用户选择牌阵类型"""
     
+    actions = ("waiting_spread",)
+    # 牌阵菜单只取决于牌阵列表和所选主题
+    memoize = True
+    memo_fields = ("spreads", "topic_info")
+    
     def prep(self, shared):
         # 准备牌阵选项和当前主题
         spreads = get_spreads()
@@ -163,24 +297,29 @@ class SpreadSelectionNode(Node):
             "topic_info": topics.get(current_topic, {})
         }
     
-    def exec(self, prep_res):
+    def build_prompt(self, prep_res):
         spreads = prep_res["spreads"]
         topic_info = prep_res["topic_info"]
         
         spread_list = "\n".join([f"{i+1}. {spread['name']} - {spread['description']}" 
                                 for i, spread in enumerate(spreads.values())])
         
-        prompt = f"""用户选择了{topic_info.get('name', '未知')}主题。现在要让用户选择牌阵类型：
-
-{spread_list}
-
-请生成一段话来：
+        instructions = """现在要让用户选择牌阵类型，可选的牌阵和用户选择的主题列在最后。请生成一段话来：
 1. 根据用户选择的主题推荐合适的牌阵
 2. 解释不同牌阵的特点
 3. 让用户选择喜欢的牌阵
 4. 保持鼓励和期待的语气"""
-        
-        return call_tarot_llm(prompt)
+
+        # 牌阵列表对所有用户相同，放在主题之前
+        payload = f"可选的牌阵有：\n{spread_list}\n\n用户选择的主题：{topic_info.get('name', '未知')}"
+        return layout_prompt(instructions, payload)
+    
+    def response_template(self, prep_res):
+        topic_info = prep_res["topic_info"]
+        return "spread_menu", {"topic_name": topic_info.get("name", "占卜"), "topic_emoji": topic_info.get("emoji", "🔮")}
+    
+    def exec(self, prep_res):
+        return self.respond(prep_res)
     
     def post(self, shared, prep_res, exec_res):
         shared["user_session"]["conversation_history"].append({
@@ -193,9 +332,11 @@ class SpreadSelectionNode(Node):
         shared["user_session"]["current_step"] = "waiting_spread"
         return "waiting_spread"
 
-class ProcessSpreadNode(Node):
+class ProcessSpreadNode(TarotNode):
     """处理用户选择的牌阵"""
     
+    actions = ("drawing_cards", "spread_selection")
+    
     def prep(self, shared):
         selected_spread = shared.get("user_input", {}).get("selected_spread")
         spreads = get_spreads()
@@ -204,21 +345,32 @@ class ProcessSpreadNode(Node):
             "spreads": spreads
         }
     
-    def exec(self, prep_res):
+    def build_prompt(self, prep_res):
         selected_spread = prep_res["selected_spread"]
         spreads = prep_res["spreads"]
         
         if selected_spread not in spreads:
-            return call_tarot_llm(f"请从以下牌阵中选择：{list(spreads.keys())}")
+            return f"请从以下牌阵中选择：{list(spreads.keys())}"
         
         spread_info = spreads[selected_spread]
-        prompt = f"""用户选择了{spread_info['name']}牌阵。请：
+        instructions = """用户刚刚选择了牌阵（见最后）。请：
 1. 确认用户的选择
 2. 说明这个牌阵的特点
 3. 引导用户准备抽牌（深呼吸、集中注意力等）
 4. 营造神秘而不紧张的氛围"""
-        
-        return call_tarot_llm(prompt)
+
+        return layout_prompt(instructions, f"用户选择的牌阵：{spread_info['name']}")
+    
+    def response_template(self, prep_res):
+        selected_spread = prep_res["selected_spread"]
+        if selected_spread not in prep_res["spreads"]:
+            return "invalid_spread", {"selected": str(selected_spread or "")[:20]}
+        spread_info = prep_res["spreads"][selected_spread]
+        return "spread_confirmed", {"spread_name": spread_info["name"], "spread_description": spread_info["description"],
+                                    "card_count": spread_info["card_count"], "positions": "、".join(spread_info["positions"])}
+    
+    def exec(self, prep_res):
+        return self.respond(prep_res)
     
     def post(self, shared, prep_res, exec_res):
         if prep_res["selected_spread"] in prep_res["spreads"]:
@@ -237,9 +389,16 @@ class ProcessSpreadNode(Node):
         
         return next_action
 
-class CardDrawingNode(Node):
+class CardDrawingNode(TarotNode):
     """抽牌节点 - 模拟抽牌过程"""
     
+    actions = ("interpretation",)
+    reads = ("divination.spread_type", "divination.topic")
+    writes = ("divination.drawn_cards", "user_session.conversation_history", "user_session.current_step")
+    
+    use_llm_cache = False
+    llm_priority = "high"
+    
     def prep(self, shared):
         spread_type = shared.get("divination", {}).get("spread_type")
         topic = shared.get("divination", {}).get("topic")
@@ -248,27 +407,25 @@ class CardDrawingNode(Node):
             "topic": topic
         }
     
-    def exec(self, prep_res):
-        # 模拟抽牌过程
-        spread_type = prep_res["spread_type"]
-        draw_result = simulate_draw_process(spread_type)
-        
+    def build_prompt(self, draw_result):
         # 生成抽牌过程的描述
-        prompt = f"""用户选择了{draw_result['spread_name']}，现在已经抽取了塔罗牌。
-
-抽牌结果：
-{draw_result['summary']}
-
-请作为塔罗占卜师：
+        instructions = """用户已经抽取了塔罗牌，牌阵和抽牌结果见最后。请作为塔罗占卜师：
 1. 营造神秘的抽牌氛围
 2. 公布抽到的牌
 3. 表达对结果的初步感受
 4. 准备进入解读环节
 5. 保持期待和鼓励的语气"""
+
+        payload = f"牌阵：{draw_result['spread_name']}\n\n抽牌结果：\n{draw_result['summary']}"
+        return layout_prompt(instructions, payload)
+    
+    def exec(self, prep_res):
+        # 模拟抽牌过程
+        draw_result = simulate_draw_process(prep_res["spread_type"])
         
         return {
             "draw_result": draw_result,
-            "message": call_tarot_llm(prompt)
+            "message": call_tarot_llm(self.build_prompt(draw_result), **self.llm_options())
         }
     
     def post(self, shared, prep_res, exec_res):
@@ -286,9 +443,62 @@ class CardDrawingNode(Node):
         shared["user_session"]["current_step"] = "interpretation"
         return "interpretation"
 
-class InterpretationNode(Node):
+class DrawCardsNode(CardDrawingNode):
+    """
+    只抽牌、不调用LLM的抽牌节点
+    
+    抽牌过程的描述由DrawMessageNode单独生成，在AsyncDAGFlow中它和解读节点都只依赖抽到的牌，可以同时调用LLM。
+    """
+    
+    writes = ("divination.drawn_cards", "user_session.current_step")
+    
+    def exec(self, prep_res):
+        return simulate_draw_process(prep_res["spread_type"])
+    
+    def post(self, shared, prep_res, exec_res):
+        shared["divination"]["drawn_cards"] = exec_res["drawn_cards"]
+        shared["user_session"]["current_step"] = "interpretation"
+        return "interpretation"
+
+class DrawMessageNode(CardDrawingNode):
+    """抽牌描述节点 - 为DrawCardsNode抽到的牌生成抽牌过程的描述"""
+    
+    actions = ("default",)
+    reads = ("divination.spread_type", "divination.drawn_cards")
+    writes = ("user_session.conversation_history",)
+    
+    def prep(self, shared):
+        divination = shared.get("divination", {})
+        drawn_cards = divination.get("drawn_cards", [])
+        # 与simulate_draw_process返回的结构一致，build_prompt直接复用
+        return {
+            "spread_name": get_spreads()[divination.get("spread_type")]["name"],
+            "summary": get_draw_summary(drawn_cards),
+            "drawn_cards": drawn_cards
+        }
+    
+    def exec(self, prep_res):
+        return call_tarot_llm(self.build_prompt(prep_res), **self.llm_options())
+    
+    def post(self, shared, prep_res, exec_res):
+        shared["user_session"]["conversation_history"].append({
+            "step": "cards_drawn",
+            "message": exec_res,
+            "drawn_cards": prep_res["drawn_cards"],
+            "timestamp": "now"
+        })
+
+class InterpretationNode(TarotNode):
     """解读节点 - 基于抽到的牌和主题提供解读"""
     
+    actions = ("advice",)
+    reads = ("divination.topic", "divination.spread_type", "divination.drawn_cards")
+    writes = ("divination.interpretation", "user_session.conversation_history", "user_session.current_step")
+    
+    use_llm_cache = False
+    llm_priority = "high"
+    llm_route = "reading"
+    
     def prep(self, shared):
         divination = shared.get("divination", {})
         return {
@@ -297,10 +507,7 @@ class InterpretationNode(Node):
             "drawn_cards": divination.get("drawn_cards", [])
         }
     
-    def exec(self, prep_res):
-        topic = prep_res["topic"]
-        drawn_cards = prep_res["drawn_cards"]
-        
+    def cards_text(self, drawn_cards):
         # 构建牌面信息
         cards_info = []
         for card in drawn_cards:
@@ -310,21 +517,24 @@ class InterpretationNode(Node):
 关键词：{', '.join(card['keywords'])}"""
             cards_info.append(card_desc)
         
-        cards_text = "\n".join(cards_info)
+        return "\n".join(cards_info)
+    
+    def build_prompt(self, prep_res):
+        topic = prep_res["topic"]
+        cards_text = self.cards_text(prep_res["drawn_cards"])
         
-        prompt = f"""现在要为{topic}主题进行塔罗牌解读。抽到的牌是：
-
-{cards_text}
-
-请作为塔罗占卜师星月：
-1. 结合抽到的牌和{topic}主题进行深入解读
+        instructions = """现在要进行塔罗牌解读，占卜主题和抽到的牌见最后。请作为塔罗占卜师星月：
+1. 结合抽到的牌和占卜主题进行深入解读
 2. 解释牌面之间的关联和整体含义
-3. 针对{topic}给出具体的指导建议
+3. 针对占卜主题给出具体的指导建议
 4. 保持积极正面的解读角度
 5. 语言风格要友好轻松，避免过于严肃
 6. 控制在200字左右"""
-        
-        return call_tarot_llm(prompt)
+
+        return layout_prompt(instructions, f"占卜主题：{topic}\n\n抽到的牌：\n{cards_text}")
+    
+    def exec(self, prep_res):
+        return call_tarot_llm(self.build_prompt(prep_res), **self.llm_options())
     
     def post(self, shared, prep_res, exec_res):
         # 存储解读结果
@@ -339,9 +549,18 @@ class InterpretationNode(Node):
         shared["user_session"]["current_step"] = "advice"
         return "advice"
 
-class AdviceNode(Node):
+class AdviceNode(TarotNode):
     """建议节点 - 给出积极正面的建议和鼓励"""
     
+    actions = ("completed",)
+    reads = ("divination.topic", "divination.interpretation", "divination.drawn_cards")
+    writes = ("divination.advice", "divination.status", "user_session.conversation_history",
+              "user_session.current_step")
+    
+    use_llm_cache = False
+    llm_priority = "high"
+    llm_route = "reading"
+    
     def prep(self, shared):
         divination = shared.get("divination", {})
         return {
@@ -350,22 +569,22 @@ class AdviceNode(Node):
             "drawn_cards": divination.get("drawn_cards", [])
         }
     
-    def exec(self, prep_res):
+    def build_prompt(self, prep_res):
         topic = prep_res["topic"]
         interpretation = prep_res["interpretation"]
         
-        prompt = f"""基于刚才对{topic}主题的塔罗解读：
-{interpretation}
-
-请作为塔罗占卜师星月：
+        instructions = """现在要基于刚才的塔罗解读给出建议，占卜主题和解读内容见最后。请作为塔罗占卜师星月：
 1. 给出具体可行的建议和指导
 2. 提供积极正面的鼓励话语
 3. 帮助用户建立信心和希望
 4. 提醒用户塔罗是启发工具，最终还是要靠自己的努力
 5. 以温暖的祝福结束
 6. 控制在120字左右"""
-        
-        return call_tarot_llm(prompt)
+
+        return layout_prompt(instructions, f"占卜主题：{topic}\n\n刚才的解读：\n{interpretation}")
+    
+    def exec(self, prep_res):
+        return call_tarot_llm(self.build_prompt(prep_res), **self.llm_options())
     
     def post(self, shared, prep_res, exec_res):
         # 存储建议
@@ -381,4 +600,348 @@ class AdviceNode(Node):
         shared["user_session"]["current_step"] = "completed"
         shared["divination"]["status"] = "completed"
         
-        return "completed"
\ No newline at end of file
+        return "completed"
+
+def parse_fused_reading(text):
+    """
+    解析合并节点返回的JSON
+    
+    Returns:
+        Dict: 包含非空interpretation和advice的字典，格式不符时返回None
+    """
+    if not text:
+        return None
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    interpretation, advice = data.get("interpretation"), data.get("advice")
+    if not (isinstance(interpretation, str) and interpretation.strip()
+            and isinstance(advice, str) and advice.strip()):
+        return None
+    return {"interpretation": interpretation.strip(), "advice": advice.strip()}
+
+class FusedReadingNode(InterpretationNode):
+    """解读+建议合并节点 - 一次LLM调用以JSON同时生成解读和建议，解析失败时退回解读、建议两次调用"""
+    
+    actions = ("completed",)
+    writes = ("divination.interpretation", "divination.advice", "divination.status", "divination.fused_reading",
+              "user_session.conversation_history", "user_session.current_step")
+    
+    def build_prompt(self, prep_res):
+        topic = prep_res["topic"]
+        cards_text = self.cards_text(prep_res["drawn_cards"])
+        
+        instructions = """现在要进行塔罗牌解读并给出建议，占卜主题和抽到的牌见最后。请作为塔罗占卜师星月完成两部分内容：
+解读（interpretation）：
+1. 结合抽到的牌和占卜主题进行深入解读
+2. 解释牌面之间的关联和整体含义
+3. 保持积极正面的解读角度，语言友好轻松
+4. 控制在200字左右
+建议（advice）：
+1. 基于上面的解读给出具体可行的建议和积极的鼓励
+2. 提醒用户塔罗是启发工具，最终还是要靠自己的努力
+3. 以温暖的祝福结束
+4. 控制在120字左右
+
+只返回一个JSON对象，不要包含其他内容：
+{"interpretation": "解读内容", "advice": "建议内容"}"""
+
+        return layout_prompt(instructions, f"占卜主题：{topic}\n\n抽到的牌：\n{cards_text}")
+    
+    def advice_prep(self, prep_res, interpretation):
+        # 与AdviceNode.prep的结构一致
+        return {
+            "topic": prep_res["topic"],
+            "interpretation": interpretation,
+            "drawn_cards": prep_res["drawn_cards"]
+        }
+    
+    def exec(self, prep_res):
+        reading = parse_fused_reading(call_tarot_llm(self.build_prompt(prep_res), json_mode=True, **self.llm_options()))
+        if reading is not None:
+            return {**reading, "fused": True}
+        interpretation = call_tarot_llm(InterpretationNode.build_prompt(self, prep_res), **self.llm_options())
+        advice = call_tarot_llm(AdviceNode.build_prompt(self, self.advice_prep(prep_res, interpretation)), **self.llm_options())
+        return {"interpretation": interpretation, "advice": advice, "fused": False}
+    
+    def post(self, shared, prep_res, exec_res):
+        InterpretationNode.post(self, shared, prep_res, exec_res["interpretation"])
+        shared["divination"]["fused_reading"] = exec_res["fused"]
+        return AdviceNode.post(self, shared, self.advice_prep(prep_res, exec_res["interpretation"]), exec_res["advice"])
+
+# ---------- 异步节点 ----------
+# 复用同步节点的prep/build_prompt/post，只把LLM调用换成异步版本，
+# 在AsyncFlow或FastAPI的事件循环中运行时不会阻塞其他会话
+
+class AsyncTarotNode(AsyncNode):
+    """异步塔罗节点基类 - prep和post直接复用同步节点的实现"""
+    
+    async def _run_async(self, shared):
+        with self.usage_scope(shared):
+            return await super()._run_async(shared)
+    
+    async def prep_async(self, shared):
+        return self.prep(shared)
+    
+    async def exec_async(self, prep_res):
+        return await self.respond_async(prep_res)
+    
+    async def respond_async(self, prep_res):
+        """respond的异步版本"""
+        reply = self.template_response(prep_res)
+        if reply is not None:
+            return reply
+        return await call_tarot_llm_async(self.build_prompt(prep_res), **self.llm_options())
+    
+    async def post_async(self, shared, prep_res, exec_res):
+        return self.post(shared, prep_res, exec_res)
+
+# main.py在恢复流程前为本次请求设置：可以使用的预生成结果、接收流式文本片段的队列
+_reading_speculation: ContextVar[Optional[SpeculativeResult]] = ContextVar("reading_speculation", default=None)
+_reading_stream: ContextVar[Optional[asyncio.Queue]] = ContextVar("reading_stream", default=None)
+
+@contextmanager
+def reading_scope(speculation=None, stream=None):
+    """
+    在此范围内（包括其中创建的asyncio任务）运行的解读、建议节点：
+    预生成结果与本次提示一致时直接使用它代替LLM调用；传入stream时把生成的文本片段逐个放入该队列
+    
+    Args:
+        speculation: speculate_reading返回的SpeculativeResult，None表示实时生成
+        stream: asyncio.Queue，None表示不需要流式输出
+    """
+    tokens = (_reading_speculation.set(speculation), _reading_stream.set(stream))
+    try:
+        yield
+    finally:
+        _reading_stream.reset(tokens[1])
+        _reading_speculation.reset(tokens[0])
+
+class AsyncStreamingTarotNode(AsyncTarotNode):
+    """
+    支持预生成和流式输出的异步塔罗节点，exec结果就是LLM生成的文本
+    
+    在reading_scope内运行时使用其中的预生成结果和片段队列，因此同一个流程既可以用于普通请求也可以用于SSE流式请求。
+    """
+    
+    async def exec_async(self, prep_res):
+        prompt = self.build_prompt(prep_res)
+        speculation, stream = _reading_speculation.get(), _reading_stream.get()
+        if speculation is not None and not await speculation.matches(prompt):
+            speculation = None
+        if stream is None:
+            if speculation is not None:
+                try:
+                    return await speculation.result()
+                except Exception:
+                    # 预生成失败时改为实时生成
+                    pass
+            return await self.respond_async(prep_res)
+        chunks = []
+        if speculation is not None:
+            try:
+                async for chunk in speculation.stream():
+                    chunks.append(chunk)
+                    stream.put_nowait(chunk)
+            except Exception:
+                # 预生成在输出任何内容之前失败时改为实时生成
+                if chunks:
+                    raise
+        if not chunks:
+            async for chunk in stream_tarot_llm_async(prompt, **self.llm_options()):
+                chunks.append(chunk)
+                stream.put_nowait(chunk)
+        return "".join(chunks)
+    
+    async def speculate_into(self, view, result):
+        """
+        在shared的副本上预生成本节点的回复，写入result后对副本执行post，供后续节点继续预生成
+        
+        Args:
+            view: shared的深拷贝，会被修改
+            result: 接收生成文本的SpeculativeResult
+        """
+        prep_res = self.prep(view)
+        prompt = self.build_prompt(prep_res)
+        result.begin(prompt)
+        with self.usage_scope(view):
+            async for chunk in stream_tarot_llm_async(prompt, **self.llm_options()):
+                result.push(chunk)
+        result.finish()
+        self.post(view, prep_res, "".join(result.chunks))
+
+class AsyncWelcomeNode(AsyncTarotNode, WelcomeNode):
+    """欢迎节点的异步版本"""
+    
+    async def exec_async(self, prep_res):
+        try:
+            return await call_tarot_llm_async(self.build_prompt(prep_res), **self.llm_options())
+        except Exception as e:
+            return self.default_message(prep_res)
+
+class AsyncTopicSelectionNode(AsyncTarotNode, TopicSelectionNode):
+    """主题选择节点的异步版本"""
+
+class AsyncProcessTopicNode(AsyncTarotNode, ProcessTopicNode):
+    """处理主题节点的异步版本"""
+
+class AsyncSpreadSelectionNode(AsyncTarotNode, SpreadSelectionNode):
+    """牌阵选择节点的异步版本"""
+
+class AsyncProcessSpreadNode(AsyncTarotNode, ProcessSpreadNode):
+    """处理牌阵节点的异步版本"""
+
+class AsyncCardDrawingNode(AsyncTarotNode, CardDrawingNode):
+    """抽牌节点的异步版本"""
+    
+    async def exec_async(self, prep_res):
+        draw_result = simulate_draw_process(prep_res["spread_type"])
+        return {
+            "draw_result": draw_result,
+            "message": await call_tarot_llm_async(self.build_prompt(draw_result), **self.llm_options())
+        }
+
+class AsyncDrawCardsNode(AsyncTarotNode, DrawCardsNode):
+    """只抽牌节点的异步版本"""
+    
+    async def exec_async(self, prep_res):
+        return self.exec(prep_res)
+
+class AsyncDrawMessageNode(AsyncTarotNode, DrawMessageNode):
+    """抽牌描述节点的异步版本"""
+    
+    async def exec_async(self, prep_res):
+        return await call_tarot_llm_async(self.build_prompt(prep_res), **self.llm_options())
+
+class AsyncInterpretationNode(AsyncStreamingTarotNode, InterpretationNode):
+    """解读节点的异步版本"""
+
+class AsyncAdviceNode(AsyncStreamingTarotNode, AdviceNode):
+    """建议节点的异步版本"""
+
+class AsyncFusedReadingNode(AsyncTarotNode, FusedReadingNode):
+    """解读+建议合并节点的异步版本"""
+    
+    async def exec_async(self, prep_res):
+        text = await call_tarot_llm_async(self.build_prompt(prep_res), json_mode=True, **self.llm_options())
+        reading = parse_fused_reading(text)
+        if reading is not None:
+            return {**reading, "fused": True}
+        interpretation = await call_tarot_llm_async(InterpretationNode.build_prompt(self, prep_res), **self.llm_options())
+        advice = await call_tarot_llm_async(
+            AdviceNode.build_prompt(self, self.advice_prep(prep_res, interpretation)), **self.llm_options()
+        )
+        return {"interpretation": interpretation, "advice": advice, "fused": False}
+
+async def _fused_speculate_into(view, results):
+    # 一次调用生成两部分，按解读、建议节点各自会构建的提示登记结果
+    node = AsyncFusedReadingNode()
+    prep_res = node.prep(view)
+    interpretation = results["get_interpretation"]
+    interpretation.begin(InterpretationNode.build_prompt(node, prep_res))
+    with node.usage_scope(view):
+        reading = await node.exec_async(prep_res)
+    interpretation.push(reading["interpretation"])
+    interpretation.finish()
+    InterpretationNode.post(node, view, prep_res, reading["interpretation"])
+    advice = results["get_advice"]
+    advice.begin(AdviceNode.build_prompt(node, AdviceNode.prep(node, view)))
+    advice.push(reading["advice"])
+    advice.finish()
+
+class DrawSimulationNode(ProcessBatchNode):
+    """
+    抽牌模拟节点 - 大批量模拟某个牌阵的抽牌，统计每张牌被抽到的频率和逆位比例
+    
+    模拟按block_size次抽牌分块，每块有自己的随机种子（指定seed时结果可复现），
+    在进程池中计算，不占用API进程的GIL。
+    """
+    
+    block_size = 2000
+    
+    async def prep_async(self, shared):
+        simulation = shared["simulation"]
+        runs = simulation["runs"]
+        seed = simulation.get("seed")
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        return [
+            {"spread_type": simulation["spread_type"], "seed": seed + i, "draws": min(self.block_size, runs - start)}
+            for i, start in enumerate(range(0, runs, self.block_size))
+        ]
+    
+    def exec(self, block):
+        # 在工作进程中运行：第一次抽牌设置本块的种子，之后的抽牌延续同一个随机序列
+        counts = {}
+        for i in range(block["draws"]):
+            for card in draw_cards(block["spread_type"], seed=block["seed"] if i == 0 else None):
+                drawn, reversed_count = counts.get(card["id"], (0, 0))
+                counts[card["id"]] = (drawn + 1, reversed_count + card["is_reversed"])
+        return counts
+    
+    async def post_async(self, shared, prep_res, exec_res):
+        totals = {}
+        for counts in exec_res:
+            for card_id, (drawn, reversed_count) in counts.items():
+                total = totals.setdefault(card_id, [0, 0])
+                total[0] += drawn
+                total[1] += reversed_count
+        cards_drawn = sum(drawn for drawn, _ in totals.values())
+        shared["simulation"]["cards"] = {
+            card_id: {
+                "name": get_card_by_id(card_id)["name"],
+                "count": drawn,
+                "frequency": drawn / cards_drawn,
+                "reversed_rate": reversed_count / drawn
+            }
+            for card_id, (drawn, reversed_count) in sorted(totals.items(), key=lambda item: -item[1][0])
+        }
+        return "default"
+
+def speculate_reading(shared, fused=False):
+    """
+    抽牌完成后在后台依次预生成解读和建议，除用量统计外不修改shared
+    
+    解读完成后在shared的副本上执行解读节点的post，再用它生成建议，
+    因此建议的提示与用户按正常顺序请求时完全相同。预生成的LLM调用
+    无论结果是否被使用都计入shared["llm_usage"]。需要在事件循环中调用。
+    
+    Args:
+        shared: 已完成抽牌的共享存储
+        fused: 是否用AsyncFusedReadingNode一次调用同时生成解读和建议（不再逐段流式输出）
+    
+    Returns:
+        Dict[str, SpeculativeResult]: 键为get_interpretation和get_advice
+    """
+    # 副本与shared共用同一个用量字典
+    usage = shared.setdefault("llm_usage", {})
+    view = copy.deepcopy(shared, {id(usage): usage})
+    results = {"get_interpretation": SpeculativeResult(), "get_advice": SpeculativeResult()}
+    
+    async def run():
+        try:
+            if fused:
+                await _fused_speculate_into(view, results)
+            else:
+                await AsyncInterpretationNode().speculate_into(view, results["get_interpretation"])
+                await AsyncAdviceNode().speculate_into(view, results["get_advice"])
+        except BaseException as e:
+            # 生产任务被取消时，消费方收到普通异常，以便回退到实时生成
+            cancelled = isinstance(e, asyncio.CancelledError)
+            for result in results.values():
+                result.finish(SpeculationDiscarded("预生成已被取消") if cancelled else e)
+            if cancelled:
+                raise
+    
+    # 预生成在后台继续运行，不受发起请求的截止时间和断开取消的影响，每次LLM调用仍受LLM_TIMEOUT限制
+    with deadline_scope(None):
+        task = asyncio.get_running_loop().create_task(run())
+    for result in results.values():
+        result.task = task
+    return results
@@ -0,0 +1,10 @@
+"""
+测试公共配置：从仓库根目录导入模块，LLM使用本地stub提供商，不访问网络
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("LLM_PROVIDER", "stub")
@@ -0,0 +1,109 @@
+"""流程检查点：在等待用户输入的action处暂停、序列化和恢复，以及API按检查点推进步骤"""
+
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from macore import AsyncFlow, Checkpoint, Flow, FlowValidationError, Node
+
+class Ask(Node):
+    def post(self, shared, prep_res, exec_res):
+        shared["log"].append("ask")
+        return "waiting"
+
+class Answer(Node):
+    def prep(self, shared):
+        return shared["answer"]
+    
+    def post(self, shared, prep_res, exec_res):
+        shared["log"].append(f"answer:{prep_res}")
+        return "again" if prep_res == "retry" else "done"
+
+class Finish(Node):
+    def post(self, shared, prep_res, exec_res):
+        shared["log"].append("finish")
+
+def make_flow(flow_class=Flow):
+    ask, answer, finish = Ask(), Answer(), Finish()
+    ask - "waiting" >> answer
+    answer - "again" >> ask
+    answer - "done" >> finish
+    return flow_class(start=ask).compile(suspend_on=("waiting",))
+
+def test_run_suspends_and_resumes_with_new_input():
+    flow = make_flow()
+    checkpoint = flow.run_until_suspended({"log": []})
+    assert checkpoint.action == "waiting" and isinstance(flow.node_at(checkpoint), Answer)
+    
+    checkpoint = flow.resume(checkpoint, {"answer": "retry"})
+    assert not checkpoint.done and isinstance(flow.node_at(checkpoint), Answer)
+    
+    checkpoint = flow.resume(checkpoint, {"answer": "yes"})
+    assert checkpoint.done
+    assert checkpoint.shared["log"] == ["ask", "answer:retry", "ask", "answer:yes", "finish"]
+
+def test_checkpoint_survives_serialization():
+    flow = make_flow(AsyncFlow)
+    checkpoint = asyncio.run(flow.run_until_suspended_async({"log": []}))
+    restored = Checkpoint.loads(checkpoint.dumps())
+    assert (restored.node, restored.action, restored.shared) == (checkpoint.node, checkpoint.action, checkpoint.shared)
+    assert asyncio.run(flow.resume_async(restored, {"answer": "yes"})).done
+
+def test_resume_rejects_other_graphs_and_finished_runs():
+    flow = make_flow()
+    checkpoint = flow.run_until_suspended({"log": []})
+    other = Flow(start=Finish()).compile(suspend_on=("waiting",))
+    with pytest.raises(FlowValidationError):
+        other.resume(checkpoint)
+    finished = flow.resume(checkpoint, {"answer": "yes"})
+    with pytest.raises(FlowValidationError):
+        flow.resume(finished)
+
+@pytest.fixture
+def client():
+    import main
+    with TestClient(main.app) as client:
+        yield client
+
+def step(client, session_id, name, **data):
+    return client.post("/api/v1/divination/step", json={"session_id": session_id, "step": name, "data": data})
+
+def test_api_walks_the_flow_and_rejects_out_of_order_steps(client):
+    session_id = client.post("/api/v1/divination/start", json={}).json()["session_id"]
+    
+    response = step(client, session_id, "draw_cards")
+    assert response.status_code == 409
+    assert step(client, session_id, "bogus").status_code == 400
+    
+    response = step(client, session_id, "select_topic", topic="not-a-topic")
+    assert response.status_code == 200 and response.json()["next_step"] == "topic_selection"
+    
+    expected = [
+        ("select_topic", {"topic": "love"}, "spread_selection"),
+        ("select_spread", {"spread": "single"}, "drawing_cards"),
+        ("draw_cards", {}, "interpretation"),
+        ("get_interpretation", {}, "advice"),
+        ("get_advice", {}, "completed"),
+    ]
+    for name, data, next_step in expected:
+        response = step(client, session_id, name, **data)
+        assert response.status_code == 200, response.json()
+        assert response.json()["next_step"] == next_step
+    
+    assert step(client, session_id, "get_advice").status_code == 409
+    status = client.get(f"/api/v1/divination/{session_id}/status").json()
+    assert status["completed"] and status["progress"] == 100
+
+def test_api_returns_the_menu_shown_after_each_selection(client):
+    started = client.post("/api/v1/divination/start", json={}).json()
+    assert started["data"]["menu"] and started["data"]["menu"] != started["message"]
+    
+    invalid = step(client, started["session_id"], "select_topic", topic="not-a-topic").json()
+    assert invalid["data"]["menu"]
+    
+    chosen = step(client, started["session_id"], "select_topic", topic="love").json()
+    assert chosen["data"]["menu"] and "available_spreads" in chosen["data"]
+    
+    drawn = step(client, started["session_id"], "select_spread", spread="single").json()
+    assert "menu" not in drawn["data"]
@@ -0,0 +1,76 @@
+"""AsyncDAGFlow的调度：依赖顺序、同步节点和max_concurrency"""
+
+import asyncio
+import time
+
+import pytest
+
+from macore import AsyncDAGFlow, AsyncNode, FlowValidationError, Node
+
+class SyncStep(Node):
+    def __init__(self, name, reads=None, writes=None, delay=0.0):
+        super().__init__()
+        self.name, self.reads, self.writes, self.delay = name, reads, writes, delay
+    
+    def exec(self, prep_res):
+        time.sleep(self.delay)
+    
+    def post(self, shared, prep_res, exec_res):
+        shared["log"].append(self.name)
+
+class AsyncStep(AsyncNode):
+    def __init__(self, name, reads=None, writes=None, delay=0.0):
+        super().__init__()
+        self.name, self.reads, self.writes, self.delay = name, reads, writes, delay
+    
+    async def exec_async(self, prep_res):
+        await asyncio.sleep(self.delay)
+    
+    async def post_async(self, shared, prep_res, exec_res):
+        shared["log"].append(self.name)
+
+def run(flow, timeout=5):
+    shared = {"log": []}
+    asyncio.run(asyncio.wait_for(flow.run_async(shared), timeout))
+    return shared["log"]
+
+def test_sync_writers_with_one_permit_do_not_deadlock():
+    # n2只和n1写同一路径，它必须等n1 post之后才能post；等待不能占着唯一的许可
+    nodes = [
+        SyncStep("n0", reads=(), writes=("a",), delay=0.2),
+        SyncStep("n1", reads=("a",), writes=("b",)),
+        SyncStep("n2", reads=(), writes=("b",)),
+    ]
+    assert run(AsyncDAGFlow(nodes, max_concurrency=1)) == ["n0", "n1", "n2"]
+
+def test_blocked_sync_writers_do_not_exhaust_the_pool():
+    from concurrent.futures import ThreadPoolExecutor
+    nodes = [SyncStep("first", reads=(), writes=("a",), delay=0.1), SyncStep("reader", reads=("a",), writes=("x",))]
+    nodes += [SyncStep(f"w{i}", reads=(), writes=("x",)) for i in range(4)]
+    with ThreadPoolExecutor(2) as executor:
+        assert run(AsyncDAGFlow(nodes, executor=executor)) == ["first", "reader", "w0", "w1", "w2", "w3"]
+
+def test_independent_nodes_overlap_and_results_keep_program_order():
+    nodes = [
+        AsyncStep("slow", reads=(), writes=("log.slow",), delay=0.3),
+        AsyncStep("fast", reads=(), writes=("log.fast",), delay=0.3),
+        SyncStep("sync", reads=(), writes=("log.sync",), delay=0.3),
+    ]
+    start = time.monotonic()
+    assert sorted(run(AsyncDAGFlow(nodes))) == ["fast", "slow", "sync"]
+    assert time.monotonic() - start < 0.8
+
+def test_mixed_writers_post_in_program_order():
+    nodes = [
+        AsyncStep("a0", reads=(), writes=("out",), delay=0.2),
+        SyncStep("s1", reads=(), writes=("out",)),
+        AsyncStep("a2", reads=(), writes=("out",)),
+        SyncStep("s3", reads=(), writes=("out",)),
+    ]
+    assert run(AsyncDAGFlow(nodes, max_concurrency=1)) == ["a0", "s1", "a2", "s3"]
+
+def test_backward_edges_are_rejected():
+    first, second = SyncStep("first"), SyncStep("second")
+    second >> first
+    with pytest.raises(FlowValidationError):
+        AsyncDAGFlow([first, second]).compile()
@@ -0,0 +1,98 @@
+"""截止时间：嵌套、节点重试和降级、API的X-Request-Timeout"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from macore import AsyncNode, Deadline, DeadlineExceeded, Node, current_deadline, deadline_scope
+
+class Flaky(Node):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.attempts = 0
+    
+    def exec(self, prep_res):
+        self.attempts += 1
+        raise ConnectionError("upstream failed")
+    
+    def exec_fallback(self, prep_res, exc):
+        return exc
+
+class SlowAsync(AsyncNode):
+    async def exec_async(self, prep_res):
+        # 与LLM调用一样，用剩余预算作为超时
+        try:
+            await asyncio.wait_for(asyncio.sleep(1), current_deadline().remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(current_deadline().why()) from None
+    
+    async def exec_fallback_async(self, prep_res, exc):
+        return "fallback"
+    
+    async def post_async(self, shared, prep_res, exec_res):
+        shared["result"] = exec_res
+
+def test_nested_deadline_is_bounded_by_its_parent():
+    with deadline_scope(Deadline(0.1)) as parent:
+        with deadline_scope(5) as child:
+            assert child.remaining() <= 0.1
+        parent.cancel("client disconnected")
+        assert child.expired() and child.why() == "client disconnected"
+
+def test_retries_stop_when_the_backoff_does_not_fit_the_budget():
+    node = Flaky(max_retries=10, wait=0.2)
+    start = time.monotonic()
+    with deadline_scope(0.3):
+        node.run({})
+    assert node.attempts < 10
+    assert time.monotonic() - start < 0.5
+
+def test_expired_deadline_raises_before_exec():
+    node = Flaky()
+    with deadline_scope(Deadline(0)), pytest.raises(DeadlineExceeded):
+        node.run({})
+    assert node.attempts == 0
+
+def test_async_node_falls_back_when_its_call_runs_out_of_time():
+    async def main():
+        shared = {}
+        with deadline_scope(0.1):
+            await SlowAsync().run_async(shared)
+        return shared
+    
+    start = time.monotonic()
+    assert asyncio.run(main()) == {"result": "fallback"}
+    assert time.monotonic() - start < 0.5
+
+def test_invalid_request_timeout_header_is_rejected():
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as client:
+        response = client.post("/api/v1/divination/quick", headers={"X-Request-Timeout": "abc"})
+    assert response.status_code == 400
+
+def test_sync_cassette_replay_stops_at_the_deadline(tmp_path):
+    from utils import call_llm
+    from utils.llm_cassette import Cassette
+    path = str(tmp_path / "llm.jsonl")
+    Cassette(path, mode="record").record("stub", "stub", None, "hello", "world", latency=2.0)
+    previous = call_llm.get_cassette()
+    call_llm.set_cassette(Cassette(path, mode="replay"))
+    try:
+        start = time.monotonic()
+        with deadline_scope(0.1), pytest.raises(DeadlineExceeded):
+            call_llm._chat("stub", None, "hello")
+        assert time.monotonic() - start < 0.5
+    finally:
+        call_llm.set_cassette(previous)
+
+def test_sleep_wakes_when_the_parent_is_cancelled():
+    parent = Deadline(30)
+    child = Deadline(30, parent)
+    threading.Timer(0.1, parent.cancel, args=("client disconnected",)).start()
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded, match="client disconnected"):
+        child.sleep(5)
+    assert time.monotonic() - start < 0.5
@@ -0,0 +1,69 @@
+"""ResponseCache：LRU淘汰、TTL过期、多版本回复，以及解读和建议不进入缓存"""
+
+import time
+
+import pytest
+
+from utils import call_llm
+from utils.llm_cache import ResponseCache, make_cache_key
+
+def test_cache_key_covers_every_request_field():
+    key = make_cache_key("openai", "gpt", "system", "prompt")
+    assert key == make_cache_key("openai", "gpt", "system", "prompt")
+    assert len({
+        key,
+        make_cache_key("deepseek", "gpt", "system", "prompt"),
+        make_cache_key("openai", "gpt-mini", "system", "prompt"),
+        make_cache_key("openai", "gpt", None, "prompt"),
+        make_cache_key("openai", "gpt", "system", "prompt 2"),
+    }) == 5
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_size=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == ("A", None, "C")
+    assert cache.stats()["evictions"] == 1
+
+def test_entries_expire_after_ttl():
+    cache = ResponseCache(ttl=0.05)
+    cache.put("a", "A")
+    cache.put("b", "B", ttl=10)
+    assert cache.get("a") == "A"
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.get("b") == "B"
+
+def test_variants_are_collected_before_hits():
+    cache = ResponseCache(variants=3)
+    for value in ("one", "two", "three"):
+        assert cache.get("k") is None
+        cache.put("k", value)
+    cache.put("k", "four")
+    seen = {cache.get("k") for _ in range(50)}
+    assert seen == {"one", "two", "three"}
+    assert cache.stats()["misses"] == 3
+
+def test_invalid_sizes_are_rejected():
+    with pytest.raises(ValueError):
+        ResponseCache(max_size=0)
+    with pytest.raises(ValueError):
+        ResponseCache(variants=0)
+
+def test_readings_and_advice_are_never_cached(monkeypatch):
+    from nodes import (AdviceNode, AsyncAdviceNode, AsyncFusedReadingNode, AsyncInterpretationNode,
+                       CardDrawingNode, InterpretationNode, SpreadSelectionNode)
+    for node_class in (CardDrawingNode, InterpretationNode, AdviceNode,
+                       AsyncInterpretationNode, AsyncAdviceNode, AsyncFusedReadingNode):
+        assert node_class().llm_options()["use_cache"] is False, node_class.__name__
+    assert SpreadSelectionNode().llm_options()["use_cache"] is True
+    
+    cache = ResponseCache()
+    monkeypatch.setattr(call_llm, "_response_cache", cache)
+    monkeypatch.setattr(call_llm, "_dispatch", lambda *args, **kwargs: "reply")
+    call_llm.call_tarot_llm("解读这组牌", use_cache=False)
+    assert cache.stats()["size"] == 0
+    call_llm.call_tarot_llm("介绍牌阵", use_cache=True)
+    assert cache.stats()["size"] == 1
@@ -0,0 +1,75 @@
+"""Hedger：对冲获胜时不把被取消的主请求的耗时当作延迟样本"""
+
+import asyncio
+import time
+
+from utils.llm_hedging import Hedger
+
+def warmed_hedger(latency=0.05, samples=5):
+    hedger = Hedger(percentile=0.5, min_delay=0.01, min_samples=samples, burst=10)
+    for _ in range(samples):
+        hedger._record_latency("primary", latency)
+    return hedger
+
+def test_async_cancelled_primary_is_not_sampled():
+    hedger = warmed_hedger()
+    
+    async def attempt(provider):
+        await asyncio.sleep(1.0 if provider == "primary" else 0.01)
+        return provider
+    
+    assert asyncio.run(hedger.run_async("primary", "backup", attempt)) == ("backup", "backup")
+    assert hedger.stats()["hedge_wins"] == 1
+    assert list(hedger._stats["primary"].latencies) == [0.05] * 5
+
+def test_sync_primary_is_sampled_when_it_really_completes():
+    hedger = warmed_hedger()
+    
+    def attempt(provider):
+        time.sleep(0.3 if provider == "primary" else 0.01)
+        return provider
+    
+    try:
+        assert hedger.run("primary", "backup", attempt) == ("backup", "backup")
+        assert len(hedger._stats["primary"].latencies) == 5
+        time.sleep(0.5)
+        latencies = list(hedger._stats["primary"].latencies)
+        assert len(latencies) == 6 and latencies[-1] >= 0.3
+    finally:
+        hedger.shutdown()
+
+def test_primary_win_is_sampled():
+    hedger = warmed_hedger()
+    
+    async def attempt(provider):
+        await asyncio.sleep(0.01)
+        return provider
+    
+    assert asyncio.run(hedger.run_async("primary", "backup", attempt)) == ("primary", "primary")
+    assert len(hedger._stats["primary"].latencies) == 6
+
+def test_dispatched_backup_keeps_its_half_open_probe(monkeypatch):
+    from utils import call_llm
+    from utils.llm_router import ProviderRouter
+    router = ProviderRouter(["a", "b"], explore_rate=0.0, failure_threshold=1, cooldown=0.01)
+    router.record_success("a", 0.01)
+    router.record_failure("b")
+    time.sleep(0.02)
+    hedger = Hedger(percentile=0.5, min_delay=0.01, min_samples=1, burst=10)
+    hedger._record_latency("a", 0.05)
+    
+    def chat(provider, system_message, user_message, options=None):
+        time.sleep(0.2 if provider == "a" else 0.5)
+        return provider, None
+    
+    monkeypatch.setattr(call_llm, "_chat", chat)
+    monkeypatch.setattr(call_llm, "_router", router)
+    monkeypatch.setattr(call_llm, "_hedger", hedger)
+    try:
+        assert call_llm._dispatch(None, None, "hello") == "a"
+        # 备用请求仍在进行，它的探测名额不能提前交还
+        assert router._breakers["b"].probe_in_flight
+        time.sleep(0.5)
+        assert router.snapshot()["providers"]["b"]["circuit"] == "closed"
+    finally:
+        hedger.shutdown()
@@ -0,0 +1,67 @@
+"""ProviderLimiter：并发上限、按优先级排队、超时和取消后归还名额"""
+
+import asyncio
+
+import pytest
+
+from utils.llm_limiter import ProviderLimiter
+
+def test_concurrency_is_capped_and_released_slots_go_to_the_highest_priority():
+    limiter = ProviderLimiter("test", max_concurrency=1)
+    granted = []
+    
+    async def call(name, priority):
+        ticket = await limiter.acquire_async(priority)
+        granted.append(name)
+        await asyncio.sleep(0.01)
+        limiter.release(ticket)
+    
+    async def main():
+        first = await limiter.acquire_async("normal")
+        waiters = [asyncio.ensure_future(call(name, priority))
+                   for name, priority in [("low", "low"), ("normal", "normal"), ("high", "high")]]
+        await asyncio.sleep(0.01)
+        assert limiter.stats()["queue_depth"] == 3 and limiter.stats()["in_flight"] == 1
+        limiter.release(first)
+        await asyncio.gather(*waiters)
+    
+    asyncio.run(main())
+    assert granted == ["high", "normal", "low"]
+    assert limiter.stats()["in_flight"] == 0
+
+def test_async_timeout_leaves_the_queue():
+    limiter = ProviderLimiter("test", max_concurrency=1)
+    
+    async def main():
+        ticket = await limiter.acquire_async()
+        with pytest.raises(TimeoutError):
+            await limiter.acquire_async(timeout=0.05)
+        limiter.release(ticket)
+        limiter.release(await limiter.acquire_async(timeout=1))
+    
+    asyncio.run(main())
+    stats = limiter.stats()
+    assert stats["timeouts"] == 1 and stats["queue_depth"] == 0 and stats["in_flight"] == 0
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    limiter = ProviderLimiter("test", max_concurrency=1)
+    
+    async def main():
+        ticket = await limiter.acquire_async()
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        limiter.release(ticket)
+        limiter.release(await limiter.acquire_async(timeout=1))
+    
+    asyncio.run(main())
+    assert limiter.stats()["in_flight"] == 0
+
+def test_rpm_window_blocks_until_it_frees_up():
+    limiter = ProviderLimiter("test", rpm=1, window=0.2)
+    limiter.release(limiter.acquire())
+    with pytest.raises(TimeoutError):
+        limiter.acquire(timeout=0.05)
+    limiter.release(limiter.acquire(timeout=1))
+    assert limiter.stats()["granted"] == 2
@@ -0,0 +1,32 @@
+"""模型路由：只有显式配置的模型和token上限生效"""
+
+from utils.llm_model_routes import ModelRouteTable
+
+PROVIDERS = ("openai", "gemini", "deepseek", "stub")
+
+def test_unconfigured_routes_keep_the_provider_model(monkeypatch):
+    for name in ("CHAT", "READING"):
+        monkeypatch.delenv(f"LLM_ROUTE_{name}_MAX_TOKENS", raising=False)
+        for provider in PROVIDERS:
+            monkeypatch.delenv(f"LLM_ROUTE_{name}_{provider.upper()}_MODEL", raising=False)
+    table = ModelRouteTable.from_env(PROVIDERS)
+    for name in ("chat", "reading"):
+        route = table.get(name)
+        assert route.max_tokens is None
+        assert all(route.model_for(provider) is None for provider in PROVIDERS)
+
+def test_explicit_route_settings_apply(monkeypatch):
+    monkeypatch.setenv("LLM_ROUTE_CHAT_OPENAI_MODEL", "gpt-5-nano")
+    monkeypatch.setenv("LLM_ROUTE_CHAT_MAX_TOKENS", "1024")
+    monkeypatch.setenv("LLM_NODE_ROUTES", "SpreadSelectionNode=reading")
+    table = ModelRouteTable.from_env(PROVIDERS)
+    chat = table.get("chat")
+    assert chat.model_for("openai") == "gpt-5-nano"
+    assert chat.model_for("gemini") is None
+    assert chat.max_tokens == 1024
+    assert table.route_name("SpreadSelectionNode", "chat") == "reading"
+    assert table.route_name("WelcomeNode", "chat") == "chat"
+
+def test_model_routing_is_off_by_default():
+    from utils.call_llm import get_llm_model_routes_snapshot
+    assert get_llm_model_routes_snapshot() == {"enabled": False}
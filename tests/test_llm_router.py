@@ -0,0 +1,39 @@
+"""ProviderRouter：按延迟排序、熔断和冷却后的半开探测"""
+
+import time
+
+from utils.llm_router import ProviderRouter
+
+def make_router(**kwargs):
+    return ProviderRouter(["a", "b", "c"], explore_rate=0.0, **kwargs)
+
+def test_measured_providers_are_tried_fastest_first():
+    router = make_router()
+    router.record_success("b", 0.1)
+    router.record_success("a", 0.5)
+    assert router.route()["order"] == ["b", "a", "c"]
+
+def test_consecutive_failures_open_the_circuit():
+    router = make_router(failure_threshold=2)
+    router.record_failure("a", RuntimeError("down"))
+    assert "a" in router.route()["order"]
+    router.record_failure("a", RuntimeError("down"))
+    assert router.route()["order"] == ["b", "c"]
+    assert router.snapshot()["providers"]["a"]["circuit"] == "open"
+
+def test_open_circuit_allows_one_probe_after_cooldown():
+    router = make_router(failure_threshold=1, cooldown=0.05)
+    router.record_failure("a")
+    time.sleep(0.06)
+    assert "a" in router.route()["order"]
+    # 探测请求进行中时不再放行
+    assert "a" not in router.route()["order"]
+    router.record_success("a", 0.01)
+    assert router.route()["order"][0] == "a"
+
+def test_all_open_still_returns_every_provider():
+    router = make_router(failure_threshold=1, cooldown=60)
+    for provider in ("a", "b", "c"):
+        router.record_failure(provider)
+    decision = router.route()
+    assert decision["reason"] == "all_open" and sorted(decision["order"]) == ["a", "b", "c"]
@@ -0,0 +1,117 @@
+"""SingleFlight：合并相同请求，每个调用方只受自己的截止时间限制"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from macore import Deadline, DeadlineExceeded, current_deadline, deadline_scope
+from utils.llm_singleflight import SingleFlight
+
+def test_async_waiters_share_one_flight():
+    flight = SingleFlight()
+    calls = []
+    
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "ok"
+    
+    async def main():
+        return await asyncio.gather(*(flight.do_async("k", fetch) for _ in range(5)))
+    
+    assert asyncio.run(main()) == ["ok"] * 5
+    assert len(calls) == 1
+    assert flight.stats()["coalesced"] == 4
+
+def test_async_short_deadline_does_not_fail_coalesced_callers():
+    flight = SingleFlight(flight_timeout=5)
+    seen = []
+    
+    async def fetch():
+        seen.append(current_deadline())
+        await asyncio.sleep(0.5)
+        return "ok"
+    
+    async def call(timeout):
+        with deadline_scope(Deadline(timeout)):
+            return await flight.do_async("k", fetch)
+    
+    async def main():
+        short = asyncio.ensure_future(call(0.1))
+        await asyncio.sleep(0)
+        long = asyncio.ensure_future(call(30))
+        return await asyncio.gather(short, long, return_exceptions=True)
+    
+    short, long = asyncio.run(main())
+    assert isinstance(short, DeadlineExceeded)
+    assert long == "ok"
+    assert flight.stats()["leaders"] == 1 and flight.stats()["coalesced"] == 1
+    # 共享请求不继承领头调用方的截止时间，只受flight_timeout限制
+    assert seen[0].remaining() > 1
+
+def test_sync_short_deadline_does_not_fail_coalesced_callers():
+    flight = SingleFlight(flight_timeout=5)
+    started = threading.Event()
+    results = {}
+    
+    def fetch():
+        started.set()
+        time.sleep(0.5)
+        return "ok"
+    
+    def call(name, timeout):
+        with deadline_scope(Deadline(timeout)):
+            try:
+                results[name] = flight.do("k", fetch)
+            except DeadlineExceeded as e:
+                results[name] = e
+    
+    short = threading.Thread(target=call, args=("short", 0.1))
+    short.start()
+    started.wait(1)
+    long = threading.Thread(target=call, args=("long", 30))
+    long.start()
+    short.join()
+    long.join()
+    assert isinstance(results["short"], DeadlineExceeded)
+    assert results["long"] == "ok"
+    assert flight.stats()["coalesced"] == 1
+
+def test_sync_waiter_stops_waiting_when_its_deadline_is_cancelled():
+    flight = SingleFlight()
+    deadline = Deadline(30)
+    threading.Timer(0.1, deadline.cancel, args=("client disconnected",)).start()
+    start = time.monotonic()
+    with deadline_scope(deadline), pytest.raises(DeadlineExceeded):
+        flight.do("k", lambda: time.sleep(1))
+    assert time.monotonic() - start < 0.5
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+    
+    async def fetch():
+        await asyncio.sleep(0.05)
+        raise ValueError("boom")
+    
+    async def main():
+        return await asyncio.gather(*(flight.do_async("k", fetch) for _ in range(3)), return_exceptions=True)
+    
+    assert all(isinstance(r, ValueError) for r in asyncio.run(main()))
+    assert flight.stats()["errors"] == 1
+
+def test_sync_leader_with_deadline_runs_on_the_bounded_pool():
+    flight = SingleFlight(max_workers=1)
+    threads = []
+    
+    def fetch():
+        threads.append(threading.current_thread().name)
+        return "ok"
+    
+    try:
+        with deadline_scope(Deadline(5)):
+            assert [flight.do(i, fetch) for i in range(3)] == ["ok"] * 3
+        assert len(set(threads)) == 1 and threads[0].startswith("llm-singleflight")
+    finally:
+        flight.shutdown()
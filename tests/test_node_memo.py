@@ -0,0 +1,57 @@
+"""节点结果记忆：macore的MemoCache，以及塔罗菜单节点只记忆LLM生成的回复"""
+
+import pytest
+
+from macore import MemoCache, Node
+from nodes import TopicSelectionNode
+from utils.node_memo import set_node_memo, get_node_memo
+from utils.response_templates import TemplateEngine, set_template_engine, get_template_engine
+
+class Counting(Node):
+    def __init__(self, memo):
+        super().__init__()
+        self.memo, self.calls = memo, 0
+    
+    def prep(self, shared):
+        return shared["input"]
+    
+    def memo_key(self, prep_res):
+        return None if prep_res == "skip" else prep_res
+    
+    def exec(self, prep_res):
+        self.calls += 1
+        return self.calls
+
+def test_exec_results_are_memoized_by_key():
+    node = Counting(MemoCache(16))
+    assert [node.run({"input": x}) for x in ("a", "a", "b")] == [None] * 3
+    assert node.calls == 2
+
+def test_memo_key_none_skips_memoization():
+    node = Counting(MemoCache(16))
+    node.run({"input": "skip"})
+    node.run({"input": "skip"})
+    assert node.calls == 2
+
+@pytest.fixture
+def memo_and_templates():
+    memo, engine = get_node_memo(), get_template_engine()
+    set_node_memo(MemoCache(16))
+    yield
+    set_node_memo(memo)
+    set_template_engine(engine)
+
+def topic_menu():
+    shared = {"user_session": {"conversation_history": []}}
+    TopicSelectionNode().run(shared)
+    return shared["user_session"]["conversation_history"][-1]["message"]
+
+def test_template_rendered_menus_are_not_memoized(memo_and_templates):
+    set_template_engine(TemplateEngine(["topic_menu"], seed=1))
+    assert len({topic_menu() for _ in range(20)}) > 1
+    assert get_node_memo().stats()["size"] == 0
+
+def test_llm_rendered_menus_are_memoized(memo_and_templates):
+    set_template_engine(None)
+    assert topic_menu() == topic_menu()
+    assert get_node_memo().stats()["hits"] == 1
@@ -0,0 +1,148 @@
+"""AsyncParallelBatchNode/Flow：并发上限、惰性读取、完成顺序回调、失败隔离与截止时间"""
+
+import asyncio
+
+import pytest
+
+from macore import AsyncNode, AsyncParallelBatchFlow, AsyncParallelBatchNode, DeadlineExceeded, deadline_scope
+
+class Squares(AsyncParallelBatchNode):
+    def __init__(self, items, delays=None, **kwargs):
+        super().__init__(**kwargs)
+        self.items, self.delays = items, delays or {}
+        self.running = self.peak = 0
+        self.done_order = []
+    
+    async def prep_async(self, shared):
+        return self.items
+    
+    async def exec_async(self, item):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(self.delays.get(item, 0.01))
+            if item == "bad":
+                raise ValueError("bad item")
+            if item == "late":
+                raise DeadlineExceeded("deadline exceeded")
+            return item * item
+        finally:
+            self.running -= 1
+    
+    async def item_done_async(self, index, item, result):
+        self.done_order.append((index, result))
+    
+    async def post_async(self, shared, prep_res, exec_res):
+        shared["results"] = exec_res
+
+def run_node(node):
+    shared = {}
+    asyncio.run(node.run_async(shared))
+    return shared["results"]
+
+def test_concurrency_is_capped_and_results_keep_item_order():
+    node = Squares(list(range(8)), max_concurrency=3)
+    assert run_node(node) == [i * i for i in range(8)]
+    assert node.peak == 3
+
+def test_generator_items_are_pulled_lazily():
+    pulled = []
+    
+    def items():
+        for i in range(100):
+            pulled.append(i)
+            yield i
+    
+    node = Squares(items(), max_concurrency=2, as_completed=True)
+    seen_when_done = []
+    
+    async def item_done_async(index, item, result):
+        seen_when_done.append(len(pulled))
+    
+    node.item_done_async = item_done_async
+    assert run_node(node) is None
+    assert len(pulled) == 100
+    # 第一个结果完成时只读取了两个元素
+    assert seen_when_done[0] == 2
+
+def test_as_completed_reports_in_completion_order():
+    node = Squares([1, 2, 3], delays={1: 0.09, 2: 0.05, 3: 0.01}, as_completed=True)
+    assert run_node(node) is None
+    assert node.done_order == [(2, 9), (1, 4), (0, 1)]
+
+def test_isolated_failures_become_results():
+    results = run_node(Squares([1, "bad", 3], isolate_failures=True))
+    assert results[0] == 1 and results[2] == 9
+    assert isinstance(results[1], ValueError)
+
+def test_failures_abort_without_isolation():
+    with pytest.raises(ValueError):
+        run_node(Squares([1, "bad", 3]))
+
+def test_deadline_exceeded_is_never_isolated():
+    with pytest.raises(DeadlineExceeded):
+        run_node(Squares([1, "late", 3], isolate_failures=True))
+
+class Reading(AsyncNode):
+    def __init__(self):
+        super().__init__()
+        # 流程每次运行都使用节点的副本，计数放在副本共享的字典中
+        self.concurrency = {"running": 0, "peak": 0}
+    
+    async def exec_async(self, prep_res):
+        concurrency = self.concurrency
+        concurrency["running"] += 1
+        concurrency["peak"] = max(concurrency["peak"], concurrency["running"])
+        try:
+            await asyncio.sleep(self.params["delay"])
+            if self.params.get("fail"):
+                raise ValueError(self.params["name"])
+            return self.params["name"]
+        finally:
+            concurrency["running"] -= 1
+    
+    async def post_async(self, shared, prep_res, exec_res):
+        shared.setdefault("read", []).append(exec_res)
+        return "done"
+
+class Readings(AsyncParallelBatchFlow):
+    def __init__(self, batch, **kwargs):
+        self.reading = Reading()
+        super().__init__(start=self.reading, **kwargs)
+        self.batch = batch
+        self.finished = []
+    
+    async def prep_async(self, shared):
+        return self.batch
+    
+    async def batch_done_async(self, index, params, result):
+        self.finished.append((params["name"], result))
+
+def test_flow_caps_concurrent_runs_and_reports_each_as_it_finishes():
+    batch = [{"name": name, "delay": delay} for name, delay in (("a", 0.1), ("b", 0.02), ("c", 0.02), ("d", 0.02))]
+    flow = Readings(batch, batch_concurrency=2)
+    shared = {}
+    asyncio.run(flow.run_async(shared))
+    assert flow.reading.concurrency["peak"] == 2
+    assert sorted(shared["read"]) == ["a", "b", "c", "d"]
+    assert [name for name, _ in flow.finished] == ["b", "c", "d", "a"]
+    assert all(result == "done" for _, result in flow.finished)
+
+def test_flow_isolates_failed_runs():
+    batch = [{"name": "a", "delay": 0.01}, {"name": "b", "delay": 0.02, "fail": True}]
+    flow = Readings(batch, isolate_failures=True)
+    asyncio.run(flow.run_async({}))
+    results = dict(flow.finished)
+    assert results["a"] == "done" and isinstance(results["b"], ValueError)
+
+def test_flow_deadline_aborts_even_with_isolated_failures():
+    batch = [{"name": name, "delay": 0.04} for name in "abcd"]
+    flow = Readings(batch, batch_concurrency=1, isolate_failures=True)
+    
+    async def main():
+        with deadline_scope(0.06):
+            await flow.run_async({})
+    
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(main())
+    assert len(flow.finished) < len(batch)
@@ -0,0 +1,67 @@
+"""ProcessPoolNode/ProcessBatchNode：在工作进程中运行exec"""
+
+import asyncio
+import os
+import time
+
+import pytest
+
+from macore import AsyncFlow, Deadline, DeadlineExceeded, ProcessBatchNode, ProcessPoolNode, deadline_scope, shutdown_process_pool
+
+@pytest.fixture(autouse=True, scope="module")
+def process_pool():
+    yield
+    shutdown_process_pool()
+
+class Square(ProcessBatchNode):
+    async def prep_async(self, shared):
+        return shared["items"]
+    
+    def exec(self, item):
+        if item == self.params.get("fail"):
+            raise ValueError(f"bad item {item}")
+        return item * item, os.getpid()
+    
+    def exec_fallback(self, item, exc):
+        return str(exc), None
+    
+    async def post_async(self, shared, prep_res, exec_res):
+        shared["results"] = exec_res
+
+class Sleep(ProcessPoolNode):
+    def exec(self, prep_res):
+        time.sleep(1)
+
+class Unpicklable(ProcessPoolNode):
+    async def prep_async(self, shared):
+        return lambda: None
+
+def test_batch_runs_in_workers_in_item_order():
+    flow = AsyncFlow(start=Square(chunk_size=3)).compile()
+    shared = {"items": list(range(10))}
+    asyncio.run(flow.run_async(shared))
+    assert [square for square, _ in shared["results"]] == [i * i for i in range(10)]
+    assert os.getpid() not in {pid for _, pid in shared["results"]}
+
+def test_failed_item_falls_back_without_failing_its_chunk():
+    node = Square(chunk_size=4)
+    node.set_params({"fail": 5})
+    shared = {"items": list(range(8))}
+    asyncio.run(node.run_async(shared))
+    assert shared["results"][5] == ("bad item 5", None)
+    assert [square for square, _ in shared["results"][4:8:2]] == [16, 36]
+
+def test_timeout_and_deadline_bound_the_wait():
+    with pytest.raises(TimeoutError):
+        asyncio.run(Sleep(timeout=0.2).run_async({}))
+    
+    async def run_with_deadline():
+        with deadline_scope(Deadline(0.2)):
+            await Sleep().run_async({})
+    
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run_with_deadline())
+
+def test_unpicklable_prep_res_is_reported_in_the_caller():
+    with pytest.raises(TypeError, match="picklable"):
+        asyncio.run(Unpicklable().run_async({}))
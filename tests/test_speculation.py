@@ -0,0 +1,98 @@
+"""投机执行：命中、提示不一致、开始前失败和放弃时解读节点的行为"""
+
+import asyncio
+
+import pytest
+
+import nodes
+from nodes import AsyncStreamingTarotNode, reading_scope
+from utils.speculation import SpeculationDiscarded, SpeculativeResult, speculation_stats
+
+class EchoReadingNode(AsyncStreamingTarotNode):
+    def build_prompt(self, prep_res):
+        return prep_res
+    
+    def llm_options(self):
+        return {}
+    
+    async def respond_async(self, prep_res):
+        return "live"
+
+async def live_stream(prompt, **kwargs):
+    yield "li"
+    yield "ve"
+
+def stat_delta(field, fn):
+    before = speculation_stats.snapshot()[field]
+    result = fn()
+    return result, speculation_stats.snapshot()[field] - before
+
+def test_hit_uses_speculated_text():
+    async def run():
+        speculation = SpeculativeResult()
+        speculation.begin("prompt")
+        speculation.push("spec")
+        speculation.push("ulated")
+        speculation.finish()
+        with reading_scope(speculation):
+            return await EchoReadingNode().exec_async("prompt")
+    
+    result, hits = stat_delta("hits", lambda: asyncio.run(run()))
+    assert (result, hits) == ("speculated", 1)
+
+def test_mismatch_generates_live():
+    async def run():
+        speculation = SpeculativeResult()
+        speculation.begin("other prompt")
+        speculation.push("stale")
+        speculation.finish()
+        with reading_scope(speculation):
+            return await EchoReadingNode().exec_async("prompt")
+    
+    result, mismatches = stat_delta("mismatches", lambda: asyncio.run(run()))
+    assert (result, mismatches) == ("live", 1)
+
+def test_failure_before_first_chunk_streams_live(monkeypatch):
+    monkeypatch.setattr(nodes, "stream_tarot_llm_async", live_stream)
+    
+    async def run():
+        speculation = SpeculativeResult()
+        speculation.begin("prompt")
+        speculation.finish(RuntimeError("provider down"))
+        stream = asyncio.Queue()
+        with reading_scope(speculation, stream):
+            result = await EchoReadingNode().exec_async("prompt")
+        return result, [stream.get_nowait() for _ in range(stream.qsize())]
+    
+    result, failures = stat_delta("failures", lambda: asyncio.run(run()))
+    assert result == ("live", ["li", "ve"])
+    assert failures == 1
+
+def test_discard_wakes_waiting_consumer_with_ordinary_exception():
+    async def run():
+        speculation = SpeculativeResult()
+        speculation.begin("prompt")
+        producer = asyncio.create_task(asyncio.sleep(10))
+        speculation.task = producer
+        waiter = asyncio.create_task(speculation.result())
+        await asyncio.sleep(0)
+        speculation.cancel()
+        with pytest.raises(SpeculationDiscarded):
+            await waiter
+        with pytest.raises(asyncio.CancelledError):
+            await producer
+    
+    asyncio.run(run())
+
+def test_discard_while_node_waits_falls_back_to_live():
+    async def run():
+        speculation = SpeculativeResult()
+        speculation.begin("prompt")
+        speculation.push("partial")
+        with reading_scope(speculation):
+            node = asyncio.create_task(EchoReadingNode().exec_async("prompt"))
+            await asyncio.sleep(0.01)
+            speculation.cancel()
+            return await node
+    
+    assert asyncio.run(run()) == "live"
@@ -0,0 +1,70 @@
+"""SSE流式接口：片段和完成事件的格式、超时时的error事件、步骤不对时返回409"""
+
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import nodes
+
+@pytest.fixture
+def client():
+    import main
+    with TestClient(main.app) as client:
+        yield client
+
+def step(client, session_id, name, **data):
+    response = client.post("/api/v1/divination/step", json={"session_id": session_id, "step": name, "data": data})
+    assert response.status_code == 200, response.json()
+    return response.json()
+
+def session_at_interpretation(client):
+    session_id = client.post("/api/v1/divination/start", json={}).json()["session_id"]
+    step(client, session_id, "select_topic", topic="love")
+    step(client, session_id, "select_spread", spread="single")
+    step(client, session_id, "draw_cards")
+    return session_id
+
+def read_events(response):
+    events = []
+    for block in response.text.split("\n\n"):
+        if block.strip():
+            event, data = block.split("\n")
+            assert event.startswith("event: ") and data.startswith("data: ")
+            events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+def test_stream_sends_tokens_then_done(client):
+    session_id = session_at_interpretation(client)
+    response = client.get(f"/api/v1/divination/{session_id}/stream")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    
+    events = read_events(response)
+    names = [name for name, _ in events]
+    assert names[-1] == "done" and set(names[:-1]) == {"token"} and len(names) > 1
+    done = events[-1][1]
+    text = "".join(data["text"] for _, data in events[:-1])
+    assert done["next_step"] == "advice"
+    assert done["data"]["interpretation"] == text
+
+def test_stream_sends_error_event_on_timeout(client, monkeypatch):
+    async def slow_stream(prompt, **kwargs):
+        await asyncio.sleep(5)
+        yield "late"
+    
+    # 预生成和实时生成都使用这个函数
+    monkeypatch.setattr(nodes, "stream_tarot_llm_async", slow_stream)
+    session_id = session_at_interpretation(client)
+    response = client.get(f"/api/v1/divination/{session_id}/stream", headers={"X-Request-Timeout": "0.2"})
+    assert response.status_code == 200
+    assert [name for name, _ in read_events(response)] == ["error"]
+
+def test_stream_rejects_a_step_the_flow_is_not_at(client):
+    session_id = client.post("/api/v1/divination/start", json={}).json()["session_id"]
+    assert client.get(f"/api/v1/divination/{session_id}/stream").status_code == 409
+    
+    session_id = session_at_interpretation(client)
+    assert client.get(f"/api/v1/divination/{session_id}/stream", params={"step": "get_advice"}).status_code == 409
+    assert client.get(f"/api/v1/divination/{session_id}/stream", params={"step": "draw_cards"}).status_code == 400
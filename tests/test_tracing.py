@@ -0,0 +1,76 @@
+"""节点计时：一次Flow.run产生一棵嵌套的span，MemorySink按节点汇总各阶段耗时"""
+
+import time
+
+import pytest
+
+from macore import Flow, MemorySink, Node, Tracer, get_trace_stats, get_tracer, set_tracer
+
+class Step(Node):
+    def __init__(self, delay=0.0, failures=0, **kwargs):
+        super().__init__(**kwargs)
+        self.delay, self.failures = delay, failures
+    
+    def exec(self, prep_res):
+        time.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("retry me")
+        return "ok"
+
+class First(Step): pass
+class Inner(Step): pass
+class Last(Step): pass
+class Outer(Flow): pass
+class Nested(Flow): pass
+
+class ListSink:
+    def __init__(self):
+        self.spans = []
+    
+    def emit(self, span):
+        self.spans.append(span)
+
+@pytest.fixture
+def sinks():
+    previous = get_tracer()
+    memory, spans = MemorySink(), ListSink()
+    set_tracer(Tracer(memory, spans))
+    try:
+        yield memory, spans
+    finally:
+        set_tracer(previous)
+
+def build_flow():
+    inner = Inner(delay=0.02, failures=1, max_retries=2)
+    first = First(delay=0.01)
+    first >> Nested(start=inner) >> Last()
+    return Outer(start=first)
+
+def test_one_run_emits_one_nested_span_tree(sinks):
+    memory, spans = sinks
+    build_flow().run({})
+    assert len(spans.spans) == 1
+    root = spans.spans[0]
+    assert [(depth, span.name) for depth, span in root.walk()] == [
+        (0, "Outer"), (1, "First"), (1, "Nested"), (2, "Inner"), (1, "Last")
+    ]
+    first, nested, last = root.children
+    inner = nested.children[0]
+    assert set(first.phases) == {"prep", "exec", "post"}
+    assert first.phases["exec"] >= 0.01
+    assert inner.attempts == 2 and inner.phases["exec"] >= 0.04
+    assert root.duration >= first.duration + nested.duration + last.duration
+    
+    stats = memory.stats()
+    assert stats["Inner"]["runs"] == 1 and stats["Inner"]["attempts"] == 2
+    assert stats["First"]["phases"]["exec"]["count"] == 1
+    assert stats["First"]["phases"]["total"]["max"] == pytest.approx(first.duration)
+    assert get_trace_stats()["nodes"]["Outer"]["runs"] == 1
+
+def test_no_spans_are_recorded_without_a_tracer(sinks):
+    memory, spans = sinks
+    set_tracer(None)
+    build_flow().run({})
+    assert spans.spans == [] and memory.stats() == {}
+    assert get_trace_stats() == {"enabled": False}
@@ -1,78 +1,1072 @@
+import asyncio
 import os
-from typing import Optional, List, Dict, Any
+import threading
+import time
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple, Union
 import dotenv
 
+from macore import DeadlineExceeded, current_deadline
+from .llm_cache import ResponseCache, make_cache_key
+from .llm_singleflight import SingleFlight
+from .llm_router import ProviderRouter
+from .llm_hedging import Hedger
+from .llm_limiter import ProviderLimiter
+from .llm_cassette import Cassette
+from .llm_model_routes import ModelRoute, ModelRouteTable
+from .llm_usage import UsageScope, UsageTracker, current_usage_scope, extract_usage
+
 dotenv.load_dotenv()
 
-def call_llm(prompt: str, provider: Optional[str] = None) -> str:
+# 限流排队优先级：high/normal/low/background或数值，越小越优先
+Priority = Union[str, int, None]
+
+SUPPORTED_PROVIDERS = ("openai", "gemini", "deepseek", "stub")
+
+# 各提供商的API密钥、默认模型和接口地址
+PROVIDER_SETTINGS: Dict[str, Dict[str, Optional[str]]] = {
+    "openai": {"api_key_env": "OPENAI_API_KEY", "model_env": "OPENAI_MODEL",
+               "default_model": "gpt-5-mini", "base_url": None},
+    "gemini": {"api_key_env": "GEMINI_API_KEY", "model_env": "GEMINI_MODEL",
+               "default_model": "gemini-2.5-flash", "base_url": None},
+    # DeepSeek uses OpenAI-compatible API
+    "deepseek": {"api_key_env": "DEEPSEEK_API_KEY", "model_env": "DEEPSEEK_MODEL",
+                 "default_model": "deepseek-chat", "base_url": "https://api.deepseek.com/v1"},
+    # 本地桩LLM（utils/llm_stub.py），用于离线压测，不需要真实密钥
+    "stub": {"api_key_env": "LLM_STUB_API_KEY", "model_env": "LLM_STUB_MODEL",
+             "default_model": "stub-tarot", "base_url": None, "default_api_key": "stub"},
+}
+
+def resolve_provider(provider: Optional[str] = None) -> str:
     """
-    Call LLM with support for multiple providers.
+    Resolve the provider name, falling back to LLM_PROVIDER or 'openai'.
     
-    Args:
-        prompt: The prompt to send to the LLM
-        provider: LLM provider to use ('openai', 'gemini', 'deepseek'). 
-                 If None, uses LLM_PROVIDER env var or defaults to 'openai'
+    Raises:
+        ValueError: If the provider is not supported
+    """
+    if provider is None:
+        provider = os.getenv("LLM_PROVIDER", "openai")
+    provider = provider.lower()
+    if provider not in PROVIDER_SETTINGS:
+        raise ValueError(f"Unsupported provider: {provider}. Choose from: {', '.join(SUPPORTED_PROVIDERS)}")
+    return provider
+
+def get_model_name(provider: str) -> str:
+    """获取提供商当前配置的模型名称"""
+    settings = PROVIDER_SETTINGS[provider]
+    return os.getenv(settings["model_env"], settings["default_model"])
+
+def _get_api_key(provider: str) -> str:
+    env_name = PROVIDER_SETTINGS[provider]["api_key_env"]
+    api_key = os.getenv(env_name, PROVIDER_SETTINGS[provider].get("default_api_key"))
+    if not api_key:
+        raise ValueError(f"{env_name} not found in environment variables")
+    return api_key
+
+def _get_base_url(provider: str) -> Optional[str]:
+    if provider == "stub":
+        # 未指定外部桩服务时在进程内启动一个
+        from .llm_stub import ensure_stub_server
+        return os.getenv("LLM_STUB_BASE_URL") or ensure_stub_server().base_url
+    return PROVIDER_SETTINGS[provider]["base_url"]
+
+def _import_genai():
+    try:
+        import google.generativeai as genai
+    except ImportError:
+        raise ImportError("Please install google-generativeai: pip install google-generativeai")
+    return genai
+
+def get_pool_limits() -> Dict[str, Any]:
+    """
+    从环境变量读取连接池限制
     
     Returns:
-        The LLM response as a string
+        Dict: max_connections / max_keepalive_connections / keepalive_expiry
     """
-    # Determine provider
-    if provider is None:
-        provider = os.getenv("LLM_PROVIDER", "openai").lower()
+    return {
+        "max_connections": int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "100")),
+        "max_keepalive_connections": int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20")),
+        "keepalive_expiry": float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "30")),
+    }
+
+class LLMClientRegistry:
+    """
+    LLM客户端注册表
+    
+    每个提供商的客户端在进程内只创建一次，之后所有调用复用同一个
+    keep-alive连接池，避免每次调用都重新握手。可以被多个线程同时使用。
+    """
+    
+    def __init__(self, **pool_limits):
+        self._lock = threading.RLock()
+        self._clients: Dict[str, Any] = {}
+        self._async_clients: Dict[str, Any] = {}
+        self._gemini_models: Dict[tuple, Any] = {}
+        self._pool_limits = {**get_pool_limits(), **pool_limits}
+    
+    @property
+    def pool_limits(self) -> Dict[str, Any]:
+        return dict(self._pool_limits)
     
-    if provider == "openai":
-        from openai import OpenAI
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
+    def configure(self, **pool_limits) -> None:
+        """
+        更新连接池限制，已创建的客户端会被关闭并在下次使用时按新配置重建
         
-        client = OpenAI(api_key=api_key)
-        model = os.getenv("OPENAI_MODEL", "gpt-5-mini")
+        Args:
+            **pool_limits: max_connections / max_keepalive_connections / keepalive_expiry
+        """
+        unknown = set(pool_limits) - set(self._pool_limits)
+        if unknown:
+            raise ValueError(f"Unknown pool limits: {sorted(unknown)}")
+        with self._lock:
+            self._pool_limits.update(pool_limits)
+            self.close()
+    
+    def get(self, provider: Optional[str] = None) -> Any:
+        """
+        获取提供商的客户端，首次调用时创建
         
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return response.choices[0].message.content
+        Args:
+            provider: LLM提供商，None时使用LLM_PROVIDER
+        
+        Returns:
+            OpenAI客户端（openai/deepseek）或已配置的genai模块（gemini）
+        """
+        provider = resolve_provider(provider)
+        client = self._clients.get(provider)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(provider)
+            if client is None:
+                client = self._build(provider)
+                self._clients[provider] = client
+            return client
     
-    elif provider == "gemini":
-        try:
-            import google.generativeai as genai
-        except ImportError:
-            raise ImportError("Please install google-generativeai: pip install google-generativeai")
+    def get_async(self, provider: Optional[str] = None) -> Any:
+        """
+        获取提供商的异步客户端，首次调用时创建
         
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment variables")
+        异步连接池绑定在创建它的事件循环上，应在应用的主事件循环中使用。
         
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel(os.getenv("GEMINI_MODEL", "gemini-2.5-flash"))
-        response = model.generate_content(prompt)
-        return response.text
-    
-    elif provider == "deepseek":
-        from openai import OpenAI
-        api_key = os.getenv("DEEPSEEK_API_KEY")
-        if not api_key:
-            raise ValueError("DEEPSEEK_API_KEY not found in environment variables")
+        Args:
+            provider: LLM提供商，None时使用LLM_PROVIDER
         
-        # DeepSeek uses OpenAI-compatible API
-        client = OpenAI(
+        Returns:
+            AsyncOpenAI客户端（openai/deepseek）或已配置的genai模块（gemini）
+        """
+        provider = resolve_provider(provider)
+        client = self._async_clients.get(provider)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._async_clients.get(provider)
+            if client is None:
+                client = self._build(provider, use_async=True)
+                self._async_clients[provider] = client
+            return client
+    
+    def get_gemini_model(self, system_instruction: Optional[str] = None, model_name: Optional[str] = None) -> Any:
+        """获取（并缓存）指定模型和系统提示的Gemini模型对象，model_name为None时使用GEMINI_MODEL"""
+        genai = self.get("gemini")
+        key = (model_name or get_model_name("gemini"), system_instruction)
+        model = self._gemini_models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._gemini_models.get(key)
+                if model is None:
+                    kwargs = {"system_instruction": system_instruction} if system_instruction else {}
+                    model = genai.GenerativeModel(key[0], **kwargs)
+                    self._gemini_models[key] = model
+        return model
+    
+    def _build(self, provider: str, use_async: bool = False) -> Any:
+        if provider == "gemini":
+            # genai.configure是全局配置，同步和异步调用共用
+            if "gemini" in self._clients:
+                return self._clients["gemini"]
+            genai = _import_genai()
+            genai.configure(api_key=_get_api_key(provider))
+            self._clients["gemini"] = genai
+            return genai
+        
+        import httpx
+        from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+        api_key = _get_api_key(provider)
+        base_url = _get_base_url(provider)
+        limits = httpx.Limits(**self._pool_limits)
+        if use_async:
+            return AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=DefaultAsyncHttpxClient(limits=limits)
+            )
+        return OpenAI(
             api_key=api_key,
-            base_url="https://api.deepseek.com/v1"
+            base_url=base_url,
+            http_client=DefaultHttpxClient(limits=limits)
         )
-        model = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+    
+    def warmup(self, providers: Optional[List[str]] = None, connect: bool = False,
+               include_async: bool = False) -> List[str]:
+        """
+        预先创建客户端，可选地提前建立连接
         
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return response.choices[0].message.content
+        Args:
+            providers: 需要预热的提供商，None时只预热默认提供商
+            connect: 是否发送一次轻量请求以提前完成TLS握手
+            include_async: 是否同时创建异步客户端
+        
+        Returns:
+            List[str]: 成功预热的提供商
+        """
+        warmed = []
+        for provider in providers or [resolve_provider()]:
+            try:
+                client = self.get(provider)
+                if connect and provider != "gemini":
+                    client.models.list()
+                if include_async:
+                    self.get_async(provider)
+                warmed.append(provider)
+            except Exception as e:
+                print(f"LLM客户端预热失败 ({provider}): {e}")
+        return warmed
+    
+    def close(self) -> None:
+        """关闭所有同步客户端并释放连接池，异步客户端需要使用aclose"""
+        with self._lock:
+            clients, self._clients = self._clients, {}
+            self._gemini_models = {}
+        for provider, client in clients.items():
+            if provider != "gemini":
+                client.close()
+    
+    async def aclose(self) -> None:
+        """关闭所有异步和同步客户端"""
+        with self._lock:
+            async_clients, self._async_clients = self._async_clients, {}
+        for provider, client in async_clients.items():
+            if provider != "gemini":
+                await client.close()
+        self.close()
+
+# 进程级共享的客户端注册表
+client_registry = LLMClientRegistry()
+
+def get_client(provider: Optional[str] = None) -> Any:
+    """获取共享注册表中的提供商客户端"""
+    return client_registry.get(provider)
+
+def configure_llm_pool(**pool_limits) -> None:
+    """修改共享注册表的连接池限制"""
+    client_registry.configure(**pool_limits)
+
+def get_async_client(provider: Optional[str] = None) -> Any:
+    """获取共享注册表中的提供商异步客户端"""
+    return client_registry.get_async(provider)
+
+def warmup_llm_clients(providers: Optional[List[str]] = None, connect: Optional[bool] = None,
+                       include_async: bool = False) -> List[str]:
+    """
+    预热共享注册表中的客户端，在应用启动时调用
+    
+    Args:
+        providers: 需要预热的提供商，None时预热路由池中的提供商（未启用路由时只预热默认提供商）
+        connect: 是否提前建立连接，None时读取LLM_WARMUP_CONNECT
+        include_async: 是否同时创建异步客户端
+    """
+    if providers is None and _router is not None:
+        providers = _router.providers
+    if connect is None:
+        connect = os.getenv("LLM_WARMUP_CONNECT", "false").lower() == "true"
+    return client_registry.warmup(providers, connect=connect, include_async=include_async)
+
+def close_llm_clients() -> None:
+    """关闭共享注册表中的同步客户端"""
+    client_registry.close()
+
+async def aclose_llm_clients() -> None:
+    """关闭共享注册表中的全部客户端，在应用关闭时调用"""
+    await client_registry.aclose()
+    if _hedger is not None:
+        _hedger.shutdown()
+
+def _default_routing_providers() -> List[str]:
+    configured = os.getenv("LLM_ROUTING_PROVIDERS")
+    if configured:
+        return [resolve_provider(p.strip()) for p in configured.split(",") if p.strip()]
+    # 默认提供商优先，其余已配置API密钥的提供商作为备用
+    primary = resolve_provider()
+    return [primary] + [p for p in SUPPORTED_PROVIDERS
+                        if p != primary and os.getenv(PROVIDER_SETTINGS[p]["api_key_env"])]
+
+def _default_router() -> Optional[ProviderRouter]:
+    if os.getenv("LLM_ROUTING_ENABLED", "false").lower() != "true":
+        return None
+    return ProviderRouter(
+        _default_routing_providers(),
+        failure_threshold=int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5")),
+        cooldown=float(os.getenv("LLM_CIRCUIT_COOLDOWN", "30")),
+        explore_rate=float(os.getenv("LLM_ROUTING_EXPLORE_RATE", "0.05"))
+    )
+
+# 多提供商路由器，None表示只使用LLM_PROVIDER
+_router = _default_router()
+
+def get_router() -> Optional[ProviderRouter]:
+    """获取当前使用的提供商路由器"""
+    return _router
+
+def set_router(router: Optional[ProviderRouter]) -> None:
+    """
+    替换提供商路由器
+    
+    Args:
+        router: ProviderRouter实例，None表示关闭路由
+    """
+    global _router
+    _router = router
+
+def get_llm_routing_snapshot() -> Dict[str, Any]:
+    """获取路由状态：各提供商的熔断状态、延迟统计和最近的路由决策"""
+    router = _router
+    if router is None:
+        return {"enabled": False, "provider": resolve_provider()}
+    return {"enabled": True, **router.snapshot()}
+
+def _default_hedger() -> Optional[Hedger]:
+    if os.getenv("LLM_HEDGING_ENABLED", "false").lower() != "true":
+        return None
+    return Hedger(
+        percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95")),
+        min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5")),
+        min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")),
+        max_hedge_ratio=float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1"))
+    )
+
+# 对冲请求控制器，None表示不对冲
+_hedger = _default_hedger()
+
+def get_hedger() -> Optional[Hedger]:
+    """获取当前使用的对冲控制器"""
+    return _hedger
+
+def set_hedger(hedger: Optional[Hedger]) -> None:
+    """
+    替换对冲控制器
+    
+    Args:
+        hedger: Hedger实例，None表示关闭对冲
+    """
+    global _hedger
+    _hedger = hedger
+
+def get_llm_hedging_stats() -> Dict[str, Any]:
+    """获取对冲统计：对冲率、对冲获胜次数和估算节省的延迟"""
+    hedger = _hedger
+    if hedger is None:
+        return {"enabled": False}
+    return {"enabled": True, **hedger.stats()}
+
+def _limit_setting(provider: str, name: str, default: Optional[str] = None) -> Optional[int]:
+    value = os.getenv(f"LLM_LIMIT_{provider.upper()}_{name}", os.getenv(f"LLM_LIMIT_{name}", default))
+    return int(value) if value else None
+
+_limiters: Dict[str, ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(provider: str) -> Optional[ProviderLimiter]:
+    """
+    获取提供商的限流器，首次使用时按环境变量创建
+    
+    每个提供商可以用LLM_LIMIT_<PROVIDER>_CONCURRENCY/RPM/TPM单独配置，
+    未单独配置时使用LLM_LIMIT_CONCURRENCY/RPM/TPM。LLM_LIMITS_ENABLED=false时返回None。
+    """
+    limiter = _limiters.get(provider)
+    if limiter is not None or os.getenv("LLM_LIMITS_ENABLED", "true").lower() != "true":
+        return limiter
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            limiter = ProviderLimiter(
+                provider,
+                max_concurrency=_limit_setting(provider, "CONCURRENCY", "32"),
+                rpm=_limit_setting(provider, "RPM"),
+                tpm=_limit_setting(provider, "TPM")
+            )
+            _limiters[provider] = limiter
+        return limiter
+
+def set_limiter(provider: str, limiter: Optional[ProviderLimiter]) -> None:
+    """替换提供商的限流器，None表示恢复按环境变量创建"""
+    with _limiters_lock:
+        if limiter is None:
+            _limiters.pop(provider, None)
+        else:
+            _limiters[provider] = limiter
+
+def get_llm_limiter_stats() -> Dict[str, Any]:
+    """获取各提供商限流器的并发、队列深度和等待时间统计"""
+    return {provider: limiter.stats() for provider, limiter in list(_limiters.items())}
+
+def _default_model_routes() -> Optional[ModelRouteTable]:
+    if os.getenv("LLM_MODEL_ROUTING_ENABLED", "false").lower() != "true":
+        return None
+    return ModelRouteTable.from_env(SUPPORTED_PROVIDERS)
+
+# 按节点选择模型的路由表，None表示所有调用都使用提供商配置的模型
+_model_routes = _default_model_routes()
+
+def get_model_routes() -> Optional[ModelRouteTable]:
+    """获取当前的模型路由表"""
+    return _model_routes
+
+def set_model_routes(table: Optional[ModelRouteTable]) -> None:
+    """
+    替换模型路由表
+    
+    Args:
+        table: ModelRouteTable实例，None表示关闭按节点选择模型
+    """
+    global _model_routes
+    _model_routes = table
+
+def resolve_node_route(node: str, default: str) -> Optional[str]:
+    """
+    获取节点使用的模型路由名称
+    
+    Args:
+        node: 节点名称
+        default: 节点声明的默认路由
+    
+    Returns:
+        路由名称，未启用模型路由时返回None
+    """
+    table = _model_routes
+    return table.route_name(node, default) if table is not None else None
+
+def get_llm_model_routes_snapshot() -> Dict[str, Any]:
+    """获取模型路由表：各路由指定的模型、回复token上限和按节点的覆盖配置"""
+    table = _model_routes
+    if table is None:
+        return {"enabled": False}
+    return {"enabled": True, **table.describe()}
+
+def _model_route(options: Optional[Dict[str, Any]]) -> Optional[ModelRoute]:
+    table = _model_routes
+    if table is None or not options:
+        return None
+    return table.get(options.get("route"))
+
+def _model_for(provider: str, options: Optional[Dict[str, Any]] = None) -> str:
+    """获取本次请求在提供商上使用的模型：路由指定的模型，否则为提供商配置的模型"""
+    route = _model_route(options)
+    return (route.model_for(provider) if route is not None else None) or get_model_name(provider)
+
+def _default_cassette() -> Optional[Cassette]:
+    mode = os.getenv("LLM_CASSETTE_MODE", "off").lower()
+    if mode == "off":
+        return None
+    return Cassette(
+        os.getenv("LLM_CASSETTE_PATH", "cassettes/llm.jsonl"),
+        mode=mode,
+        speed=float(os.getenv("LLM_CASSETTE_SPEED", "1"))
+    )
+
+# 录制/回放cassette，None表示直接调用提供商
+_cassette = _default_cassette()
+
+def get_cassette() -> Optional[Cassette]:
+    """获取当前的录制/回放cassette"""
+    return _cassette
+
+def set_cassette(cassette: Optional[Cassette]) -> None:
+    """
+    替换录制/回放cassette
+    
+    Args:
+        cassette: Cassette实例，None表示关闭录制和回放
+    """
+    global _cassette
+    _cassette = cassette
+
+def get_llm_cassette_stats() -> Dict[str, Any]:
+    """获取录制/回放统计"""
+    cassette = _cassette
+    if cassette is None:
+        return {"enabled": False}
+    return {"enabled": True, **cassette.stats()}
+
+def _default_usage_tracker() -> Optional[UsageTracker]:
+    if os.getenv("LLM_USAGE_TRACKING_ENABLED", "true").lower() != "true":
+        return None
+    return UsageTracker()
+
+# token用量和提示缓存命中统计，None表示不统计
+_usage_tracker = _default_usage_tracker()
+
+def get_usage_tracker() -> Optional[UsageTracker]:
+    """获取当前的用量统计器"""
+    return _usage_tracker
+
+def set_usage_tracker(tracker: Optional[UsageTracker]) -> None:
+    """
+    替换用量统计器
+    
+    Args:
+        tracker: UsageTracker实例，None表示关闭用量统计
+    """
+    global _usage_tracker
+    _usage_tracker = tracker
+
+def get_llm_usage_stats() -> Dict[str, Any]:
+    """获取token用量、估算费用和耗时：总计、按提供商/模型（含提示缓存命中统计）、按模型路由和按节点"""
+    tracker = _usage_tracker
+    if tracker is None:
+        return {"enabled": False}
+    return {"enabled": True, **tracker.stats()}
+
+def _record_usage(provider: str, model: str, usage: Optional[Dict[str, int]], latency: float,
+                  options: Optional[Dict[str, Any]] = None, ttft: Optional[float] = None,
+                  scope: Optional[UsageScope] = None) -> None:
+    """记录一次调用的用量，scope为None时归属到当前上下文的usage_scope"""
+    tracker = _usage_tracker
+    if tracker is not None:
+        route = options.get("route") if options else None
+        tracker.record(provider, model, usage, latency, ttft, scope or current_usage_scope(), route)
+
+def _target_provider(provider: Optional[str]) -> Optional[str]:
+    """显式指定提供商时直接使用；未指定且启用了路由时返回None，由路由器选择"""
+    if provider is None and _router is not None:
+        return None
+    return resolve_provider(provider)
+
+def _request_key(provider: Optional[str], system_message: Optional[str], user_message: str,
+                 options: Optional[Dict[str, Any]] = None) -> str:
+    if provider is None:
+        # 路由请求的回复可能来自任一提供商，用路由池作为键的一部分
+        pool = _router.providers if _router is not None else []
+        return make_cache_key("auto", ",".join(f"{p}:{_model_for(p, options)}" for p in pool), system_message, user_message)
+    return make_cache_key(provider, _model_for(provider, options), system_message, user_message)
+
+def _default_response_cache() -> Optional[ResponseCache]:
+    if os.getenv("LLM_CACHE_ENABLED", "true").lower() != "true":
+        return None
+    return ResponseCache(
+        max_size=int(os.getenv("LLM_CACHE_MAX_SIZE", "512")),
+        ttl=float(os.getenv("LLM_CACHE_TTL", "3600")),
+        variants=int(os.getenv("LLM_CACHE_VARIANTS", "3"))
+    )
+
+# 进程级共享的响应缓存，None表示禁用
+_response_cache = _default_response_cache()
+
+def get_response_cache() -> Optional[Any]:
+    """获取当前使用的响应缓存"""
+    return _response_cache
+
+def set_response_cache(cache: Optional[Any]) -> None:
+    """
+    替换响应缓存
+    
+    Args:
+        cache: 实现了get(key)/put(key, value)/stats()/clear()的缓存对象，None表示禁用缓存
+    """
+    global _response_cache
+    _response_cache = cache
+
+def get_llm_cache_stats() -> Dict[str, Any]:
+    """获取响应缓存的命中统计"""
+    cache = _response_cache
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+def _cache_lookup(provider: Optional[str], system_message: Optional[str], user_message: str, use_cache: bool,
+                  options: Optional[Dict[str, Any]] = None):
+    """返回(缓存对象, 缓存键, 命中的回复)，不使用缓存时前两项为None"""
+    cache = _response_cache
+    if not use_cache or cache is None:
+        return None, None, None
+    key = _request_key(provider, system_message, user_message, options)
+    return cache, key, cache.get(key)
+
+# 合并同一时刻键相同的请求，只对允许缓存的提示生效
+_singleflight = SingleFlight(float(os.getenv("LLM_TIMEOUT", "60"))) if os.getenv("LLM_SINGLEFLIGHT_ENABLED", "true").lower() == "true" else None
+
+def get_llm_singleflight_stats() -> Dict[str, Any]:
+    """获取请求合并统计，coalesced即被合并掉的调用次数"""
+    if _singleflight is None:
+        return {"enabled": False}
+    return {"enabled": True, **_singleflight.stats()}
+
+def _build_messages(system_message: Optional[str], user_message: str) -> List[Dict[str, str]]:
+    messages = [{"role": "user", "content": user_message}]
+    if system_message is not None:
+        messages.insert(0, {"role": "system", "content": system_message})
+    return messages
+
+def _request_timeout() -> float:
+    """
+    本次请求的超时秒数：LLM_TIMEOUT与当前截止时间剩余预算中较小的一个
+    
+    Raises:
+        DeadlineExceeded: 截止时间已过或请求已被取消
+    """
+    timeout = float(os.getenv("LLM_TIMEOUT", "60"))
+    deadline = current_deadline()
+    if deadline is None:
+        return timeout
+    deadline.check()
+    remaining = deadline.remaining()
+    return timeout if remaining is None else min(timeout, remaining)
+
+def _deadline_budget() -> Optional[float]:
+    """当前截止时间的剩余秒数，用作限流排队的最长等待时间，没有截止时间时为None"""
+    deadline = current_deadline()
+    return deadline.remaining() if deadline is not None else None
+
+def _deadline_expired() -> bool:
+    deadline = current_deadline()
+    return deadline is not None and deadline.expired()
+
+def _provider_kwargs(provider: str, options: Optional[Dict[str, Any]], timeout: Optional[float] = None) -> Dict[str, Any]:
+    """把与提供商无关的请求选项（json_mode、模型路由的回复token上限、超时）转换为各提供商SDK的参数"""
+    kwargs = {}
+    generation_config = {}
+    if options and options.get("json_mode"):
+        if provider == "gemini":
+            generation_config["response_mime_type"] = "application/json"
+        else:
+            kwargs["response_format"] = {"type": "json_object"}
+    route = _model_route(options)
+    if route is not None and route.max_tokens:
+        if provider == "gemini":
+            generation_config["max_output_tokens"] = route.max_tokens
+        elif provider == "openai":
+            # OpenAI的推理模型只接受max_completion_tokens
+            kwargs["max_completion_tokens"] = route.max_tokens
+        else:
+            kwargs["max_tokens"] = route.max_tokens
+    if generation_config:
+        kwargs["generation_config"] = generation_config
+    if timeout is not None:
+        if provider == "gemini":
+            kwargs["request_options"] = {"timeout": timeout}
+        else:
+            kwargs["timeout"] = timeout
+    return kwargs
+
+def _call_provider(provider: str, system_message: Optional[str], user_message: str,
+                   options: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[Dict[str, int]]]:
+    """返回(回复文本, 用量)，提供商未返回用量时用量为None"""
+    if provider == "gemini":
+        model = client_registry.get_gemini_model(system_message, _model_for(provider, options))
+        response = model.generate_content(user_message, **_provider_kwargs(provider, options, _request_timeout()))
+        return response.text, extract_usage(provider, response)
+    
+    # 某些模型（如 gpt-5-mini）不支持自定义 temperature，使用默认值
+    response = get_client(provider).chat.completions.create(
+        model=_model_for(provider, options),
+        messages=_build_messages(system_message, user_message),
+        **_provider_kwargs(provider, options, _request_timeout())
+    )
+    return response.choices[0].message.content, extract_usage(provider, response)
+
+async def _call_provider_async(provider: str, system_message: Optional[str], user_message: str,
+                               options: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[Dict[str, int]]]:
+    if provider == "gemini":
+        model = client_registry.get_gemini_model(system_message, _model_for(provider, options))
+        response = await model.generate_content_async(user_message, **_provider_kwargs(provider, options, _request_timeout()))
+        return response.text, extract_usage(provider, response)
+    
+    response = await get_async_client(provider).chat.completions.create(
+        model=_model_for(provider, options),
+        messages=_build_messages(system_message, user_message),
+        **_provider_kwargs(provider, options, _request_timeout())
+    )
+    return response.choices[0].message.content, extract_usage(provider, response)
+
+def _chat(provider: str, system_message: Optional[str], user_message: str,
+          options: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[Dict[str, int]]]:
+    """调用提供商（或从cassette回放），记录用量，返回(回复文本, 用量)"""
+    cassette = _cassette
+    if cassette is not None and cassette.mode == "replay":
+        entry = cassette.lookup(system_message, user_message)
+        # 回放的等待同样受截止时间约束，超时或被取消时抛出DeadlineExceeded
+        deadline = current_deadline()
+        if deadline is None:
+            time.sleep(cassette.delay(entry["latency"]))
+        else:
+            deadline.sleep(cassette.delay(entry["latency"]))
+        _record_usage(entry["provider"], entry["model"], entry.get("usage"), entry["latency"], options)
+        return entry["text"], entry.get("usage")
+    start = time.perf_counter()
+    result, usage = _call_provider(provider, system_message, user_message, options)
+    latency = time.perf_counter() - start
+    _record_usage(provider, _model_for(provider, options), usage, latency, options)
+    if cassette is not None:
+        cassette.record(provider, _model_for(provider, options), system_message, user_message,
+                        result, latency, usage=usage)
+    return result, usage
+
+async def _chat_async(provider: str, system_message: Optional[str], user_message: str,
+                      options: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[Dict[str, int]]]:
+    cassette = _cassette
+    if cassette is not None and cassette.mode == "replay":
+        entry = cassette.lookup(system_message, user_message)
+        await asyncio.sleep(cassette.delay(entry["latency"]))
+        _record_usage(entry["provider"], entry["model"], entry.get("usage"), entry["latency"], options)
+        return entry["text"], entry.get("usage")
+    start = time.perf_counter()
+    result, usage = await _call_provider_async(provider, system_message, user_message, options)
+    latency = time.perf_counter() - start
+    _record_usage(provider, _model_for(provider, options), usage, latency, options)
+    if cassette is not None:
+        cassette.record(provider, _model_for(provider, options), system_message, user_message,
+                        result, latency, usage=usage)
+    return result, usage
+
+async def _stream_chat_async(provider: str, system_message: Optional[str], user_message: str,
+                             options: Optional[Dict[str, Any]] = None,
+                             usage_out: Optional[Dict[str, int]] = None) -> AsyncIterator[str]:
+    """流式调用提供商（或从cassette回放），结束后把用量写入usage_out"""
+    # 用量在流结束时才记录，那时的上下文可能已经不是发起调用的节点
+    scope = current_usage_scope()
+    cassette = _cassette
+    if cassette is not None and cassette.mode == "replay":
+        entry = cassette.lookup(system_message, user_message)
+        # 非流式录制的条目在原始耗时后一次性产出
+        chunks = entry.get("chunks") or [[entry["latency"], entry["text"]]]
+        start = time.perf_counter()
+        for offset, piece in chunks:
+            # 按相对开始的时刻等待，避免逐片段sleep的误差累积
+            await asyncio.sleep(max(0.0, cassette.delay(offset) - (time.perf_counter() - start)))
+            yield piece
+        _record_usage(entry["provider"], entry["model"], entry.get("usage"), entry["latency"], options, chunks[0][0], scope)
+        if usage_out is not None and entry.get("usage"):
+            usage_out.update(entry["usage"])
+        return
+    start = time.perf_counter()
+    chunks = []
+    usage = {}
+    async for piece in _stream_provider_async(provider, system_message, user_message, options, usage):
+        chunks.append([time.perf_counter() - start, piece])
+        yield piece
+    latency = time.perf_counter() - start
+    _record_usage(provider, _model_for(provider, options), usage or None, latency, options,
+                  chunks[0][0] if chunks else None, scope)
+    if usage_out is not None:
+        usage_out.update(usage)
+    if cassette is not None:
+        cassette.record(provider, _model_for(provider, options), system_message, user_message,
+                        "".join(piece for _, piece in chunks), latency, chunks, usage or None)
+
+def _route_order(provider: Optional[str]):
+    """返回(路由决策, 依次尝试的提供商)，显式指定提供商或未启用路由时不生成决策"""
+    router = _router
+    if provider is None and router is not None:
+        decision = router.route()
+        return decision, decision["order"]
+    return None, [provider or resolve_provider()]
+
+def _estimate_tokens(system_message: Optional[str], user_message: str) -> int:
+    # 中文提示大约每个字符一个token，再加上预期的回复长度
+    return len(system_message or "") + len(user_message) + int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "300"))
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """提取429错误中的Retry-After秒数，不是429错误时返回None"""
+    if getattr(error, "status_code", None) != 429:
+        return None
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after", "1"))
+    except (AttributeError, TypeError, ValueError):
+        return 1.0
+
+def _actual_tokens(usage: Optional[Dict[str, int]]) -> Optional[int]:
+    if not usage:
+        return None
+    return usage["prompt_tokens"] + usage["completion_tokens"]
+
+def _record_outcome(provider: str, start: float, error: Optional[BaseException] = None) -> None:
+    """把调用结果计入路由统计，429错误同时触发限流器退避"""
+    router = _router
+    if error is None:
+        if router is not None:
+            router.record_success(provider, time.perf_counter() - start)
+        return
+    if _deadline_expired():
+        # 截止时间到了或请求被取消导致的失败不说明提供商有问题
+        if router is not None:
+            router.release(provider)
+        return
+    if router is not None:
+        router.record_failure(provider, error)
+    retry_after = _retry_after(error)
+    limiter = get_limiter(provider)
+    if retry_after is not None and limiter is not None:
+        limiter.on_rate_limited(retry_after)
+
+def _attempt(provider: str, system_message: Optional[str], user_message: str, priority: Priority = None,
+            options: Optional[Dict[str, Any]] = None) -> str:
+    """在限流器允许后向单个提供商发送请求，结果计入路由统计"""
+    limiter = get_limiter(provider)
+    ticket = limiter.acquire(priority, _estimate_tokens(system_message, user_message), _deadline_budget()) if limiter else None
+    start = time.perf_counter()
+    usage = None
+    try:
+        result, usage = _chat(provider, system_message, user_message, options)
+    except Exception as e:
+        _record_outcome(provider, start, e)
+        raise
+    finally:
+        # 用提供商报告的实际token数修正每分钟token统计
+        if ticket is not None:
+            limiter.release(ticket, _actual_tokens(usage))
+    _record_outcome(provider, start)
+    return result
+
+async def _attempt_async(provider: str, system_message: Optional[str], user_message: str, priority: Priority = None,
+                        options: Optional[Dict[str, Any]] = None) -> str:
+    """_attempt的异步版本，排队等待时不阻塞事件循环，超时或截止时间到时取消上游请求"""
+    limiter = get_limiter(provider)
+    ticket = await limiter.acquire_async(priority, _estimate_tokens(system_message, user_message),
+                                         _deadline_budget()) if limiter else None
+    start = time.perf_counter()
+    usage = None
+    try:
+        result, usage = await asyncio.wait_for(_chat_async(provider, system_message, user_message, options),
+                                               _request_timeout())
+    except asyncio.CancelledError:
+        # 被取消的请求（如对冲落败）没有结果，交还它可能占用的半开探测名额
+        if _router is not None:
+            _router.release(provider)
+        raise
+    except Exception as e:
+        _record_outcome(provider, start, e)
+        raise
+    finally:
+        if ticket is not None:
+            limiter.release(ticket, _actual_tokens(usage))
+    _record_outcome(provider, start)
+    return result
+
+def _raise_for_deadline(error: BaseException) -> None:
+    """所有尝试都失败后抛出最后一个错误，截止时间已过时改为抛出DeadlineExceeded"""
+    if _deadline_expired() and not isinstance(error, DeadlineExceeded):
+        raise DeadlineExceeded(current_deadline().why()) from error
+    raise error
+
+def _finish_route(decision: Optional[Dict[str, Any]], order: List[str], served_by: Optional[str], failovers: int,
+                  dispatched: List[str]) -> None:
+    """
+    记录路由结果，并交还路由放行但没有实际发出请求的提供商
+    
+    已发出的请求（包括对冲的备用请求）由自己的结果更新熔断状态，在这里交还会让半开探测名额提前释放。
+    """
+    if decision is None:
+        return
+    decision.update(served_by=served_by, failovers=failovers)
+    for skipped in set(order) - set(dispatched):
+        _router.release(skipped)
+
+def _dispatch(provider: Optional[str], system_message: Optional[str], user_message: str, priority: Priority = None,
+             options: Optional[Dict[str, Any]] = None) -> str:
+    """
+    发送请求：provider为None且启用路由时按路由顺序依次尝试，失败自动切换到下一个提供商
+    
+    启用对冲时第一次尝试以对冲方式执行，备用请求发给路由顺序中的下一个提供商
+    （只有一个提供商时发给同一个提供商）。
+    """
+    decision, order = _route_order(provider)
+    dispatched = []
+    
+    def attempt(p):
+        # 在线程池中执行时，排队期间被取消的对冲请求不算发出
+        dispatched.append(p)
+        return _attempt(p, system_message, user_message, priority, options)
+    
+    last_error = None
+    for i, candidate in enumerate(order):
+        try:
+            if i == 0 and _hedger is not None:
+                backup = order[1] if len(order) > 1 else candidate
+                served_by, result = _hedger.run(candidate, backup, attempt)
+            else:
+                served_by, result = candidate, attempt(candidate)
+        except Exception as e:
+            last_error = e
+            if _deadline_expired():
+                break
+            continue
+        _finish_route(decision, order, served_by, i, dispatched)
+        return result
+    _finish_route(decision, order, None, len(order), dispatched)
+    _raise_for_deadline(last_error)
+
+async def _dispatch_async(provider: Optional[str], system_message: Optional[str], user_message: str, priority: Priority = None,
+                         options: Optional[Dict[str, Any]] = None) -> str:
+    """_dispatch的异步版本，对冲中落败的请求会被取消"""
+    decision, order = _route_order(provider)
+    dispatched = []
+    
+    async def attempt(p):
+        # 开始执行前就被取消的对冲请求不算发出
+        dispatched.append(p)
+        return await _attempt_async(p, system_message, user_message, priority, options)
+    
+    last_error = None
+    for i, candidate in enumerate(order):
+        try:
+            if i == 0 and _hedger is not None:
+                backup = order[1] if len(order) > 1 else candidate
+                served_by, result = await _hedger.run_async(candidate, backup, attempt)
+            else:
+                served_by, result = candidate, await attempt(candidate)
+        except Exception as e:
+            last_error = e
+            if _deadline_expired():
+                break
+            continue
+        _finish_route(decision, order, served_by, i, dispatched)
+        return result
+    _finish_route(decision, order, None, len(order), dispatched)
+    _raise_for_deadline(last_error)
+
+async def _dispatch_stream_async(provider: Optional[str], system_message: Optional[str], user_message: str, priority: Priority = None,
+                                options: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+    """流式发送请求，只在产出第一个片段之前允许切换提供商，流式请求不做对冲"""
+    decision, order = _route_order(provider)
+    dispatched = []
+    last_error = None
+    for i, candidate in enumerate(order):
+        dispatched.append(candidate)
+        # 流式请求在整个输出期间占用限流名额
+        limiter = get_limiter(candidate)
+        ticket = await limiter.acquire_async(priority, _estimate_tokens(system_message, user_message),
+                                             _deadline_budget()) if limiter else None
+        start = time.perf_counter()
+        started = False
+        usage = {}
+        try:
+            async for chunk in _stream_chat_async(candidate, system_message, user_message, options, usage):
+                started = True
+                yield chunk
+                # 流式请求的超时只限制片段之间的间隔，截止时间在片段之间检查
+                deadline = current_deadline()
+                if deadline is not None:
+                    deadline.check()
+        except Exception as e:
+            _record_outcome(candidate, start, e)
+            if started:
+                raise
+            last_error = e
+            if _deadline_expired():
+                break
+            continue
+        finally:
+            if ticket is not None:
+                limiter.release(ticket, _actual_tokens(usage))
+        _record_outcome(candidate, start)
+        _finish_route(decision, order, candidate, i, dispatched)
+        return
+    _finish_route(decision, order, None, len(order), dispatched)
+    _raise_for_deadline(last_error)
+
+def _complete(provider: Optional[str], system_message: Optional[str], user_message: str, use_cache: bool = True,
+             priority: Priority = None, options: Optional[Dict[str, Any]] = None) -> str:
+    cache, key, cached = _cache_lookup(provider, system_message, user_message, use_cache, options)
+    if cached is not None:
+        return cached
+    
+    def fetch():
+        result = _dispatch(provider, system_message, user_message, priority, options)
+        if cache is not None:
+            cache.put(key, result)
+        return result
     
-    else:
-        raise ValueError(f"Unsupported provider: {provider}. Choose from: openai, gemini, deepseek")
+    if use_cache and _singleflight is not None:
+        flight_key = key or _request_key(provider, system_message, user_message, options)
+        return _singleflight.do(flight_key, fetch)
+    return fetch()
 
-def call_llm_with_system(system_message: str, user_message: str, provider: Optional[str] = None, temperature: float = 0.7) -> str:
+async def _complete_async(provider: Optional[str], system_message: Optional[str], user_message: str, use_cache: bool = True,
+                         priority: Priority = None, options: Optional[Dict[str, Any]] = None) -> str:
+    cache, key, cached = _cache_lookup(provider, system_message, user_message, use_cache, options)
+    if cached is not None:
+        return cached
+    
+    async def fetch():
+        result = await _dispatch_async(provider, system_message, user_message, priority, options)
+        if cache is not None:
+            cache.put(key, result)
+        return result
+    
+    if use_cache and _singleflight is not None:
+        flight_key = key or _request_key(provider, system_message, user_message, options)
+        return await _singleflight.do_async(flight_key, fetch)
+    return await fetch()
+
+async def _stream_provider_async(provider: str, system_message: Optional[str], user_message: str,
+                                 options: Optional[Dict[str, Any]] = None,
+                                 usage_out: Optional[Dict[str, int]] = None) -> AsyncIterator[str]:
+    """流式调用提供商，提供商在最后一个片段中返回的用量写入usage_out"""
+    if provider == "gemini":
+        model = client_registry.get_gemini_model(system_message, _model_for(provider, options))
+        response = await model.generate_content_async(user_message, stream=True,
+                                                      **_provider_kwargs(provider, options, _request_timeout()))
+        usage = None
+        async for chunk in response:
+            usage = extract_usage(provider, chunk) or usage
+            if chunk.text:
+                yield chunk.text
+        if usage is not None and usage_out is not None:
+            usage_out.update(usage)
+        return
+    
+    stream = await get_async_client(provider).chat.completions.create(
+        model=_model_for(provider, options),
+        messages=_build_messages(system_message, user_message),
+        stream=True,
+        # 让提供商在最后一个片段中返回用量（含提示缓存命中的token数）
+        stream_options={"include_usage": True},
+        **_provider_kwargs(provider, options, _request_timeout())
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+        usage = extract_usage(provider, chunk)
+        if usage is not None and usage_out is not None:
+            usage_out.update(usage)
+
+def _request_options(json_mode: bool = False, route: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    options = {}
+    if json_mode:
+        options["json_mode"] = True
+    if route is not None:
+        options["route"] = route
+    return options or None
+
+def call_llm(prompt: str, provider: Optional[str] = None, use_cache: bool = True, priority: Priority = None) -> str:
+    """
+    Call LLM with support for multiple providers.
+    
+    Args:
+        prompt: The prompt to send to the LLM
+        provider: LLM provider to use ('openai', 'gemini', 'deepseek', 'stub'). 
+                 If None, uses LLM_PROVIDER env var or defaults to 'openai'
+        use_cache: Whether the response cache may serve/store this prompt
+        priority: Queue priority when the provider limiter is saturated
+                  ('high', 'normal', 'low', 'background' or an int, lower runs first)
+    
+    Returns:
+        The LLM response as a string
+    """
+    return _complete(_target_provider(provider), None, prompt, use_cache, priority)
+
+def call_llm_with_system(system_message: str, user_message: str, provider: Optional[str] = None, temperature: float = 0.7, use_cache: bool = True, priority: Priority = None, json_mode: bool = False, route: Optional[str] = None) -> str:
     """
     使用系统消息和用户消息调用LLM
     
@@ -81,88 +1075,83 @@ def call_llm_with_system(system_message: str, user_message: str, provider: Optio
         user_message (str): 用户输入内容
         provider (str): LLM提供商
         temperature (float): 控制输出随机性
-        
+        use_cache (bool): 是否允许使用响应缓存，要求每次回复都不同的提示应传False
+        priority: 限流排队时的优先级（high/normal/low/background或数值，越小越优先）
+        json_mode (bool): 要求提供商返回JSON对象（提示中仍需说明JSON结构）
+        route (str): 模型路由名称（chat/reading），决定使用的模型和回复token上限，None时使用提供商配置的模型
+    
     Returns:
         str: LLM的回复内容
     """
-    # Determine provider
-    if provider is None:
-        provider = os.getenv("LLM_PROVIDER", "openai").lower()
-    
-    if provider == "openai":
-        from openai import OpenAI
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
-        
-        client = OpenAI(api_key=api_key)
-        model = os.getenv("OPENAI_MODEL", "gpt-5-mini")
-        
-        # 某些模型（如 gpt-5-mini）不支持自定义 temperature，使用默认值
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
-            ]
-        )
-        return response.choices[0].message.content
+    return _complete(_target_provider(provider), system_message, user_message, use_cache, priority,
+                     _request_options(json_mode, route))
+
+async def call_llm_async(prompt: str, provider: Optional[str] = None, use_cache: bool = True, priority: Priority = None) -> str:
+    """
+    Async version of call_llm, backed by the pooled async provider clients.
     
-    elif provider == "gemini":
-        try:
-            import google.generativeai as genai
-        except ImportError:
-            raise ImportError("Please install google-generativeai: pip install google-generativeai")
-        
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment variables")
-        
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel(
-            os.getenv("GEMINI_MODEL", "gemini-2.5-flash"),
-            system_instruction=system_message
-        )
-        response = model.generate_content(user_message)
-        return response.text
-    
-    elif provider == "deepseek":
-        from openai import OpenAI
-        api_key = os.getenv("DEEPSEEK_API_KEY")
-        if not api_key:
-            raise ValueError("DEEPSEEK_API_KEY not found in environment variables")
-        
-        client = OpenAI(
-            api_key=api_key,
-            base_url="https://api.deepseek.com/v1"
-        )
-        model = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
-        
-        # DeepSeek 也可能不支持自定义 temperature，使用默认值
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
-            ]
-        )
-        return response.choices[0].message.content
+    Args:
+        prompt: The prompt to send to the LLM
+        provider: LLM provider to use. If None, uses LLM_PROVIDER env var
+        use_cache: Whether the response cache may serve/store this prompt
+        priority: Queue priority when the provider limiter is saturated
     
-    else:
-        raise ValueError(f"Unsupported provider: {provider}. Choose from: openai, gemini, deepseek")
+    Returns:
+        The LLM response as a string
+    """
+    return await _complete_async(_target_provider(provider), None, prompt, use_cache, priority)
 
-def call_tarot_llm(prompt: str, **kwargs) -> str:
+async def call_llm_with_system_async(system_message: str, user_message: str, provider: Optional[str] = None, temperature: float = 0.7, use_cache: bool = True, priority: Priority = None, json_mode: bool = False, route: Optional[str] = None) -> str:
     """
-    专门用于塔罗占卜的LLM调用，使用适合的系统提示
+    call_llm_with_system的异步版本，不会阻塞事件循环
     
     Args:
-        prompt (str): 占卜相关的提示词
-        **kwargs: 传递给call_llm_with_system的其他参数
-        
+        system_message (str): 系统提示，定义角色和行为
+        user_message (str): 用户输入内容
+        provider (str): LLM提供商
+        temperature (float): 控制输出随机性
+        use_cache (bool): 是否允许使用响应缓存
+        priority: 限流排队时的优先级
+        json_mode (bool): 要求提供商返回JSON对象
+        route (str): 模型路由名称
+    
     Returns:
-        str: 塔罗占卜师的回复
+        str: LLM的回复内容
+    """
+    return await _complete_async(_target_provider(provider), system_message, user_message, use_cache, priority,
+                                 _request_options(json_mode, route))
+
+async def stream_llm_with_system_async(system_message: str, user_message: str, provider: Optional[str] = None, temperature: float = 0.7, use_cache: bool = True, priority: Priority = None, json_mode: bool = False, route: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    流式调用LLM，提供商返回的文本片段到达后立即产出
+    
+    Args:
+        system_message (str): 系统提示，定义角色和行为
+        user_message (str): 用户输入内容
+        provider (str): LLM提供商
+        temperature (float): 控制输出随机性
+        use_cache (bool): 是否允许使用响应缓存，命中时一次性产出缓存的完整回复
+        priority: 限流排队时的优先级
+        json_mode (bool): 要求提供商返回JSON对象
+        route (str): 模型路由名称
+    
+    Yields:
+        str: LLM回复的文本片段
     """
-    system_message = """你是一位友善、幽默的塔罗占卜师🔮，名字叫做"星月"。你的特点是：
+    provider = _target_provider(provider)
+    options = _request_options(json_mode, route)
+    cache, key, cached = _cache_lookup(provider, system_message, user_message, use_cache, options)
+    if cached is not None:
+        yield cached
+        return
+    chunks = []
+    async for chunk in _dispatch_stream_async(provider, system_message, user_message, priority, options):
+        chunks.append(chunk)
+        yield chunk
+    if cache is not None:
+        cache.put(key, "".join(chunks))
+
+TAROT_SYSTEM_MESSAGE = """你是一位友善、幽默的塔罗占卜师🔮，名字叫做"星月"。你的特点是：
 
 1. 语气轻松友好，像朋友聊天一样
 2. 会使用适当的emoji来装饰对话 ✨🌟💫
@@ -173,8 +1162,46 @@ def call_tarot_llm(prompt: str, **kwargs) -> str:
 7. 用中文回复，语气温暖亲切
 
 请记住：塔罗占卜是为了给人们带来思考和启发，而不是预测绝对的未来。"""
+
+def call_tarot_llm(prompt: str, **kwargs) -> str:
+    """
+    专门用于塔罗占卜的LLM调用，使用适合的系统提示
+    
+    Args:
+        prompt (str): 占卜相关的提示词
+        **kwargs: 传递给call_llm_with_system的其他参数
     
-    return call_llm_with_system(system_message, prompt, **kwargs)
+    Returns:
+        str: 塔罗占卜师的回复
+    """
+    return call_llm_with_system(TAROT_SYSTEM_MESSAGE, prompt, **kwargs)
+
+async def call_tarot_llm_async(prompt: str, **kwargs) -> str:
+    """
+    call_tarot_llm的异步版本
+    
+    Args:
+        prompt (str): 占卜相关的提示词
+        **kwargs: 传递给call_llm_with_system_async的其他参数
+    
+    Returns:
+        str: 塔罗占卜师的回复
+    """
+    return await call_llm_with_system_async(TAROT_SYSTEM_MESSAGE, prompt, **kwargs)
+
+async def stream_tarot_llm_async(prompt: str, **kwargs) -> AsyncIterator[str]:
+    """
+    call_tarot_llm的流式版本
+    
+    Args:
+        prompt (str): 占卜相关的提示词
+        **kwargs: 传递给stream_llm_with_system_async的其他参数
+    
+    Yields:
+        str: 塔罗占卜师回复的文本片段
+    """
+    async for chunk in stream_llm_with_system_async(TAROT_SYSTEM_MESSAGE, prompt, **kwargs):
+        yield chunk
 
 if __name__ == "__main__":
     print("=== LLM调用测试 ===\n")
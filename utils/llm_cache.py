@@ -0,0 +1,107 @@
+"""
+LLM响应缓存
+按(provider, model, system message, prompt)缓存LLM回复，支持LRU淘汰、TTL过期和多版本回复
+"""
+
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+def make_cache_key(provider: str, model: str, system_message: Optional[str], prompt: str) -> str:
+    """
+    生成缓存键
+    
+    Args:
+        provider: LLM提供商
+        model: 模型名称
+        system_message: 系统提示，没有时为None
+        prompt: 用户提示
+    
+    Returns:
+        请求内容的sha256摘要
+    """
+    raw = "\x1f".join([provider, model, system_message or "", prompt])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    线程安全的LRU/TTL响应缓存
+    
+    variants > 1 时每个键最多保存N个不同的回复：收集满N个之前都按未命中处理，
+    让调用方继续请求LLM补充新版本；收集满之后随机返回其中一个，避免回复显得千篇一律。
+    
+    任何实现了get/put/stats/clear的对象都可以通过call_llm.set_response_cache替换本实现。
+    """
+    
+    def __init__(self, max_size: int = 512, ttl: Optional[float] = 3600, variants: int = 1):
+        if max_size < 1 or variants < 1:
+            raise ValueError("max_size and variants must be at least 1")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.variants = variants
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key: str) -> Optional[str]:
+        """
+        读取缓存，未命中、已过期或多版本尚未收集满时返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] is not None and entry["expires_at"] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None or len(entry["values"]) < self.variants:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return random.choice(entry["values"])
+    
+    def put(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        """
+        写入缓存
+        
+        Args:
+            key: 缓存键
+            value: LLM回复
+            ttl: 该条目的过期秒数，None时使用缓存默认值
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry["expires_at"] is not None and entry["expires_at"] <= time.monotonic()):
+                entry = {"values": [], "expires_at": time.monotonic() + ttl if ttl else None}
+                self._entries[key] = entry
+            if len(entry["values"]) < self.variants:
+                entry["values"].append(value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self) -> None:
+        """清空缓存和统计"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "evictions": self.evictions,
+                "variants": self.variants
+            }
@@ -0,0 +1,135 @@
+"""
+LLM请求录制/回放（cassette）
+录制模式把真实提供商的回复连同耗时写入磁盘，回放模式按原始耗时重放，
+用于在没有网络的环境下做确定性的基准测试和性能回归对比
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+CASSETTE_MODES = ("record", "replay")
+
+def make_request_key(system_message: Optional[str], user_message: str) -> str:
+    """
+    生成cassette条目的请求键
+    
+    只由消息内容决定，不含提供商和模型，便于用另一套提供商配置回放同一份录制。
+    """
+    raw = "\x1f".join([system_message or "", user_message])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+class CassetteMiss(KeyError):
+    """回放模式下cassette中没有对应请求的录制"""
+
+class Cassette:
+    """
+    LLM回复录制文件
+    
+    文件为JSON Lines格式（路径以.gz结尾时使用gzip压缩），每行一次调用：
+    请求键、提供商、模型、回复文本、总耗时和提供商报告的用量，流式调用还包括每个片段相对请求开始的时刻。
+    同一请求录制了多次时按录制顺序轮流回放。
+    
+    Args:
+        path: cassette文件路径
+        mode: record（追加录制）或replay（只读回放）
+        speed: 回放速度倍数，2表示按一半的原始耗时回放，0表示不等待
+    """
+    
+    def __init__(self, path: str, mode: str = "replay", speed: float = 1.0):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode: {mode}. Choose from: {', '.join(CASSETTE_MODES)}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursors: Dict[str, int] = {}
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        if os.path.exists(path):
+            self._load()
+        elif mode == "replay":
+            raise FileNotFoundError(f"Cassette not found: {path}")
+    
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+    
+    def _load(self) -> None:
+        with self._open("r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["key"], []).append(entry)
+    
+    def record(self, provider: str, model: str, system_message: Optional[str], user_message: str,
+               text: str, latency: float, chunks: Optional[List[List[Any]]] = None,
+               usage: Optional[Dict[str, int]] = None) -> None:
+        """
+        追加一条录制
+        
+        Args:
+            provider: 实际返回回复的提供商
+            model: 模型名称
+            system_message: 系统提示
+            user_message: 用户提示
+            text: 完整回复
+            latency: 请求开始到回复完成的秒数
+            chunks: 流式调用的[相对开始的秒数, 片段文本]列表
+            usage: 提供商报告的token用量（含命中提示缓存的token数）
+        """
+        entry = {"key": make_request_key(system_message, user_message), "provider": provider,
+                 "model": model, "latency": round(latency, 4), "text": text}
+        if chunks is not None:
+            entry["chunks"] = [[round(offset, 4), piece] for offset, piece in chunks]
+        if usage is not None:
+            entry["usage"] = usage
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._entries.setdefault(entry["key"], []).append(entry)
+            self.recorded += 1
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._open("a") as f:
+                f.write(line + "\n")
+    
+    def lookup(self, system_message: Optional[str], user_message: str) -> Dict[str, Any]:
+        """
+        取出请求的下一条录制
+        
+        Raises:
+            CassetteMiss: cassette中没有这个请求
+        """
+        key = make_request_key(system_message, user_message)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                raise CassetteMiss(f"No recording for request {key} in {self.path}")
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+            self.replayed += 1
+            return entries[cursor % len(entries)]
+    
+    def delay(self, seconds: float) -> float:
+        """按回放速度换算等待时间"""
+        return seconds / self.speed if self.speed > 0 else 0.0
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "path": self.path,
+                "mode": self.mode,
+                "speed": self.speed,
+                "requests": len(self._entries),
+                "recorded": self.recorded,
+                "replayed": self.replayed,
+                "misses": self.misses
+            }
@@ -0,0 +1,203 @@
+"""
+LLM对冲请求（hedged requests）
+主请求超过其近期延迟的某个分位数仍未返回时，向备用提供商再发一个请求，取先完成的结果并取消另一个
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .llm_router import ProviderStats
+
+class Hedger:
+    """
+    对冲请求控制器
+    
+    - 触发时机：主提供商最近成功请求延迟的percentile分位数（不低于min_delay），
+      样本数不足min_samples时不对冲
+    - 预算：对冲次数不超过总请求数的max_hedge_ratio（加上burst个初始额度）
+    - 统计：对冲次数、对冲获胜次数，以及估算节省的延迟。主请求被取消后无法得知它
+      原本的耗时，因此用近期延迟中超过取消时刻的那部分样本的均值来估算剩余时间
+    - 延迟样本只记录完成的请求：被取消的主请求在取消时刻的耗时不是它的真实延迟，
+      记录下来会拉低触发分位数，让对冲越来越频繁
+    
+    异步请求的落败方会被真正取消；同步请求在线程池中执行，落败方无法中断，
+    只会被丢弃。
+    """
+    
+    def __init__(self, percentile: float = 0.95, min_delay: float = 0.5, min_samples: int = 20,
+                 max_hedge_ratio: float = 0.1, burst: int = 5, window: int = 200, max_workers: int = 32):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.burst = burst
+        self.window = window
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._stats: Dict[str, ProviderStats] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+        self.estimated_saved = 0.0
+    
+    def delay_for(self, provider: str) -> Optional[float]:
+        """获取提供商的对冲触发延迟，样本不足时返回None"""
+        with self._lock:
+            stats = self._stats.get(provider)
+            if stats is None or len(stats.latencies) < self.min_samples:
+                return None
+            return max(self.min_delay, stats.percentile(self.percentile))
+    
+    def _record_latency(self, provider: str, latency: float) -> None:
+        with self._lock:
+            stats = self._stats.get(provider)
+            if stats is None:
+                stats = self._stats[provider] = ProviderStats(self.window)
+            stats.record(True, latency)
+    
+    def _record_completed(self, future, provider: str, start: float) -> None:
+        if not future.cancelled() and future.exception() is None:
+            self._record_latency(provider, time.perf_counter() - start)
+    
+    def _acquire_budget(self) -> bool:
+        with self._lock:
+            if self.hedges < self.max_hedge_ratio * self.requests + self.burst:
+                self.hedges += 1
+                return True
+            self.budget_denied += 1
+            return False
+    
+    def _record_hedge_win(self, primary: str, elapsed: float) -> None:
+        with self._lock:
+            self.hedge_wins += 1
+            stats = self._stats.get(primary)
+            tail = [l for l in stats.latencies if l > elapsed] if stats else []
+            if tail:
+                self.estimated_saved += sum(tail) / len(tail) - elapsed
+    
+    def _plan(self, primary: str) -> Optional[float]:
+        with self._lock:
+            self.requests += 1
+        return self.delay_for(primary)
+    
+    async def run_async(self, primary: str, backup: str,
+                        attempt: Callable[[str], Awaitable[Any]]) -> Tuple[str, Any]:
+        """
+        以对冲方式执行请求
+        
+        Args:
+            primary: 主提供商
+            backup: 对冲请求使用的提供商，可以与主提供商相同
+            attempt: 接收提供商名称并发起请求的协程函数
+        
+        Returns:
+            (实际返回结果的提供商, 结果)，两个请求都失败时抛出主请求的异常
+        """
+        delay = self._plan(primary)
+        start = time.perf_counter()
+        primary_task = asyncio.ensure_future(attempt(primary))
+        tasks = {primary_task: primary}
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait({primary_task}, timeout=delay)
+                if not done and self._acquire_budget():
+                    hedge_start = time.perf_counter()
+                    tasks[asyncio.ensure_future(attempt(backup))] = backup
+            
+            if len(tasks) == 1:
+                result = await primary_task
+                self._record_latency(primary, time.perf_counter() - start)
+                return primary, result
+            
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None:
+                        elapsed = time.perf_counter() - start
+                        if task is primary_task:
+                            self._record_latency(primary, elapsed)
+                        else:
+                            # 主请求随后被取消，没有它的延迟样本
+                            self._record_latency(backup, time.perf_counter() - hedge_start)
+                            self._record_hedge_win(primary, elapsed)
+                        return tasks[task], task.result()
+            raise primary_task.exception()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    def run(self, primary: str, backup: str, attempt: Callable[[str], Any]) -> Tuple[str, Any]:
+        """run_async的同步版本，请求在共享线程池中执行"""
+        delay = self._plan(primary)
+        start = time.perf_counter()
+        if delay is None:
+            result = attempt(primary)
+            self._record_latency(primary, time.perf_counter() - start)
+            return primary, result
+        
+        executor = self._get_executor()
+        # 在调用方的上下文中执行，保留用量归属等上下文变量
+        primary_future = executor.submit(contextvars.copy_context().run, attempt, primary)
+        done, _ = wait({primary_future}, timeout=delay)
+        if done or not self._acquire_budget():
+            result = primary_future.result()
+            self._record_latency(primary, time.perf_counter() - start)
+            return primary, result
+        
+        hedge_start = time.perf_counter()
+        hedge_future = executor.submit(contextvars.copy_context().run, attempt, backup)
+        futures = {primary_future: primary, hedge_future: backup}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    elapsed = time.perf_counter() - start
+                    if future is primary_future:
+                        self._record_latency(primary, elapsed)
+                    else:
+                        self._record_latency(backup, time.perf_counter() - hedge_start)
+                        self._record_hedge_win(primary, elapsed)
+                        # 同步的主请求无法中断，等它真正完成时再记录它的延迟
+                        primary_future.add_done_callback(lambda f: self._record_completed(f, primary, start))
+                    for other in pending:
+                        other.cancel()
+                    return futures[future], future.result()
+        raise primary_future.exception()
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="llm-hedge")
+            return self._executor
+    
+    def shutdown(self) -> None:
+        """关闭同步对冲使用的线程池"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取对冲统计"""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_rate": self.hedges / self.requests if self.requests else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "budget_denied": self.budget_denied,
+                "estimated_saved_seconds": self.estimated_saved,
+                "trigger_delays": {
+                    p: max(self.min_delay, s.percentile(self.percentile))
+                    for p, s in self._stats.items() if len(s.latencies) >= self.min_samples
+                }
+            }
@@ -0,0 +1,243 @@
+"""
+LLM提供商限流
+按提供商限制并发数、每分钟请求数和每分钟token数，等待中的调用按优先级排队
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Union
+
+# 数值越小越优先
+PRIORITIES = {"high": 0, "normal": 10, "low": 20, "background": 30}
+
+def resolve_priority(priority: Union[str, int, None]) -> int:
+    """把优先级名称（high/normal/low/background）或数值转换为数值"""
+    if priority is None:
+        return PRIORITIES["normal"]
+    if isinstance(priority, int):
+        return priority
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority: {priority}. Choose from: {', '.join(PRIORITIES)}")
+    return PRIORITIES[priority]
+
+class _Waiter:
+    __slots__ = ("priority", "tokens", "enqueued_at", "event", "loop", "future", "ticket", "cancelled")
+    
+    def __init__(self, priority: int, tokens: int):
+        self.priority = priority
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        self.event = None
+        self.loop = None
+        self.future = None
+        self.ticket = None
+        self.cancelled = False
+
+class ProviderLimiter:
+    """
+    单个提供商的限流器，线程和asyncio调用方共用同一套额度
+    
+    名额直接交给队首等待者，不会被新来的调用插队；只受每分钟额度或429退避限制时，
+    会在最早的额度释放时自动重新调度。
+    """
+    
+    def __init__(self, name: str, max_concurrency: Optional[int] = None, rpm: Optional[int] = None,
+                 tpm: Optional[int] = None, window: float = 60.0, stats_size: int = 500):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self._lock = threading.Lock()
+        self._queue = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._requests = deque()
+        self._window_tokens = 0
+        self._paused_until = 0.0
+        self._timer: Optional[threading.Timer] = None
+        self._timer_at = 0.0
+        self._waits = deque(maxlen=stats_size)
+        self.granted = 0
+        self.timeouts = 0
+        self.rate_limited = 0
+    
+    def acquire(self, priority: Union[str, int, None] = None, tokens: int = 0,
+                timeout: Optional[float] = None) -> list:
+        """
+        阻塞等待一个调用名额
+        
+        Args:
+            priority: 优先级名称或数值，越小越优先
+            tokens: 本次调用预估消耗的token数，用于每分钟token限制
+            timeout: 最长等待秒数，None表示一直等待
+        
+        Returns:
+            调用名额，调用结束后传给release
+        
+        Raises:
+            TimeoutError: 超时仍未获得名额
+        """
+        waiter = _Waiter(resolve_priority(priority), tokens)
+        waiter.event = threading.Event()
+        self._enqueue(waiter)
+        if waiter.event.wait(timeout):
+            return waiter.ticket
+        with self._lock:
+            if waiter.ticket is not None:
+                return waiter.ticket
+            waiter.cancelled = True
+            self.timeouts += 1
+        raise TimeoutError(f"Timed out waiting for {self.name} rate limiter")
+    
+    async def acquire_async(self, priority: Union[str, int, None] = None, tokens: int = 0,
+                            timeout: Optional[float] = None) -> list:
+        """acquire的异步版本，等待期间不阻塞事件循环"""
+        waiter = _Waiter(resolve_priority(priority), tokens)
+        waiter.loop = asyncio.get_running_loop()
+        waiter.future = waiter.loop.create_future()
+        self._enqueue(waiter)
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                granted = waiter.ticket is not None
+                if not granted:
+                    waiter.cancelled = True
+                    if isinstance(e, asyncio.TimeoutError):
+                        self.timeouts += 1
+            if granted:
+                # 名额已经分配但调用方不再需要，直接归还
+                self.release(waiter.ticket)
+            if isinstance(e, asyncio.TimeoutError):
+                raise TimeoutError(f"Timed out waiting for {self.name} rate limiter") from None
+            raise
+    
+    def release(self, ticket: list, actual_tokens: Optional[int] = None) -> None:
+        """
+        归还调用名额
+        
+        Args:
+            ticket: acquire返回的名额
+            actual_tokens: 实际消耗的token数，用于修正每分钟token统计
+        """
+        with self._lock:
+            if ticket[2]:
+                return
+            ticket[2] = True
+            self._in_flight -= 1
+            if actual_tokens is not None and ticket[3]:
+                self._window_tokens += actual_tokens - ticket[1]
+                ticket[1] = actual_tokens
+            self._grant_locked()
+    
+    def on_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        """提供商返回429时调用，在retry_after秒内暂停分配新名额"""
+        with self._lock:
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + (retry_after or 1.0))
+    
+    def _enqueue(self, waiter: _Waiter) -> None:
+        with self._lock:
+            heapq.heappush(self._queue, (waiter.priority, next(self._seq), waiter))
+            self._grant_locked()
+    
+    def _prune_locked(self, now: float) -> None:
+        while self._requests and self._requests[0][0] <= now - self.window:
+            entry = self._requests.popleft()
+            entry[3] = False
+            self._window_tokens -= entry[1]
+    
+    def _retry_at_locked(self, now: float, tokens: int) -> Optional[float]:
+        """检查每分钟额度和退避，返回None表示可以放行，否则返回可以重试的时刻"""
+        if now < self._paused_until:
+            return self._paused_until
+        if self.rpm is not None and len(self._requests) >= self.rpm:
+            return self._requests[0][0] + self.window
+        if (self.tpm is not None and self._requests
+                and self._window_tokens + tokens > self.tpm):
+            return self._requests[0][0] + self.window
+        return None
+    
+    def _grant_locked(self) -> None:
+        now = time.monotonic()
+        self._prune_locked(now)
+        while self._queue:
+            waiter = self._queue[0][2]
+            if waiter.cancelled:
+                heapq.heappop(self._queue)
+                continue
+            if self.max_concurrency is not None and self._in_flight >= self.max_concurrency:
+                return
+            retry_at = self._retry_at_locked(now, waiter.tokens)
+            if retry_at is not None:
+                self._schedule_locked(retry_at, now)
+                return
+            heapq.heappop(self._queue)
+            # 名额：[发放时刻, token数, 是否已归还, 是否仍在统计窗口内]
+            ticket = [now, waiter.tokens, False, True]
+            self._requests.append(ticket)
+            self._window_tokens += waiter.tokens
+            self._in_flight += 1
+            self.granted += 1
+            self._waits.append(now - waiter.enqueued_at)
+            waiter.ticket = ticket
+            if waiter.event is not None:
+                waiter.event.set()
+                continue
+            try:
+                waiter.loop.call_soon_threadsafe(self._resolve_future, waiter)
+            except RuntimeError:
+                # 等待方所在的事件循环已经关闭，收回名额
+                ticket[2] = True
+                self._in_flight -= 1
+    
+    def _resolve_future(self, waiter: _Waiter) -> None:
+        # 调用方已经超时或取消时由acquire_async负责归还名额
+        if not waiter.future.done():
+            waiter.future.set_result(waiter.ticket)
+    
+    def _schedule_locked(self, at: float, now: float) -> None:
+        if self._timer is not None and self._timer_at <= at:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_at = at
+        self._timer = threading.Timer(max(0.0, at - now) + 0.001, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+    
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+            self._grant_locked()
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取队列深度、并发和等待时间统计"""
+        with self._lock:
+            self._prune_locked(time.monotonic())
+            queued = [w for _, _, w in self._queue if not w.cancelled]
+            waits = sorted(self._waits)
+            by_priority: Dict[int, int] = {}
+            for w in queued:
+                by_priority[w.priority] = by_priority.get(w.priority, 0) + 1
+            return {
+                "max_concurrency": self.max_concurrency,
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "in_flight": self._in_flight,
+                "queue_depth": len(queued),
+                "queue_by_priority": by_priority,
+                "window_requests": len(self._requests),
+                "window_tokens": self._window_tokens,
+                "granted": self.granted,
+                "timeouts": self.timeouts,
+                "rate_limited": self.rate_limited,
+                "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+                "wait_p95": waits[min(len(waits) - 1, int(0.95 * len(waits)))] if waits else 0.0,
+                "wait_max": waits[-1] if waits else 0.0
+            }
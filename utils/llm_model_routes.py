@@ -0,0 +1,93 @@
+"""
+按节点路由模型
+欢迎语、确认、菜单这类简短的对话回复可以使用便宜、低延迟的小模型，解读和建议使用更强的模型，
+每条路由可以有自己的回复token上限；没有显式配置的路由使用提供商配置的模型，不限制回复长度
+"""
+
+import os
+from typing import Any, Dict, Optional
+
+# 节点可以声明的路由：chat为简短的对话回复，reading为解读和建议
+ROUTE_NAMES = ("chat", "reading")
+
+class ModelRoute:
+    """
+    一条模型路由
+    
+    Args:
+        name: 路由名称
+        models: 提供商到模型名称的映射，未列出的提供商使用其配置的默认模型
+        max_tokens: 回复token上限，None表示不限制
+    """
+    
+    def __init__(self, name: str, models: Optional[Dict[str, str]] = None, max_tokens: Optional[int] = None):
+        self.name = name
+        self.models = dict(models or {})
+        self.max_tokens = max_tokens
+    
+    def model_for(self, provider: str) -> Optional[str]:
+        """获取本路由在提供商上使用的模型，None表示使用提供商的默认模型"""
+        return self.models.get(provider)
+    
+    def describe(self) -> Dict[str, Any]:
+        return {"models": dict(self.models), "max_tokens": self.max_tokens}
+
+class ModelRouteTable:
+    """
+    路由表：节点名称到路由的映射
+    
+    节点通过llm_route类属性声明默认路由，node_routes中的配置可以按节点名称覆盖。
+    
+    Args:
+        routes: 路由名称到ModelRoute的映射
+        node_routes: 节点名称（如ProcessTopicNode）到路由名称的映射
+    """
+    
+    def __init__(self, routes: Dict[str, ModelRoute], node_routes: Optional[Dict[str, str]] = None):
+        self.routes = dict(routes)
+        self.node_routes = dict(node_routes or {})
+        for node, route in self.node_routes.items():
+            if route not in self.routes:
+                raise ValueError(f"Unknown model route for {node}: {route}. Choose from: {', '.join(self.routes)}")
+    
+    @classmethod
+    def from_env(cls, providers) -> "ModelRouteTable":
+        """
+        按环境变量创建路由表
+        
+        - LLM_ROUTE_<ROUTE>_<PROVIDER>_MODEL：路由在某个提供商上使用的模型，未设置时使用提供商配置的模型
+        - LLM_ROUTE_<ROUTE>_MAX_TOKENS：路由的回复token上限，未设置或0表示不限制
+        - LLM_NODE_ROUTES：按节点覆盖路由，例如 SpreadSelectionNode=reading,WelcomeNode=chat
+        
+        Args:
+            providers: 支持的提供商名称
+        """
+        routes = {}
+        for name in ROUTE_NAMES:
+            models = {}
+            for provider in providers:
+                model = os.getenv(f"LLM_ROUTE_{name.upper()}_{provider.upper()}_MODEL")
+                if model:
+                    models[provider] = model
+            limit = int(os.getenv(f"LLM_ROUTE_{name.upper()}_MAX_TOKENS", "0"))
+            routes[name] = ModelRoute(name, models, limit or None)
+        node_routes = {}
+        for item in os.getenv("LLM_NODE_ROUTES", "").split(","):
+            if "=" in item:
+                node, route = item.split("=", 1)
+                node_routes[node.strip()] = route.strip()
+        return cls(routes, node_routes)
+    
+    def route_name(self, node: str, default: str) -> str:
+        """获取节点使用的路由名称"""
+        return self.node_routes.get(node, default)
+    
+    def get(self, name: Optional[str]) -> Optional[ModelRoute]:
+        """按名称获取路由，未知名称返回None"""
+        return self.routes.get(name) if name else None
+    
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "routes": {name: route.describe() for name, route in self.routes.items()},
+            "node_routes": dict(self.node_routes)
+        }
@@ -0,0 +1,203 @@
+"""
+LLM多提供商路由
+为每个提供商维护滚动延迟/错误统计和熔断器，把请求发给当前最快的健康提供商，失败时自动切换
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from typing import Optional, List, Dict, Any
+
+class CircuitBreaker:
+    """
+    提供商熔断器
+    
+    closed：正常放行；连续失败达到阈值，或窗口内错误率超过阈值时进入open；
+    open：拒绝请求，冷却时间过后进入half_open；
+    half_open：同一时间只放行一个探测请求，成功则恢复closed，失败则重新open。
+    """
+    
+    def __init__(self, failure_threshold: int = 5, error_rate_threshold: float = 0.5,
+                 min_requests: int = 10, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_in_flight = False
+    
+    def allow(self, now: float) -> bool:
+        """判断当前是否允许请求通过，需要在持有路由器锁时调用"""
+        if self.state == "open" and now - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+            self.probe_in_flight = False
+        if self.state == "half_open":
+            if self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+            return True
+        return self.state == "closed"
+    
+    def on_success(self) -> None:
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+    
+    def on_failure(self, now: float, error_rate: float, requests: int) -> None:
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+        if (self.state == "half_open"
+                or self.consecutive_failures >= self.failure_threshold
+                or (requests >= self.min_requests and error_rate >= self.error_rate_threshold)):
+            self.state = "open"
+            self.opened_at = now
+
+class ProviderStats:
+    """单个提供商的滚动统计：最近N次请求的延迟和成败，以及延迟的指数移动平均"""
+    
+    def __init__(self, window: int = 50, alpha: float = 0.2):
+        self.alpha = alpha
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.ewma_latency: Optional[float] = None
+        self.total_requests = 0
+        self.total_failures = 0
+        self.last_error: Optional[str] = None
+    
+    def record(self, ok: bool, latency: Optional[float] = None, error: Optional[BaseException] = None) -> None:
+        self.total_requests += 1
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(latency)
+            if self.ewma_latency is None:
+                self.ewma_latency = latency
+            else:
+                self.ewma_latency = self.alpha * latency + (1 - self.alpha) * self.ewma_latency
+        else:
+            self.total_failures += 1
+            self.last_error = f"{type(error).__name__}: {error}" if error else None
+    
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+    
+    def percentile(self, q: float) -> Optional[float]:
+        """最近窗口内成功请求延迟的分位数，q取0~1"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class ProviderRouter:
+    """
+    延迟感知的提供商路由器
+    
+    route()按优先级返回本次请求依次尝试的提供商：熔断器放行的提供商按延迟EWMA
+    从快到慢排列，还没有延迟数据的提供商按配置顺序排在后面；以explore_rate的概率把
+    一个随机健康提供商提到最前，保证备用提供商也有延迟数据。所有提供商都被熔断时
+    仍然按冷却结束时间返回全部提供商，避免直接失败。
+    """
+    
+    def __init__(self, providers: List[str], window: int = 50, failure_threshold: int = 5,
+                 error_rate_threshold: float = 0.5, min_requests: int = 10,
+                 cooldown: float = 30.0, explore_rate: float = 0.05, history_size: int = 100):
+        if not providers:
+            raise ValueError("ProviderRouter needs at least one provider")
+        self.providers = list(providers)
+        self.explore_rate = explore_rate
+        self._lock = threading.Lock()
+        self._stats = {p: ProviderStats(window) for p in self.providers}
+        self._breakers = {
+            p: CircuitBreaker(failure_threshold, error_rate_threshold, min_requests, cooldown)
+            for p in self.providers
+        }
+        self._decisions = deque(maxlen=history_size)
+    
+    def route(self) -> Dict[str, Any]:
+        """
+        生成一次路由决策
+        
+        调用方依次尝试decision["order"]中的提供商，并把最终结果写回
+        decision["served_by"] / decision["failovers"]，便于在snapshot中查看。
+        
+        Returns:
+            Dict: 包含order（依次尝试的提供商）和reason（fastest/explore/all_open）
+        """
+        now = time.monotonic()
+        with self._lock:
+            healthy = [p for p in self.providers if self._breakers[p].allow(now)]
+            measured = sorted((p for p in healthy if self._stats[p].ewma_latency is not None),
+                              key=lambda p: self._stats[p].ewma_latency)
+            unmeasured = [p for p in healthy if self._stats[p].ewma_latency is None]
+            order = measured + unmeasured
+            reason = "fastest"
+            if len(order) > 1 and random.random() < self.explore_rate:
+                explored = random.choice(order[1:])
+                order.remove(explored)
+                order.insert(0, explored)
+                reason = "explore"
+            if not order:
+                order = sorted(self.providers, key=lambda p: self._breakers[p].opened_at or 0)
+                reason = "all_open"
+            decision = {"time": time.time(), "order": order, "reason": reason,
+                        "served_by": None, "failovers": 0}
+            self._decisions.append(decision)
+            return decision
+    
+    def record_success(self, provider: str, latency: float) -> None:
+        """记录一次成功调用"""
+        with self._lock:
+            if provider not in self._stats:
+                return
+            self._stats[provider].record(True, latency)
+            self._breakers[provider].on_success()
+    
+    def record_failure(self, provider: str, error: Optional[BaseException] = None) -> None:
+        """记录一次失败调用，可能触发熔断"""
+        with self._lock:
+            if provider not in self._stats:
+                return
+            stats = self._stats[provider]
+            stats.record(False, error=error)
+            self._breakers[provider].on_failure(time.monotonic(), stats.error_rate, len(stats.outcomes))
+    
+    def release(self, provider: str) -> None:
+        """放弃一次已放行但没有实际发出的请求（例如更靠前的提供商已经成功）"""
+        with self._lock:
+            breaker = self._breakers.get(provider)
+            if breaker is not None and breaker.state == "half_open":
+                breaker.probe_in_flight = False
+    
+    def latency_percentile(self, provider: str, q: float) -> Optional[float]:
+        """获取提供商最近延迟的分位数"""
+        with self._lock:
+            stats = self._stats.get(provider)
+            return stats.percentile(q) if stats else None
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        导出路由状态，供接口查看
+        
+        Returns:
+            Dict: 各提供商的熔断状态、延迟和错误统计，以及最近的路由决策
+        """
+        with self._lock:
+            providers = {}
+            for p in self.providers:
+                stats, breaker = self._stats[p], self._breakers[p]
+                providers[p] = {
+                    "circuit": breaker.state,
+                    "consecutive_failures": breaker.consecutive_failures,
+                    "ewma_latency": stats.ewma_latency,
+                    "p50_latency": stats.percentile(0.5),
+                    "p95_latency": stats.percentile(0.95),
+                    "error_rate": stats.error_rate,
+                    "total_requests": stats.total_requests,
+                    "total_failures": stats.total_failures,
+                    "last_error": stats.last_error
+                }
+            return {"providers": providers, "recent_decisions": [dict(d) for d in self._decisions]}
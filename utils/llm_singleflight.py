@@ -0,0 +1,189 @@
+"""
+相同LLM请求的合并执行（single-flight）
+同一时刻键相同的多个调用只会触发一次上游请求，所有调用方共享它的结果或异常
+"""
+
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from macore import Deadline, DeadlineExceeded, current_deadline, deadline_scope
+
+# 同步等待方检查截止时间是否被取消（如客户端断开）的间隔（秒）
+WAIT_POLL_INTERVAL = 0.05
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    线程和asyncio通用的single-flight合并器
+    
+    同步调用用线程事件等待领头调用完成；异步调用把领头请求包装成独立task，
+    等待方通过asyncio.shield共享结果，某个等待方被取消不会影响其他等待方，
+    所有等待方都取消后上游请求才会被取消。
+    
+    共享的请求不属于任何一个调用方：它不继承领头调用方的截止时间和取消，只受flight_timeout限制；
+    每个调用方（包括领头的）只用自己的截止时间限制自己的等待，超时后抛出DeadlineExceeded，
+    不影响其他调用方。领头调用方有截止时间时，共享请求在专用的有界线程池中执行，
+    不使用AsyncFlow的同步节点线程池，避免节点线程占满时共享请求排不上队。
+    
+    Args:
+        flight_timeout: 共享请求的截止时间（秒），None表示不限制
+        max_workers: 执行共享请求的线程数上限
+    """
+    
+    def __init__(self, flight_timeout: Optional[float] = None, max_workers: int = 16):
+        self.flight_timeout = flight_timeout
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._calls: Dict[Hashable, _Call] = {}
+        self._tasks: Dict[Hashable, list] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.errors = 0
+    
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        执行fn，如果已有键相同的调用在进行中则等待并共享其结果
+        
+        Args:
+            key: 请求键
+            fn: 实际发起请求的函数
+        
+        Returns:
+            fn的返回值，失败时向所有等待方抛出同一个异常
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        
+        deadline = current_deadline()
+        if leader and deadline is None:
+            # 领头调用方没有截止时间，直接在当前线程执行
+            self._lead(key, call, fn)
+        elif leader:
+            # 在线程池中执行，领头调用方和其他等待方一样只按自己的截止时间等待
+            self._get_executor().submit(contextvars.copy_context().run, self._lead, key, call, fn)
+        
+        while not call.done.wait(self._poll_interval(deadline)):
+            deadline.check()
+        if call.error is not None:
+            raise call.error
+        return call.result
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="llm-singleflight")
+            return self._executor
+    
+    def shutdown(self) -> None:
+        """关闭同步共享请求使用的线程池"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+    
+    @staticmethod
+    def _poll_interval(deadline: Optional[Deadline]) -> Optional[float]:
+        """同步等待方每次等待的秒数：不超过剩余预算，并定期醒来检查截止时间是否被取消"""
+        if deadline is None:
+            return None
+        remaining = deadline.remaining()
+        return WAIT_POLL_INTERVAL if remaining is None else min(remaining, WAIT_POLL_INTERVAL)
+    
+    def _flight_scope(self):
+        """共享请求运行时的截止时间：与调用方无关，只受flight_timeout限制"""
+        return deadline_scope(None if self.flight_timeout is None else Deadline(self.flight_timeout))
+    
+    def _lead(self, key: Hashable, call: _Call, fn: Callable[[], Any]) -> None:
+        try:
+            with self._flight_scope():
+                call.result = fn()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self.errors += 1
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+    
+    async def _detached(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        with self._flight_scope():
+            return await fn()
+    
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        do的异步版本，合并范围限定在当前事件循环内
+        
+        Args:
+            key: 请求键
+            fn: 返回协程的函数，只有领头调用会执行
+        
+        Returns:
+            协程的返回值，失败时向所有等待方抛出同一个异常
+        """
+        loop = asyncio.get_running_loop()
+        task_key = (id(loop), key)
+        with self._lock:
+            entry = self._tasks.get(task_key)
+            if entry is None:
+                task = loop.create_task(self._detached(fn))
+                entry = [task, 0]
+                self._tasks[task_key] = entry
+                task.add_done_callback(lambda t: self._finish_task(task_key, t))
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+            entry[1] += 1
+        
+        task = entry[0]
+        deadline = current_deadline()
+        try:
+            if deadline is None:
+                return await asyncio.shield(task)
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), deadline.remaining())
+            except asyncio.TimeoutError:
+                if task.done():
+                    raise
+                raise DeadlineExceeded(deadline.why()) from None
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                abandoned = entry[1] == 0 and not task.done()
+            if abandoned:
+                task.cancel()
+    
+    def _finish_task(self, task_key: Hashable, task: "asyncio.Task") -> None:
+        with self._lock:
+            if self._tasks.get(task_key, [None])[0] is task:
+                del self._tasks[task_key]
+            if not task.cancelled() and task.exception() is not None:
+                self.errors += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取合并统计：leaders为实际发出的上游请求数，coalesced为被合并掉的调用数"""
+        with self._lock:
+            total = self.leaders + self.coalesced
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "coalesce_rate": self.coalesced / total if total else 0.0,
+                "in_flight": len(self._calls) + len(self._tasks)
+            }
@@ -0,0 +1,350 @@
+"""
+本地桩LLM（stub）
+提供OpenAI兼容的本地HTTP服务，返回确定性的塔罗风格回复，并模拟延迟分布、逐token流式输出、提示缓存、错误和429限流，
+用于离线压测和CI，不消耗真实token
+
+单独运行：python -m utils.llm_stub --port 8765 --profile realistic
+应用内使用：LLM_PROVIDER=stub，未配置LLM_STUB_BASE_URL时会在进程内自动启动一个桩服务
+"""
+
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional
+
+from .tarot_cards import get_all_cards
+
+# 延迟配置：首token延迟服从中位数为ttft、对数标准差为sigma的对数正态分布，
+# 之后每个token间隔per_token秒；以tail_rate的概率出现tail_ttft秒的长尾延迟
+LATENCY_PROFILES: Dict[str, Dict[str, float]] = {
+    "instant": {"ttft": 0.0, "sigma": 0.0, "per_token": 0.0, "tail_rate": 0.0, "tail_ttft": 0.0},
+    "fast": {"ttft": 0.15, "sigma": 0.3, "per_token": 0.005, "tail_rate": 0.0, "tail_ttft": 0.0},
+    "realistic": {"ttft": 0.6, "sigma": 0.5, "per_token": 0.02, "tail_rate": 0.01, "tail_ttft": 5.0},
+    "slow": {"ttft": 2.0, "sigma": 0.6, "per_token": 0.05, "tail_rate": 0.0, "tail_ttft": 0.0},
+    "spiky": {"ttft": 0.3, "sigma": 0.3, "per_token": 0.01, "tail_rate": 0.05, "tail_ttft": 5.0},
+}
+
+# 模拟提供商的提示缓存：提示按PREFIX_CACHE_BLOCK个字符分块，与之前请求相同的最长前缀计为命中，
+# 命中部分的预填充耗时按CACHED_PREFILL_DISCOUNT折算
+PREFIX_CACHE_BLOCK = 64
+PREFIX_CACHE_SIZE = 10000
+CACHED_PREFILL_DISCOUNT = 0.5
+
+_OPENINGS = [
+    "亲爱的求问者，牌面已经为你展开。",
+    "让我们静下心来，倾听塔罗的低语。",
+    "星光落在牌阵之上，答案正在浮现。",
+    "感谢你的信任，这一次的指引很清晰。",
+]
+
+_BODIES = [
+    "{card}提醒你，眼前的变化正是成长的契机，不必急于求成。",
+    "{card}的能量显示，你内心早已有了方向，只需要再多一点勇气。",
+    "从{card}来看，过去的经历正在转化为你的力量。",
+    "{card}象征着平衡，试着在付出与接受之间找到自己的节奏。",
+    "{card}带来的讯息是：真诚沟通会化解目前的大部分困扰。",
+    "{card}指向新的可能，留意生活中那些不经意的机会。",
+]
+
+_CLOSINGS = [
+    "愿你带着这份指引，温柔而坚定地前行。✨",
+    "记住，命运的笔始终握在你自己手中。🌙",
+    "保持开放的心，美好的事情正在靠近。🌟",
+]
+
+class StubLLM:
+    """
+    桩LLM的回复生成和延迟/故障模拟
+    
+    回复内容只由请求消息决定，相同请求总是得到相同回复；延迟和故障由种子随机数发生器抽样，
+    固定种子时整个压测过程可以复现。
+    """
+    
+    def __init__(self, profile: str = "fast", error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 retry_after: float = 1.0, reply_chars: int = 240, seed: Optional[int] = None):
+        if profile not in LATENCY_PROFILES:
+            raise ValueError(f"Unknown stub profile: {profile}. Choose from: {', '.join(LATENCY_PROFILES)}")
+        self.profile = profile
+        self.latency = LATENCY_PROFILES[profile]
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.reply_chars = reply_chars
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._card_names = [card["name"] for card in get_all_cards().values()]
+        self._prefixes: "OrderedDict[str, None]" = OrderedDict()
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.cached_tokens = 0
+    
+    @classmethod
+    def from_env(cls) -> "StubLLM":
+        """按LLM_STUB_*环境变量创建"""
+        seed = os.getenv("LLM_STUB_SEED")
+        return cls(
+            profile=os.getenv("LLM_STUB_PROFILE", "fast"),
+            error_rate=float(os.getenv("LLM_STUB_ERROR_RATE", "0")),
+            rate_limit_rate=float(os.getenv("LLM_STUB_429_RATE", "0")),
+            retry_after=float(os.getenv("LLM_STUB_RETRY_AFTER", "1")),
+            reply_chars=int(os.getenv("LLM_STUB_REPLY_CHARS", "240")),
+            seed=int(seed) if seed else None
+        )
+    
+    def reply(self, messages: List[Dict[str, Any]]) -> str:
+        """
+        生成确定性的塔罗风格回复
+        
+        Args:
+            messages: OpenAI格式的消息列表
+        
+        Returns:
+            str: 回复文本，提示中提到的牌名会出现在回复里
+        """
+        prompt = "\n".join(str(m.get("content", "")) for m in messages)
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+        # 只在用户消息里找牌名，并去掉"塔罗"以免误认出"塔"
+        user_text = "\n".join(str(m.get("content", "")) for m in messages if m.get("role") != "system").replace("塔罗", "")
+        cards = [name for name in self._card_names if name in user_text] or [rng.choice(self._card_names)]
+        parts = [rng.choice(_OPENINGS)]
+        while sum(len(p) for p in parts) < self.reply_chars:
+            parts.append(rng.choice(_BODIES).format(card=cards[len(parts) % len(cards)]))
+        parts.append(rng.choice(_CLOSINGS))
+        return "".join(parts)
+    
+    def reply_json(self, messages: List[Dict[str, Any]]) -> str:
+        """
+        JSON模式的回复：按提示中出现的"键":结构生成一个JSON对象，每个键对应一段回复文本
+        """
+        prompt = str(messages[-1].get("content", "")) if messages else ""
+        keys = list(dict.fromkeys(re.findall(r'"([A-Za-z_][A-Za-z0-9_]*)"\s*:', prompt))) or ["text"]
+        payload = {key: self.reply(messages + [{"role": "user", "content": key}]) for key in keys}
+        return json.dumps(payload, ensure_ascii=False)
+    
+    def tokens(self, text: str) -> List[str]:
+        """把回复切成流式输出的token，中文大约每两个字一个token"""
+        return [text[i:i + 2] for i in range(0, len(text), 2)]
+    
+    def cached_prefix(self, messages: List[Dict[str, Any]]) -> int:
+        """
+        模拟提示缓存：返回与之前请求相同的最长前缀字符数（按块对齐），并记住本次请求的所有前缀
+        """
+        prompt = "\x1f".join(str(m.get("content", "")) for m in messages)
+        digests = []
+        hasher = hashlib.sha256()
+        for i in range(0, len(prompt) - PREFIX_CACHE_BLOCK + 1, PREFIX_CACHE_BLOCK):
+            hasher.update(prompt[i:i + PREFIX_CACHE_BLOCK].encode("utf-8"))
+            digests.append(hasher.copy().hexdigest())
+        with self._lock:
+            cached = 0
+            for digest in digests:
+                if digest not in self._prefixes:
+                    break
+                cached += PREFIX_CACHE_BLOCK
+            for digest in digests:
+                self._prefixes[digest] = None
+                self._prefixes.move_to_end(digest)
+            while len(self._prefixes) > PREFIX_CACHE_SIZE:
+                self._prefixes.popitem(last=False)
+            self.cached_tokens += cached
+            return cached
+    
+    def roll(self, cached_ratio: float = 0.0) -> Dict[str, Any]:
+        """
+        为一次请求抽样延迟和故障
+        
+        Args:
+            cached_ratio: 提示中命中提示缓存的比例，用于缩短首token延迟
+        
+        Returns:
+            Dict: status（200/429/500）和ttft（首token前等待的秒数）
+        """
+        with self._lock:
+            self.requests += 1
+            if self._rng.random() < self.latency["tail_rate"]:
+                ttft = self.latency["tail_ttft"]
+            elif self.latency["ttft"] > 0:
+                ttft = self.latency["ttft"] * math.exp(self._rng.gauss(0.0, self.latency["sigma"]))
+            else:
+                ttft = 0.0
+            ttft *= 1.0 - CACHED_PREFILL_DISCOUNT * cached_ratio
+            draw = self._rng.random()
+            if draw < self.rate_limit_rate:
+                self.rate_limited += 1
+                return {"status": 429, "ttft": 0.0}
+            if draw < self.rate_limit_rate + self.error_rate:
+                self.errors += 1
+                return {"status": 500, "ttft": ttft}
+            return {"status": 200, "ttft": ttft}
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"profile": self.profile, "requests": self.requests, "errors": self.errors,
+                    "rate_limited": self.rate_limited, "cached_tokens": self.cached_tokens}
+
+def _prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(len(str(m.get("content", ""))) for m in messages)
+
+def _usage(messages: List[Dict[str, Any]], completion: str, cached_tokens: int = 0) -> Dict[str, Any]:
+    prompt_tokens = _prompt_tokens(messages)
+    completion_tokens = math.ceil(len(completion) / 2)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": min(cached_tokens, prompt_tokens)}}
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stub: StubLLM = None
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "stub-tarot", "object": "model", "owned_by": "stub"}]})
+        else:
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+    
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+        
+        messages = body.get("messages", [])
+        cached = self.stub.cached_prefix(messages)
+        outcome = self.stub.roll(cached / max(1, _prompt_tokens(messages)))
+        time.sleep(outcome["ttft"])
+        if outcome["status"] == 429:
+            self._send_json(429, {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_error",
+                                            "code": "rate_limit_exceeded"}},
+                            {"Retry-After": str(self.stub.retry_after)})
+            return
+        if outcome["status"] != 200:
+            self._send_json(outcome["status"], {"error": {"message": "Internal error (stub)", "type": "server_error"}})
+            return
+        
+        model = body.get("model", "stub-tarot")
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            text = self.stub.reply_json(messages)
+        else:
+            text = self.stub.reply(messages)
+        # 按请求的回复token上限截断，中文大约每两个字一个token
+        limit = body.get("max_completion_tokens") or body.get("max_tokens")
+        if limit:
+            text = text[:2 * limit]
+        if body.get("stream"):
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+            self._stream(model, text, _usage(messages, text, cached) if include_usage else None)
+            return
+        time.sleep(self.stub.latency["per_token"] * len(self.stub.tokens(text)))
+        self._send_json(200, {
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": _usage(messages, text, cached)
+        })
+    
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _stream(self, model: str, text: str, usage: Optional[Dict[str, Any]]):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for event in self._events(model, text, usage):
+            data = f"data: {event}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+    
+    def _events(self, model: str, text: str, usage: Optional[Dict[str, Any]]) -> Iterator[str]:
+        chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+        for i, token in enumerate(self.stub.tokens(text)):
+            if i:
+                time.sleep(self.stub.latency["per_token"])
+            delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+            yield json.dumps({**chunk, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}, ensure_ascii=False)
+        yield json.dumps({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if usage is not None:
+            yield json.dumps({**chunk, "choices": [], "usage": usage})
+        yield "[DONE]"
+
+class StubLLMServer(ThreadingHTTPServer):
+    """OpenAI兼容的桩LLM HTTP服务"""
+    
+    daemon_threads = True
+    request_queue_size = 256
+    
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, stub: Optional[StubLLM] = None):
+        self.stub = stub or StubLLM.from_env()
+        handler = type("StubHandler", (_StubHandler,), {"stub": self.stub})
+        super().__init__((host, port), handler)
+    
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+    
+    def start(self) -> "StubLLMServer":
+        """在后台线程中运行服务"""
+        threading.Thread(target=self.serve_forever, name="llm-stub", daemon=True).start()
+        return self
+    
+    def handle_error(self, request, client_address):
+        # 压测时客户端取消请求（如对冲落败方）会断开连接，不需要打印堆栈
+        pass
+
+_server: Optional[StubLLMServer] = None
+_server_lock = threading.Lock()
+
+def ensure_stub_server() -> StubLLMServer:
+    """获取进程内共享的桩服务，首次调用时在随机端口启动"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = StubLLMServer().start()
+        return _server
+
+def main():
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="OpenAI兼容的本地桩LLM服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--profile", default=os.getenv("LLM_STUB_PROFILE", "fast"), choices=list(LATENCY_PROFILES))
+    parser.add_argument("--error-rate", type=float, default=float(os.getenv("LLM_STUB_ERROR_RATE", "0")))
+    parser.add_argument("--rate-limit-rate", type=float, default=float(os.getenv("LLM_STUB_429_RATE", "0")))
+    parser.add_argument("--retry-after", type=float, default=float(os.getenv("LLM_STUB_RETRY_AFTER", "1")))
+    parser.add_argument("--reply-chars", type=int, default=int(os.getenv("LLM_STUB_REPLY_CHARS", "240")))
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    
+    stub = StubLLM(args.profile, args.error_rate, args.rate_limit_rate, args.retry_after, args.reply_chars, args.seed)
+    server = StubLLMServer(args.host, args.port, stub)
+    print(f"Stub LLM ({args.profile}) listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
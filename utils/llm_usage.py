@@ -0,0 +1,252 @@
+"""
+LLM用量统计
+从各提供商回复的usage字段中提取提示token、回复token和命中提示缓存的token数，按提供商/模型、
+调用节点和会话汇总token、估算费用和耗时，用于确认提示缓存（prompt caching）是否真的带来了
+折扣和更低的预填充延迟，以及按步骤做容量和成本决策
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+# 各提供商默认模型的公开价格（美元/百万token）：(提示, 命中缓存的提示, 回复)
+# 价格变动或更换模型时用 LLM_PRICE_<PROVIDER>=提示,缓存提示,回复 覆盖
+DEFAULT_PRICES: Dict[str, Tuple[float, float, float]] = {
+    "openai": (0.25, 0.025, 2.0),
+    "gemini": (0.30, 0.03, 2.5),
+    "deepseek": (0.28, 0.028, 0.42),
+    "stub": (0.0, 0.0, 0.0),
+}
+
+def load_prices() -> Dict[str, Tuple[float, float, float]]:
+    """读取各提供商价格，环境变量LLM_PRICE_<PROVIDER>优先于DEFAULT_PRICES"""
+    prices = dict(DEFAULT_PRICES)
+    for provider in list(prices):
+        value = os.getenv(f"LLM_PRICE_{provider.upper()}")
+        if value:
+            prompt, cached, completion = (float(part) for part in value.split(","))
+            prices[provider] = (prompt, cached, completion)
+    return prices
+
+def _field(obj: Any, name: str) -> Any:
+    # SDK返回的是对象，cassette和桩服务中是字典
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+def extract_usage(provider: str, response: Any) -> Optional[Dict[str, int]]:
+    """
+    从提供商的回复（或流式输出的最后一个片段）中提取用量
+    
+    - OpenAI：usage.prompt_tokens_details.cached_tokens
+    - DeepSeek：usage.prompt_cache_hit_tokens
+    - Gemini：usage_metadata.cached_content_token_count
+    
+    Args:
+        provider: 提供商名称
+        response: 提供商SDK返回的回复对象
+    
+    Returns:
+        Dict: prompt_tokens、completion_tokens、cached_tokens，回复中没有用量信息时返回None
+    """
+    if provider == "gemini":
+        metadata = _field(response, "usage_metadata")
+        if metadata is None or not _field(metadata, "prompt_token_count"):
+            return None
+        return {
+            "prompt_tokens": _field(metadata, "prompt_token_count") or 0,
+            "completion_tokens": _field(metadata, "candidates_token_count") or 0,
+            "cached_tokens": _field(metadata, "cached_content_token_count") or 0
+        }
+    
+    usage = _field(response, "usage")
+    if usage is None:
+        return None
+    cached = _field(_field(usage, "prompt_tokens_details"), "cached_tokens")
+    if cached is None:
+        cached = _field(usage, "prompt_cache_hit_tokens")
+    return {
+        "prompt_tokens": _field(usage, "prompt_tokens") or 0,
+        "completion_tokens": _field(usage, "completion_tokens") or 0,
+        "cached_tokens": cached or 0
+    }
+
+class UsageScope:
+    """用量归属：调用LLM的节点、会话，以及额外累加用量的字典（通常是shared["llm_usage"]）"""
+    
+    __slots__ = ("node", "session", "sink")
+    
+    def __init__(self, node: Optional[str] = None, session: Optional[str] = None,
+                 sink: Optional[Dict[str, Any]] = None):
+        self.node = node
+        self.session = session
+        self.sink = sink
+
+_current_scope: ContextVar[Optional[UsageScope]] = ContextVar("llm_usage_scope", default=None)
+
+def current_usage_scope() -> Optional[UsageScope]:
+    """获取当前上下文的用量归属，不在usage_scope内时返回None"""
+    return _current_scope.get()
+
+@contextmanager
+def usage_scope(node: Optional[str] = None, session: Optional[str] = None,
+                sink: Optional[Dict[str, Any]] = None) -> Iterator[UsageScope]:
+    """
+    在此范围内（包括其中创建的asyncio任务）发出的LLM调用，用量计入node和session，并累加到sink
+    
+    Args:
+        node: 节点名称
+        session: 会话ID
+        sink: 额外累加用量的字典，结构为{"total": {...}, "by_node": {节点名称: {...}}}
+    """
+    scope = UsageScope(node, session, sink)
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        try:
+            _current_scope.reset(token)
+        except ValueError:
+            # 异步生成器在别的上下文中被关闭时无法还原，原上下文也随之结束
+            pass
+
+def _new_totals() -> Dict[str, Any]:
+    return {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+            "cost": 0.0, "wall_time": 0.0}
+
+def _add(totals: Dict[str, Any], usage: Optional[Dict[str, int]], latency: float, cost: float) -> None:
+    totals["requests"] += 1
+    totals["wall_time"] += latency
+    if usage is not None:
+        totals["prompt_tokens"] += usage["prompt_tokens"]
+        totals["completion_tokens"] += usage["completion_tokens"]
+        totals["cached_tokens"] += usage["cached_tokens"]
+        totals["cost"] += cost
+
+def _with_means(totals: Dict[str, Any]) -> Dict[str, Any]:
+    requests = totals["requests"]
+    return {**totals, "mean_latency": totals["wall_time"] / requests if requests else 0.0,
+            "mean_cost": totals["cost"] / requests if requests else 0.0}
+
+def _mean(bucket) -> Optional[float]:
+    count, total = bucket
+    return total / count if count else None
+
+class UsageTracker:
+    """
+    汇总LLM用量
+    
+    - 按提供商/模型：token、估算费用、耗时，以及按是否命中提示缓存分开的平均耗时和流式首片段耗时，
+      两组均值的差距就是提示缓存实际节省的预填充时间
+    - 按模型路由、按节点：token、估算费用、总耗时和每次调用的平均耗时与费用
+    - 按会话：token、估算费用和耗时，只保留最近max_sessions个会话
+    
+    Args:
+        prices: 各提供商价格（美元/百万token），见load_prices
+        max_sessions: 保留统计的会话数
+    """
+    
+    def __init__(self, prices: Optional[Dict[str, Tuple[float, float, float]]] = None, max_sessions: int = 1000):
+        self.prices = prices if prices is not None else load_prices()
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._total = _new_totals()
+        self._models: Dict[str, Dict[str, Any]] = {}
+        self._routes: Dict[str, Dict[str, Any]] = {}
+        self._nodes: Dict[str, Dict[str, Any]] = {}
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    
+    def cost(self, provider: str, usage: Optional[Dict[str, int]]) -> float:
+        """按价格表估算一次调用的费用（美元），未知提供商或没有用量时为0"""
+        if usage is None or provider not in self.prices:
+            return 0.0
+        prompt, cached, completion = self.prices[provider]
+        uncached_tokens = usage["prompt_tokens"] - usage["cached_tokens"]
+        return (uncached_tokens * prompt + usage["cached_tokens"] * cached
+                + usage["completion_tokens"] * completion) / 1_000_000
+    
+    def record(self, provider: str, model: str, usage: Optional[Dict[str, int]], latency: float,
+               ttft: Optional[float] = None, scope: Optional[UsageScope] = None,
+               route: Optional[str] = None) -> None:
+        """
+        记录一次调用
+        
+        Args:
+            provider: 提供商名称
+            model: 模型名称
+            usage: extract_usage的结果，提供商未返回用量时为None
+            latency: 请求开始到回复完成的秒数
+            ttft: 流式请求从开始到第一个片段的秒数
+            scope: 用量归属，None时只计入提供商/模型
+            route: 请求使用的模型路由名称
+        """
+        cost = self.cost(provider, usage)
+        with self._lock:
+            _add(self._total, usage, latency, cost)
+            model_totals = self._models.get(f"{provider}/{model}")
+            if model_totals is None:
+                model_totals = self._models[f"{provider}/{model}"] = {
+                    **_new_totals(), "reported": 0, "cache_hit_requests": 0,
+                    # 按是否命中提示缓存分别累计：[次数, 总秒数]
+                    "latency": {True: [0, 0.0], False: [0, 0.0]},
+                    "ttft": {True: [0, 0.0], False: [0, 0.0]}
+                }
+            _add(model_totals, usage, latency, cost)
+            if usage is not None:
+                hit = usage["cached_tokens"] > 0
+                model_totals["reported"] += 1
+                model_totals["cache_hit_requests"] += hit
+                model_totals["latency"][hit][0] += 1
+                model_totals["latency"][hit][1] += latency
+                if ttft is not None:
+                    model_totals["ttft"][hit][0] += 1
+                    model_totals["ttft"][hit][1] += ttft
+            if route is not None:
+                _add(self._routes.setdefault(route, _new_totals()), usage, latency, cost)
+            if scope is None:
+                return
+            if scope.node is not None:
+                _add(self._nodes.setdefault(scope.node, _new_totals()), usage, latency, cost)
+            if scope.session is not None:
+                session_totals = self._sessions.pop(scope.session, None) or _new_totals()
+                self._sessions[scope.session] = session_totals
+                _add(session_totals, usage, latency, cost)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            if scope.sink is not None:
+                _add(scope.sink.setdefault("total", _new_totals()), usage, latency, cost)
+                if scope.node is not None:
+                    by_node = scope.sink.setdefault("by_node", {})
+                    _add(by_node.setdefault(scope.node, _new_totals()), usage, latency, cost)
+    
+    def session_stats(self, session: str) -> Optional[Dict[str, Any]]:
+        """获取单个会话的用量，没有记录时返回None"""
+        with self._lock:
+            totals = self._sessions.get(session)
+            return dict(totals) if totals is not None else None
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取总用量、按提供商/模型、按模型路由和按节点的用量，以及有记录的会话数（单个会话见session_stats）"""
+        with self._lock:
+            models = {}
+            for name, totals in self._models.items():
+                models[name] = {
+                    **{key: value for key, value in totals.items() if key not in ("latency", "ttft")},
+                    "cached_ratio": totals["cached_tokens"] / totals["prompt_tokens"] if totals["prompt_tokens"] else 0.0,
+                    "latency_cached": _mean(totals["latency"][True]),
+                    "latency_uncached": _mean(totals["latency"][False]),
+                    "ttft_cached": _mean(totals["ttft"][True]),
+                    "ttft_uncached": _mean(totals["ttft"][False])
+                }
+            return {
+                "total": dict(self._total),
+                "models": models,
+                "routes": {name: _with_means(totals) for name, totals in self._routes.items()},
+                "nodes": {name: _with_means(totals) for name, totals in self._nodes.items()},
+                "sessions": len(self._sessions)
+            }
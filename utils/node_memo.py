@@ -0,0 +1,53 @@
+"""
+节点结果记忆
+exec只取决于prep结果中部分字段的节点（主题菜单、牌阵菜单）声明memoize = True后，
+exec的结果按这些字段的摘要缓存，同样的输入不再重复执行
+"""
+
+import os
+from typing import Any, Dict, Optional
+
+from macore import MemoCache, DiskMemoCache
+
+def memo_from_env() -> Optional[MemoCache]:
+    """
+    按环境变量创建节点记忆缓存
+    
+    - NODE_MEMO_BACKEND：memory（进程内，默认）、disk（SQLite文件，进程间共享、重启后保留）或none（关闭）
+    - NODE_MEMO_MAX_SIZE：最多保存的条目数
+    - NODE_MEMO_TTL：条目过期秒数，0表示不过期
+    - NODE_MEMO_PATH：disk后端的文件路径
+    """
+    backend = os.getenv("NODE_MEMO_BACKEND", "memory").strip().lower()
+    max_size = int(os.getenv("NODE_MEMO_MAX_SIZE", "256"))
+    ttl = float(os.getenv("NODE_MEMO_TTL", "600")) or None
+    if backend in ("", "none"):
+        return None
+    if backend == "memory":
+        return MemoCache(max_size, ttl)
+    if backend == "disk":
+        return DiskMemoCache(os.getenv("NODE_MEMO_PATH", ".node_memo.sqlite3"), max_size, ttl)
+    raise ValueError(f"Unknown NODE_MEMO_BACKEND: {backend}. Choose from: memory, disk, none")
+
+_memo = memo_from_env()
+
+def get_node_memo() -> Optional[MemoCache]:
+    """获取声明了memoize的节点使用的缓存，None表示不记忆"""
+    return _memo
+
+def set_node_memo(memo: Optional[MemoCache]) -> None:
+    """
+    替换节点记忆缓存
+    
+    Args:
+        memo: MemoCache、DiskMemoCache或任何实现了get/put/stats的对象，None表示不记忆
+    """
+    global _memo
+    _memo = memo
+
+def get_node_memo_stats() -> Dict[str, Any]:
+    """获取节点记忆缓存的命中统计"""
+    memo = _memo
+    if memo is None:
+        return {"enabled": False}
+    return {"enabled": True, **memo.stats()}
@@ -0,0 +1,190 @@
+"""
+本地回复模板
+主题菜单、牌阵菜单、选择确认和输入校验错误这类不需要创造性的回复，用预编译的模板库在本地渲染，
+每个步骤有多种措辞随机选用，不调用LLM
+"""
+
+import os
+import random
+import string
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .tarot_cards import get_topics, get_spreads
+
+# 每个步骤的模板，占位符为固定字段（渲染前由tarot_cards.py的数据填好）或该步骤的动态字段
+TEMPLATE_BANKS: Dict[str, List[str]] = {
+    "topic_menu": [
+        "✨ 想让塔罗为你照亮哪个方面呢？从下面的主题里选一个吧：\n{topic_menu}\n选好告诉我，我们马上开始~",
+        "🔮 每个主题都藏着不同的指引，挑一个你现在最关心的：\n{topic_menu}\n凭第一直觉选就好哦！",
+        "🌟 先来定个占卜主题～这里有{topic_count}个方向：\n{topic_menu}\n哪一个最让你心动？",
+    ],
+    "spread_menu": [
+        "{topic_emoji} {topic_name}主题已就位！接下来选一个牌阵吧：\n{spread_menu}\n想快速看看就选单张牌，想了解来龙去脉就选三张牌～",
+        "好的，就从{topic_name}开始 {topic_emoji} 现在请选择牌阵：\n{spread_menu}\n不同的牌阵会从不同的角度回答你的问题✨",
+        "{topic_emoji} 收到！关于{topic_name}，我准备了{spread_count}种牌阵：\n{spread_menu}\n选一个你喜欢的吧🌙",
+    ],
+    "topic_confirmed": [
+        "{topic_emoji} 好眼光！这次我们来看看{topic_name}：{topic_description}。接下来选一个牌阵吧~",
+        "收到～{topic_emoji} {topic_name}主题已确认！塔罗会为你带来{topic_description}的指引，下一步选择牌阵✨",
+        "{topic_emoji} {topic_name}，就它了！放轻松，我们一起看看牌面想告诉你什么。先来选个牌阵吧🌟",
+    ],
+    "spread_confirmed": [
+        "🔮 {spread_name}牌阵已准备好！{spread_description}。深呼吸，在心里默念你的问题，准备抽牌吧~",
+        "✨ 选择了{spread_name}，将抽取{card_count}张牌（{positions}）。放松肩膀，集中注意力，我们开始抽牌🌙",
+        "🌟 好的，{spread_name}！{spread_description}。闭上眼睛想一想你最在意的事，准备好就抽牌吧~",
+    ],
+    "invalid_topic": [
+        "😅 没找到「{selected}」这个主题呢，请从这些里面选一个：\n{topic_menu}",
+        "哎呀，「{selected}」不在我的主题列表里🔮 可以选的有：\n{topic_menu}",
+    ],
+    "invalid_spread": [
+        "😅 没找到「{selected}」这个牌阵呢，请从这些里面选一个：\n{spread_menu}",
+        "哎呀，「{selected}」不是我会用的牌阵🔮 可以选的有：\n{spread_menu}",
+    ],
+}
+
+# 各步骤渲染时需要传入的动态字段
+STEP_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "topic_menu": (),
+    "spread_menu": ("topic_name", "topic_emoji"),
+    "topic_confirmed": ("topic_name", "topic_emoji", "topic_description"),
+    "spread_confirmed": ("spread_name", "spread_description", "card_count", "positions"),
+    "invalid_topic": ("selected",),
+    "invalid_spread": ("selected",),
+}
+
+TEMPLATE_STEPS = tuple(TEMPLATE_BANKS)
+
+def static_fields() -> Dict[str, Any]:
+    """由tarot_cards.py的数据生成的固定字段：主题菜单、牌阵菜单及其数量"""
+    topics = get_topics()
+    spreads = get_spreads()
+    return {
+        "topic_menu": "\n".join(f"{i + 1}. {topic['emoji']} {topic['name']} - {topic['description']}"
+                                for i, topic in enumerate(topics.values())),
+        "topic_count": len(topics),
+        "spread_menu": "\n".join(f"{i + 1}. {spread['name']} - {spread['description']}"
+                                 for i, spread in enumerate(spreads.values())),
+        "spread_count": len(spreads),
+    }
+
+def _compile(template: str, fixed: Dict[str, Any], fields: Tuple[str, ...]) -> List[Tuple[bool, str]]:
+    """把模板编译为片段列表：(False, 文本)直接输出，(True, 字段名)渲染时取动态字段"""
+    pieces: List[Tuple[bool, str]] = []
+    for literal, field, spec, conversion in string.Formatter().parse(template):
+        text = literal
+        if field is not None:
+            if spec or conversion:
+                raise ValueError(f"Format specs are not supported in response templates: {template!r}")
+            if field in fixed:
+                text += str(fixed[field])
+            elif field not in fields:
+                raise ValueError(f"Unknown field {field!r} in response template: {template!r}")
+        if text:
+            if pieces and not pieces[-1][0]:
+                pieces[-1] = (False, pieces[-1][1] + text)
+            else:
+                pieces.append((False, text))
+        if field is not None and field not in fixed:
+            pieces.append((True, field))
+    return pieces
+
+class TemplateEngine:
+    """
+    本地回复引擎
+    
+    创建时把所有模板编译好：固定字段直接代入，动态字段和未知占位符在这时就会报错，
+    渲染只剩随机选一个模板和拼接字符串。
+    
+    Args:
+        steps: 使用模板的步骤，None表示全部步骤
+        banks: 步骤到模板列表的映射，默认TEMPLATE_BANKS
+        seed: 随机选择模板的种子，固定后措辞可复现
+    """
+    
+    def __init__(self, steps: Optional[List[str]] = None, banks: Optional[Dict[str, List[str]]] = None,
+                 seed: Optional[int] = None):
+        banks = banks or TEMPLATE_BANKS
+        fixed = static_fields()
+        unknown = set(steps or ()) - set(banks)
+        if unknown:
+            raise ValueError(f"Unknown template steps: {sorted(unknown)}. Choose from: {', '.join(banks)}")
+        self.steps = set(banks) if steps is None else set(steps)
+        self._banks = {
+            step: [_compile(template, fixed, STEP_FIELDS.get(step, ())) for template in templates]
+            for step, templates in banks.items()
+        }
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._rendered: Dict[str, int] = {}
+        self._render_seconds = 0.0
+    
+    def enabled(self, step: str) -> bool:
+        """步骤是否配置为使用模板"""
+        return step in self.steps
+    
+    def render(self, step: str, **fields) -> str:
+        """
+        随机选一个模板渲染回复
+        
+        Args:
+            step: 步骤名称
+            **fields: 该步骤的动态字段
+        
+        Returns:
+            str: 回复文本
+        """
+        start = time.perf_counter()
+        with self._lock:
+            pieces = self._rng.choice(self._banks[step])
+        text = "".join(str(fields[value]) if is_field else value for is_field, value in pieces)
+        with self._lock:
+            self._rendered[step] = self._rendered.get(step, 0) + 1
+            self._render_seconds += time.perf_counter() - start
+        return text
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取启用的步骤、各步骤的渲染次数和平均渲染耗时"""
+        with self._lock:
+            total = sum(self._rendered.values())
+            return {
+                "steps": sorted(self.steps),
+                "rendered": dict(self._rendered),
+                "mean_render_seconds": self._render_seconds / total if total else 0.0
+            }
+
+def engine_from_env() -> Optional[TemplateEngine]:
+    """
+    按RESPONSE_TEMPLATE_STEPS创建引擎：all表示全部步骤，none或空表示不使用模板，也可以是逗号分隔的步骤名
+    """
+    value = os.getenv("RESPONSE_TEMPLATE_STEPS", "all").strip().lower()
+    if value in ("", "none"):
+        return None
+    if value == "all":
+        return TemplateEngine()
+    return TemplateEngine([step.strip() for step in value.split(",") if step.strip()])
+
+_engine = engine_from_env()
+
+def get_template_engine() -> Optional[TemplateEngine]:
+    """获取当前的本地回复引擎，None表示所有步骤都调用LLM"""
+    return _engine
+
+def set_template_engine(engine: Optional[TemplateEngine]) -> None:
+    """
+    替换本地回复引擎
+    
+    Args:
+        engine: TemplateEngine实例，None表示所有步骤都调用LLM
+    """
+    global _engine
+    _engine = engine
+
+def get_template_stats() -> Dict[str, Any]:
+    """获取本地回复模板的使用统计"""
+    engine = _engine
+    if engine is None:
+        return {"enabled": False}
+    return {"enabled": True, **engine.stats()}
@@ -0,0 +1,144 @@
+"""
+投机执行（speculative execution）
+在用户真正请求之前于后台预先生成LLM回复，请求到达时直接使用已完成的结果或接着等待/流式读取
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+class SpeculationStats:
+    """投机执行统计：被使用、提示不一致、被丢弃的次数，以及估算节省的等待时间"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.hits = 0
+        self.ready_hits = 0
+        self.mismatches = 0
+        self.failures = 0
+        self.discarded = 0
+        self.saved_seconds = 0.0
+    
+    def record(self, field: str, saved: float = 0.0) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+            self.saved_seconds += saved
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "started": self.started,
+                "hits": self.hits,
+                "ready_hits": self.ready_hits,
+                "mismatches": self.mismatches,
+                "failures": self.failures,
+                "discarded": self.discarded,
+                "hit_rate": self.hits / self.started if self.started else 0.0,
+                "saved_seconds": self.saved_seconds
+            }
+
+# 进程级共享的投机执行统计
+speculation_stats = SpeculationStats()
+
+class SpeculationDiscarded(Exception):
+    """预生成在完成前被放弃，正在等待它的消费方改为实时生成"""
+
+class SpeculativeResult:
+    """
+    一次投机生成的结果缓冲
+    
+    生产方先设置prompt，再逐段push文本，最后finish；消费方可以在任意时刻接入：
+    stream()先补发已生成的片段再跟随后续片段，result()等待完整文本。
+    只能在创建它的事件循环中使用。
+    """
+    
+    def __init__(self):
+        self.prompt: Optional[str] = None
+        self.chunks: List[str] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.task: Optional["asyncio.Task"] = None
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+        self.consumed = False
+        self._changed = asyncio.Event()
+        speculation_stats.record("started")
+    
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+    
+    def begin(self, prompt: str) -> None:
+        """生产方：记录实际发送的提示"""
+        self.prompt = prompt
+        self._notify()
+    
+    def push(self, chunk: str) -> None:
+        """生产方：追加一个文本片段"""
+        self.chunks.append(chunk)
+        self._notify()
+    
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """生产方：标记生成结束，error不为None表示失败"""
+        if self.done:
+            return
+        self.error = error
+        self.done = True
+        self.finished_at = time.perf_counter()
+        self._notify()
+    
+    async def matches(self, prompt: str) -> bool:
+        """
+        消费方：判断预生成结果能否代替本次请求
+        
+        必要时等待生产方确定提示；提示与本次请求不同或生成在开始前就失败时返回False。
+        匹配时把结果标记为已使用，并计入节省的等待时间。
+        """
+        while self.prompt is None and not self.done:
+            await self._changed.wait()
+        if self.prompt != prompt:
+            speculation_stats.record("mismatches")
+            return False
+        if self.error is not None and not self.chunks:
+            speculation_stats.record("failures")
+            return False
+        self.consumed = True
+        elapsed = time.perf_counter() - self.started_at
+        if self.done:
+            speculation_stats.record("ready_hits", self.finished_at - self.started_at)
+            speculation_stats.record("hits")
+        else:
+            speculation_stats.record("hits", elapsed)
+        return True
+    
+    async def stream(self) -> AsyncIterator[str]:
+        """消费方：产出已生成和之后生成的所有片段，生成失败时抛出同一个异常"""
+        i = 0
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+    
+    async def result(self) -> str:
+        """消费方：等待并返回完整文本"""
+        return "".join([chunk async for chunk in self.stream()])
+    
+    def cancel(self) -> None:
+        """
+        放弃预生成，未被使用的结果计入discarded
+        
+        只有生产任务收到CancelledError；正在stream()/result()中等待的消费方收到SpeculationDiscarded。
+        """
+        if not self.consumed:
+            speculation_stats.record("discarded")
+            self.consumed = True
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        self.finish(SpeculationDiscarded("预生成已被放弃"))